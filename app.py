@@ -1,30 +1,51 @@
-from flask import Flask, render_template, request, send_file, jsonify
+import time
+_inicio_importacion = time.perf_counter()  # Para informar cuánto tarda en importarse la aplicación
+
+from flask import Flask, Request, render_template, request, send_file, jsonify, Response, stream_with_context, g
 import openpyxl
 from datetime import datetime
 import os
+import io
+import json
 import base64
+import zipfile
+import atexit
+import hashlib
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from concurrent.futures.process import BrokenProcessPool
 from io import BytesIO
-from weasyprint import HTML, CSS
+import itertools
+import re
 import tempfile
+import uuid
+import zlib
+import logging
+import sqlite3
+import pathlib
+import bisect
+import math
+import sys
+import array
+import importlib
+import importlib.util
+import csv
+import codecs
+from contextlib import contextmanager
+from abc import ABC, abstractmethod
 
-# Importaciones para ReportLab (alternativa más compatible)
-try:
-    from reportlab.pdfgen import canvas
-    from reportlab.lib.pagesizes import A4
-    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-    from reportlab.lib import colors
-    from reportlab.lib.units import inch
-    REPORTLAB_AVAILABLE = True
-except ImportError:
-    REPORTLAB_AVAILABLE = False
+# NumPy es opcional: acelera las estadísticas de una carga (sin él se calculan con listas).
+# Solo se comprueba que esté instalado; se importa con importar_numpy al calcular las primeras estadísticas
+NUMPY_AVAILABLE = importlib.util.find_spec('numpy') is not None
+np = None
 
-# Importaciones para pdfkit (alternativa con wkhtmltopdf)
+# xlrd es opcional: lee los libros de Excel 97-2003 (.xls), que openpyxl no soporta
 try:
-    import pdfkit
-    PDFKIT_AVAILABLE = True
+    import xlrd
+    XLRD_AVAILABLE = True
 except ImportError:
-    PDFKIT_AVAILABLE = False
+    XLRD_AVAILABLE = False
 
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max
@@ -33,43 +54,462 @@ app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max
 UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', 'uploads')
 OUTPUT_FOLDER = os.environ.get('OUTPUT_FOLDER', 'output')
 
+# Pool de procesos para generar PDFs (0 = generar en el mismo proceso) y tiempo máximo por PDF
+PDF_POOL_SIZE = int(os.environ.get('PDF_POOL_SIZE', '2'))
+PDF_JOB_TIMEOUT = float(os.environ.get('PDF_JOB_TIMEOUT', '60'))
+
+# Caché de PDFs generados (MB en memoria por worker y MB en disco dentro de OUTPUT_FOLDER)
+PDF_CACHE_MEMORIA_MB = int(os.environ.get('PDF_CACHE_MEMORIA_MB', '16'))
+PDF_CACHE_DISCO_MB = int(os.environ.get('PDF_CACHE_DISCO_MB', '200'))
+
+# Circuit breaker de backends PDF: fallos seguidos para dejar de usar un backend y segundos hasta reintentarlo
+PDF_BREAKER_FALLOS = int(os.environ.get('PDF_BREAKER_FALLOS', '3'))
+PDF_BREAKER_ESPERA = float(os.environ.get('PDF_BREAKER_ESPERA', '300'))
+
+# PDF consolidado: evaluaciones máximas para renderizarlo como un solo HTML (más allá se usa
+# ReportLab, con memoria acotada) y tiempo máximo de generación
+PDF_CONSOLIDADO_MAX_HTML = int(os.environ.get('PDF_CONSOLIDADO_MAX_HTML', '100'))
+# Motivo con que se reporta un backend HTML que no se intentó por el tamaño del consolidado
+OMITIDO_POR_TAMANO = 'demasiadas evaluaciones para HTML'
+PDF_CONSOLIDADO_TIMEOUT = float(os.environ.get('PDF_CONSOLIDADO_TIMEOUT', '100'))
+
+# Almacén compartido de cargas procesadas (SQLite) y horas que se conservan
+CARGAS_DB_PATH = os.environ.get('CARGAS_DB_PATH', os.path.join(OUTPUT_FOLDER, 'cargas.sqlite3'))
+CARGAS_TTL_HORAS = float(os.environ.get('CARGAS_TTL_HORAS', '12'))
+
+# Cargas asíncronas: procesamientos simultáneos por worker, evaluaciones por lote guardado,
+# segundos sin avance para dar una carga por interrumpida y duración máxima de cada conexión SSE
+CARGAS_TRABAJOS = int(os.environ.get('CARGAS_TRABAJOS', '2'))
+CARGAS_LOTE = int(os.environ.get('CARGAS_LOTE', '200'))
+CARGAS_INACTIVIDAD = float(os.environ.get('CARGAS_INACTIVIDAD', '120'))
+CARGAS_SSE_SEGUNDOS = float(os.environ.get('CARGAS_SSE_SEGUNDOS', '60'))
+
+# Procesos para leer en paralelo las hojas de una carga (0 = leerlas una tras otra en el mismo proceso)
+CARGAS_PROCESOS = int(os.environ.get('CARGAS_PROCESOS', '4'))
+
+# MB de cada archivo subido que se mantienen en memoria; uno más grande pasa a un archivo
+# temporal con nombre único en UPLOAD_FOLDER
+CARGAS_MEMORIA_MB = float(os.environ.get('CARGAS_MEMORIA_MB', '8'))
+
+# Evaluaciones por página en la consulta de una carga (por defecto y máximo)
+CONSULTA_POR_PAGINA = int(os.environ.get('CONSULTA_POR_PAGINA', '50'))
+CONSULTA_MAX_POR_PAGINA = int(os.environ.get('CONSULTA_MAX_POR_PAGINA', '500'))
+
+# Nivel del registro (DEBUG, INFO, WARNING, ERROR) y cada cuántas filas se registra en DEBUG el
+# detalle de extracción de una fila (1 = todas)
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_MUESTREO_FILAS = max(int(os.environ.get('LOG_MUESTREO_FILAS', '100')), 1)
+
+# Carpeta donde cada proceso deja sus métricas para sumarlas en /metrics ('' = solo las del worker)
+METRICAS_DIR = os.environ.get('METRICAS_DIR', os.path.join(OUTPUT_FOLDER, 'metricas'))
+
+# Precalentar al importar: sondear los backends de PDF y generar un reporte de prueba. Con
+# `gunicorn --preload` se hace una vez en el proceso maestro y los workers lo heredan
+PRECALENTAR = os.environ.get('PRECALENTAR', '').lower() in ('1', 'true')
+
 # Crear carpetas si no existen
 for folder in [UPLOAD_FOLDER, OUTPUT_FOLDER]:
     if not os.path.exists(folder):
         os.makedirs(folder)
 
-# Variables globales para almacenar datos
-evaluaciones_data = []
+logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s %(levelname)s [%(process)d] %(name)s: %(message)s')
+log = logging.getLogger('novaderma')
 
-def get_logo_base64():
-    """Convierte el logo a base64 para embebido en PDF"""
-    logo_path = os.path.join('static', 'logo.png')
-    try:
-        if os.path.exists(logo_path):
-            with open(logo_path, 'rb') as f:
-                logo_data = f.read()
-                base64_data = base64.b64encode(logo_data).decode('utf-8')
-                print(f"Logo cargado exitosamente. Tamaño: {len(logo_data)} bytes")
-                return base64_data
+def con_traza():
+    """exc_info para log.error: la traza completa solo se registra en nivel DEBUG"""
+    return log.isEnabledFor(logging.DEBUG)
+
+# Tiempos de arranque del proceso en ms (importación, renderizadores, precalentamiento y
+# primera petición), informados en el log y en /estado-pdf
+tiempos_arranque = {'renderizadores': {}}
+
+def importar_renderizador(modulo):
+    """Importa el módulo de un renderizador de PDF la primera vez que se usa.
+    
+    WeasyPrint carga cairo, pango y fontconfig al importarse, y ReportLab también tarda;
+    importarlos recién al generar el primer PDF hace que los workers arranquen sin ellos.
+    """
+    nuevo = modulo not in sys.modules
+    inicio = time.perf_counter()
+    cargado = importlib.import_module(modulo)
+    if nuevo:
+        ms = round((time.perf_counter() - inicio) * 1000, 1)
+        tiempos_arranque['renderizadores'][modulo] = ms
+        log.info("Renderizador %s importado en %.0f ms", modulo, ms)
+    return cargado
+
+def importar_numpy():
+    """Importa NumPy la primera vez que se calculan estadísticas y retorna si se puede usar.
+    
+    Solo lo usa /estadisticas, así que la aplicación no lo importa al cargarse. openpyxl,
+    en cambio, sí lo importa por su cuenta cuando está instalado.
+    """
+    global np, NUMPY_AVAILABLE
+    if NUMPY_AVAILABLE and np is None:
+        inicio = time.perf_counter()
+        try:
+            np = importlib.import_module('numpy')
+        except ImportError as e:
+            log.warning("NumPy no se pudo importar, las estadísticas se calculan sin él: %s", e)
+            NUMPY_AVAILABLE = False
         else:
-            print(f"Logo no encontrado en: {logo_path}")
+            log.info("NumPy importado en %.0f ms", (time.perf_counter() - inicio) * 1000)
+    return NUMPY_AVAILABLE
+
+# Métricas expuestas en /metrics: nombre -> (tipo, descripción, límites de los buckets si es histograma)
+DEFINICION_METRICAS = {
+    'novaderma_carga_bytes': ('histogram', 'Tamaño de los archivos de cada carga en bytes',
+                              (1e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6, 1e7, 1.6e7)),
+    'novaderma_carga_filas': ('histogram', 'Evaluaciones extraídas por carga',
+                              (10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000)),
+    'novaderma_lectura_segundos': ('histogram', 'Tiempo de lectura de una carga completa',
+                                   (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)),
+    'novaderma_encabezados_segundos': ('histogram', 'Tiempo de detección del tipo y resolución de columnas por hoja',
+                                       (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)),
+    'novaderma_render_segundos': ('histogram', 'Tiempo de generación de un PDF por backend',
+                                  (0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)),
+    'novaderma_pdf_bytes': ('histogram', 'Tamaño de cada PDF entregado en bytes',
+                            (1e4, 2e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 5e6, 2.5e7, 1e8)),
+    'novaderma_cache_pdf_total': ('counter', 'Consultas a la caché de PDFs por resultado', None),
+    'novaderma_backend_fallos_total': ('counter', 'PDFs que un backend no pudo generar', None),
+    'novaderma_errores_total': ('counter', 'Errores por etapa', None),
+}
+
+def proceso_vivo(pid):
+    """Indica si el proceso `pid` sigue en ejecución"""
+    if os.name == 'nt':
+        # En Windows os.kill(pid, 0) no consulta el proceso sino que le envía CTRL_C_EVENT
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        proceso = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not proceso:
+            return False
+        codigo = ctypes.c_ulong()
+        try:
+            kernel32.GetExitCodeProcess(proceso, ctypes.byref(codigo))
+        finally:
+            kernel32.CloseHandle(proceso)
+        return codigo.value == 259  # STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # Existe, pero es de otro usuario
+    return True
+
+class RegistroMetricas:
+    """Contadores e histogramas en memoria, expuestos en el formato de texto de Prometheus.
+    
+    Cada proceso (workers de gunicorn y procesos de los pools) guarda sus valores en su
+    propio archivo dentro de `carpeta`, como mucho una vez por segundo o al terminar un
+    trabajo del pool; texto() suma los archivos de todos los procesos, así cualquier worker
+    responde /metrics con los totales del servicio. Los archivos de procesos que ya
+    terminaron (de este arranque o de despliegues anteriores) se borran al iniciar el
+    registro y en cada consulta: sus valores dejan de sumarse, como al reiniciar un proceso.
+    """
+    
+    def __init__(self, definiciones, carpeta):
+        self.definiciones = definiciones
+        self.carpeta = carpeta
+        self._lock = threading.Lock()
+        self._reiniciar()
+        # Un proceso hijo (fork) no debe volver a contar los valores del padre
+        os.register_at_fork(after_in_child=self._reiniciar)
+        if carpeta:
+            os.makedirs(carpeta, exist_ok=True)
+            self.limpiar()
+    
+    def _reiniciar(self):
+        self._lock = threading.Lock()
+        self._valores = {}
+        self._archivo = f"{os.getpid()}_{uuid.uuid4().hex[:8]}.json"
+        self._ultimo_guardado = 0.0
+    
+    def incrementar(self, nombre, valor=1, **etiquetas):
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + valor
+        self.guardar(forzar=False)
+    
+    def observar(self, nombre, valor, **etiquetas):
+        """Registra un valor en un histograma"""
+        limites = self.definiciones[nombre][2]
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            # Cuenta por bucket (el último es +Inf), suma y cantidad de observaciones
+            datos = self._valores.get(clave)
+            if datos is None:
+                datos = self._valores[clave] = [0] * (len(limites) + 1) + [0.0, 0]
+            datos[bisect.bisect_left(limites, valor)] += 1
+            datos[-2] += valor
+            datos[-1] += 1
+        self.guardar(forzar=False)
+    
+    @contextmanager
+    def cronometrar(self, nombre, **etiquetas):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(nombre, time.perf_counter() - inicio, **etiquetas)
+    
+    def _vigente(self, entrada):
+        """Indica si el archivo de métricas es de un proceso en ejecución; si no, lo borra"""
+        pid = entrada.name.split('_', 1)[0]
+        if not pid.isdigit() or proceso_vivo(int(pid)):
+            return True
+        try:
+            os.remove(entrada.path)
+        except OSError:
+            pass
+        return False
+    
+    def limpiar(self):
+        """Borra los archivos de métricas de los procesos que ya terminaron"""
+        try:
+            for entrada in os.scandir(self.carpeta):
+                if entrada.name.endswith('.json'):
+                    self._vigente(entrada)
+        except OSError as e:
+            log.warning("No se pudieron limpiar las métricas: %s", e)
+    
+    def guardar(self, forzar=True):
+        """Escribe los valores del proceso en su archivo (sin `forzar`, como mucho una vez por segundo)"""
+        if not self.carpeta or (not forzar and time.monotonic() - self._ultimo_guardado < 1):
+            return
+        with self._lock:
+            self._ultimo_guardado = time.monotonic()
+            datos = [[nombre, etiquetas, valor] for (nombre, etiquetas), valor in self._valores.items()]
+        try:
+            # Escritura atómica: /metrics nunca lee un archivo a medio escribir
+            fd, temporal = tempfile.mkstemp(dir=self.carpeta, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(datos, f)
+            os.replace(temporal, os.path.join(self.carpeta, self._archivo))
+        except OSError as e:
+            log.warning("No se pudieron guardar las métricas: %s", e)
+    
+    def _sumar_procesos(self):
+        if not self.carpeta:
+            with self._lock:
+                return {clave: list(valor) if isinstance(valor, list) else valor
+                        for clave, valor in self._valores.items()}
+        self.guardar()
+        total = {}
+        for entrada in os.scandir(self.carpeta):
+            if not entrada.name.endswith('.json') or not self._vigente(entrada):
+                continue
+            try:
+                with open(entrada.path) as f:
+                    datos = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for nombre, etiquetas, valor in datos:
+                if nombre not in self.definiciones:
+                    continue
+                clave = (nombre, tuple(tuple(par) for par in etiquetas))
+                if isinstance(valor, list):
+                    acumulado = total.setdefault(clave, [0] * len(valor))
+                    if len(acumulado) == len(valor):  # Se ignoran archivos con otros buckets
+                        total[clave] = [a + v for a, v in zip(acumulado, valor)]
+                else:
+                    total[clave] = total.get(clave, 0) + valor
+        return total
+    
+    def texto(self):
+        """Métricas de todos los procesos en el formato de texto de Prometheus"""
+        def formatear_etiquetas(etiquetas):
+            if not etiquetas:
+                return ''
+            pares = []
+            for nombre, valor in etiquetas:
+                valor = str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+                pares.append(f'{nombre}="{valor}"')
+            return '{' + ','.join(pares) + '}'
+        
+        valores = self._sumar_procesos()
+        lineas = []
+        for nombre, (tipo, ayuda, limites) in self.definiciones.items():
+            lineas.append(f'# HELP {nombre} {ayuda}')
+            lineas.append(f'# TYPE {nombre} {tipo}')
+            for (metrica, etiquetas), valor in sorted(valores.items()):
+                if metrica != nombre:
+                    continue
+                if tipo == 'counter':
+                    lineas.append(f'{nombre}{formatear_etiquetas(etiquetas)} {valor:g}')
+                    continue
+                acumulado = 0
+                for limite, cuenta in zip(list(limites) + ['+Inf'], valor[:-2]):
+                    acumulado += cuenta
+                    le = limite if isinstance(limite, str) else f'{limite:g}'
+                    lineas.append(f'{nombre}_bucket{formatear_etiquetas(etiquetas + (("le", le),))} {acumulado}')
+                lineas.append(f'{nombre}_sum{formatear_etiquetas(etiquetas)} {valor[-2]:g}')
+                lineas.append(f'{nombre}_count{formatear_etiquetas(etiquetas)} {valor[-1]}')
+        return '\n'.join(lineas) + '\n'
+
+metricas = RegistroMetricas(DEFINICION_METRICAS, METRICAS_DIR)
+atexit.register(metricas.guardar)
+
+# Filas de datos que se examinan para decidir si una columna contiene texto
+MUESTRA_FILAS_TEXTO = 10
+
+class RecursosRender:
+    """Registro de recursos estáticos del render (logo, CSS y fuentes), cargados una vez por proceso.
+    
+    Los recursos que vienen de un archivo se vuelven a cargar solo cuando cambia su fecha
+    de modificación, así que reemplazar el logo o el CSS no requiere reiniciar el servidor.
+    """
+    
+    # Altura máxima del logo en los reportes en puntos (45 en ReportLab; 50px = 37.5pt en el CSS)
+    # y resolución con que se incrusta: 3 píxeles por punto (216 ppp)
+    LOGO_ALTO_PUNTOS = 45
+    PIXELES_POR_PUNTO = 3
+    
+    def __init__(self, logo_path, css_path):
+        self.logo_path = logo_path
+        self.css_path = css_path
+        self._cargados = {}
+        self._font_config = None
+        self._estilos_reportlab = None
+        self._plantilla_reportlab = None
+        self._lock = threading.Lock()
+    
+    def _obtener(self, nombre, ruta, cargar, por_defecto):
+        """Retorna el recurso cargado desde ruta, recargándolo si el archivo cambió"""
+        try:
+            stat = os.stat(ruta)
+            firma = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            firma = None
+        
+        with self._lock:
+            guardado = self._cargados.get(nombre)
+            if guardado is not None and guardado[0] == firma:
+                return guardado[1]
+            
+            valor = por_defecto
+            if firma is not None:
+                try:
+                    valor = cargar(ruta)
+                except Exception as e:
+                    log.warning("Error al cargar %s: %s", ruta, e)
+            self._cargados[nombre] = (firma, valor)
+            return valor
+    
+    def _reducir_logo(self, ruta):
+        with open(ruta, 'rb') as f:
+            original = f.read()
+        try:
+            from PIL import Image as ImagenPIL
+        except ImportError:
+            return original
+        with ImagenPIL.open(BytesIO(original)) as imagen:
+            imagen = imagen.convert('RGBA')
+        alto = round(self.LOGO_ALTO_PUNTOS * self.PIXELES_POR_PUNTO)
+        if imagen.height > alto:
+            imagen = imagen.resize((round(imagen.width * alto / imagen.height), alto), ImagenPIL.LANCZOS)
+        # Sobre el fondo blanco del reporte: sin canal alfa, que el PDF guarda como una segunda imagen
+        imagen = ImagenPIL.alpha_composite(ImagenPIL.new('RGBA', imagen.size, 'white'), imagen).convert('RGB')
+        rojo, verde, azul = imagen.split()
+        if rojo.tobytes() == verde.tobytes() == azul.tobytes():
+            imagen = rojo  # Logo sin color: un solo canal, la tercera parte de los datos
+        buffer = BytesIO()
+        imagen.save(buffer, format='PNG', optimize=True)
+        log.debug("Logo reducido: %d -> %d bytes", len(original), buffer.tell())
+        return buffer.getvalue()
+    
+    def logo_reducido(self):
+        """Logo en PNG al tamaño con que aparece en los reportes (b'' si no existe).
+        
+        El original (800x400) pesaba más que todo el resto de un PDF. Se reduce una vez a
+        PIXELES_POR_PUNTO píxeles por punto de su altura en el reporte, y todos los backends
+        incrustan esta versión.
+        """
+        return self._obtener('logo_reducido', self.logo_path, self._reducir_logo, b'')
+    
+    def logo_base64(self):
+        """Logo reducido en base64 para embeber en el HTML del reporte ('' si no existe)"""
+        return base64.b64encode(self.logo_reducido()).decode('ascii')
+    
+    def logo_url(self):
+        """URL file:// del logo reducido, para documentos que lo referencian en vez de embeberlo ('' si no existe)"""
+        logo = self.logo_reducido()
+        if not logo:
             return ''
-    except Exception as e:
-        print(f"Error al cargar logo: {e}")
-        return ''
+        ruta = os.path.join(OUTPUT_FOLDER, f'logo_{hashlib.sha256(logo).hexdigest()[:16]}.png')
+        if not os.path.exists(ruta):
+            descriptor, temporal = tempfile.mkstemp(suffix='.png', dir=OUTPUT_FOLDER)
+            with os.fdopen(descriptor, 'wb') as f:
+                f.write(logo)
+            os.replace(temporal, ruta)
+        return pathlib.Path(ruta).resolve().as_uri()
+    
+    def css_texto(self):
+        """Hoja de estilos del reporte como texto"""
+        def cargar(ruta):
+            with open(ruta, encoding='utf-8') as f:
+                return f.read()
+        return self._obtener('css_texto', self.css_path, cargar, '')
+    
+    def font_config(self):
+        """Configuración de fuentes de WeasyPrint compartida por todos los renders del proceso"""
+        importar_renderizador('weasyprint')
+        with self._lock:
+            if self._font_config is None:
+                from weasyprint.text.fonts import FontConfiguration
+                self._font_config = FontConfiguration()
+            return self._font_config
+    
+    def css_weasyprint(self):
+        """Hoja de estilos del reporte ya parseada por WeasyPrint"""
+        font_config = self.font_config()
+        def cargar(ruta):
+            return importar_renderizador('weasyprint').CSS(filename=ruta, font_config=font_config)
+        return self._obtener('css_weasyprint', self.css_path, cargar, None)
+    
+    def estilos_reportlab(self):
+        """Estilos de párrafo de ReportLab que replican el CSS original"""
+        with self._lock:
+            if self._estilos_reportlab is None:
+                self._estilos_reportlab = importar_renderizador('reporte_reportlab').crear_estilos_reportlab()
+            return self._estilos_reportlab
+    
+    def plantilla_reportlab(self):
+        """Partes fijas del reporte de ReportLab (se arman de nuevo solo si cambia el logo)"""
+        estilos = self.estilos_reportlab()
+        logo = self.logo_reducido()
+        with self._lock:
+            if self._plantilla_reportlab is None or self._plantilla_reportlab.logo is not logo:
+                self._plantilla_reportlab = importar_renderizador('reporte_reportlab').PlantillaReportLab(estilos, logo)
+            return self._plantilla_reportlab
+
+recursos_render = RecursosRender(os.path.join('static', 'logo.png'), os.path.join('static', 'reporte.css'))
+
+def get_logo_base64():
+    """Convierte el logo a base64 para embebido en PDF"""
+    return recursos_render.logo_base64()
+
+# Clasificaciones de rendimiento de menor a mayor, y promedio mínimo de cada una desde la segunda
+RENDIMIENTOS = ["Deficiente", "No Satisfactorio", "Aceptable", "Satisfactorio", "Sobresaliente"]
+UMBRALES_RENDIMIENTO = [1.5, 2.5, 3.5, 4.5]
 
 def calcular_rendimiento(promedio):
     """Calcula la clasificación de rendimiento basada en el promedio"""
-    if promedio >= 4.5:
-        return "Sobresaliente"
-    elif promedio >= 3.5:
-        return "Satisfactorio"
-    elif promedio >= 2.5:
-        return "Aceptable"
-    elif promedio >= 1.5:
-        return "No Satisfactorio"
-    else:
-        return "Deficiente"
+    for umbral, rendimiento in zip(reversed(UMBRALES_RENDIMIENTO), reversed(RENDIMIENTOS)):
+        if promedio >= umbral:
+            return rendimiento
+    return RENDIMIENTOS[0]
+
+def clasificar_rendimientos(promedios):
+    """Banda de rendimiento (índice en RENDIMIENTOS) de muchos promedios a la vez"""
+    if importar_numpy():
+        promedios = np.asarray(promedios, dtype=float)
+        bandas = np.searchsorted(UMBRALES_RENDIMIENTO, promedios, side='right')
+        bandas[np.isnan(promedios)] = 0
+        return bandas
+    return [0 if math.isnan(promedio) else bisect.bisect_right(UMBRALES_RENDIMIENTO, promedio)
+            for promedio in promedios]
 
 def normalizar_texto(texto):
     """Normaliza texto para búsqueda (sin acentos, mayúsculas, espacios)"""
@@ -90,9 +530,10 @@ def normalizar_texto(texto):
     
     return texto
 
-def encontrar_columna(headers, posibles_nombres, buscar_parcial=True):
+def encontrar_columna(headers, posibles_nombres, buscar_parcial=True, headers_norm=None):
     """Encuentra una columna por nombre, con múltiples opciones y búsqueda parcial"""
-    headers_norm = [normalizar_texto(h) for h in headers]
+    if headers_norm is None:
+        headers_norm = [normalizar_texto(h) for h in headers]
     
     for nombre in posibles_nombres:
         nombre_norm = normalizar_texto(nombre)
@@ -113,299 +554,727 @@ def detectar_tipo_evaluacion(headers):
     """Detecta el tipo de evaluación basado en el número de columnas y contenido"""
     num_cols = len(headers)
     
-    print(f"Tipo de evaluación detectado: ", end="")
-    
     if num_cols <= 51:
-        print("OPERATIVO")
-        return "OPERATIVO"
+        tipo = "OPERATIVO"
     elif num_cols <= 53:
-        print("ADMINISTRATIVA") 
-        return "ADMINISTRATIVA"
+        tipo = "ADMINISTRATIVA"
     elif num_cols <= 56:
         # Distinguir entre COMERCIAL y DIRECTIVOS por contenido
         headers_text = ' '.join(str(h).upper() for h in headers)
         if 'VENTAS' in headers_text or 'CUOTAS' in headers_text or 'MEDICO' in headers_text:
-            print("COMERCIAL")
-            return "COMERCIAL"
+            tipo = "COMERCIAL"
         else:
-            print("DIRECTIVOS")
-            return "DIRECTIVOS"
+            tipo = "DIRECTIVOS"
     else:
-        print("DIRECTIVOS")
-        return "DIRECTIVOS"
-
-def extraer_calificaciones_por_categoria(headers, row, tipo_evaluacion):
-    """Extrae calificaciones específicas según el tipo de evaluación"""
-    calificaciones = {}
+        tipo = "DIRECTIVOS"
     
-    def get_value(col_idx):
-        if col_idx is not None and col_idx < len(row):
-            val = row[col_idx]
-            if val is not None and str(val).strip():
-                try:
-                    num_val = float(val)
-                    # Solo aceptar valores en el rango válido de calificaciones (1-5)
-                    if 1 <= num_val <= 5:
-                        return num_val
-                    else:
-                        return 0
-                except:
-                    return 0
-        return 0
-    
-    # Mapeo específico por tipo de evaluación
-    if tipo_evaluacion == 'OPERATIVO':
+    log.debug("Tipo de evaluación detectado: %s (%d columnas)", tipo, num_cols)
+    return tipo
+
+# Columnas de calificación por tipo de evaluación (clave -> posibles nombres de columna)
+COLUMNAS_CALIFICACION = {
+    'OPERATIVO': {
         # Sección 3: Desempeño operativo
-        operativo_cols = {
-            'organizacion': ['Organiza las tareas a fin de cumplir con los tiempos establecidos'],
-            'cumple_resultados': ['Cumple con los resultados esperados de su función'],
-            'aportes_constructivos': ['Demuestra capacidad para apoyar y generar aportes constructivos al área'],
-            'realiza_actividades': ['Realiza las actividades encomendadas según las instrucciones dadas']
-        }
-        for key, nombres in operativo_cols.items():
-            col_idx = encontrar_columna(headers, nombres, buscar_parcial=True)
-            calificaciones[key] = get_value(col_idx)
-        
+        'organizacion': ['Organiza las tareas a fin de cumplir con los tiempos establecidos'],
+        'cumple_resultados': ['Cumple con los resultados esperados de su función'],
+        'aportes_constructivos': ['Demuestra capacidad para apoyar y generar aportes constructivos al área'],
+        'realiza_actividades': ['Realiza las actividades encomendadas según las instrucciones dadas'],
         # Sección 4: Compromiso y calidad
-        compromiso_cols = {
-            'cumple_politicas': ['Demuestra compromiso con el cumplimiento de los objetivos'],
-            'conoce_calidad': ['Actúa en pro de los intereses de la empresa'],
-            'propone_mejoras': ['Propone alternativas para mejorar el trabajo']
-        }
-        for key, nombres in compromiso_cols.items():
-            col_idx = encontrar_columna(headers, nombres, buscar_parcial=True)
-            calificaciones[key] = get_value(col_idx)
-        
+        'cumple_politicas': ['Demuestra compromiso con el cumplimiento de los objetivos'],
+        'conoce_calidad': ['Actúa en pro de los intereses de la empresa'],
+        'propone_mejoras': ['Propone alternativas para mejorar el trabajo'],
         # Sección 5: Comportamiento
-        comportamiento_cols = {
-            'relaciones': ['RELACIONES INTERPERSONALES', 'Mantiene relaciones de cordialidad'],
-            'trabajo_equipo': ['TRABAJO EN EQUIPO', 'Apoya a los compañeros'],
-            'actitud_servicio': ['ACTITUD DE SERVICIO', 'Se preocupa por satisfacer']
-        }
-        for key, nombres in comportamiento_cols.items():
-            col_idx = encontrar_columna(headers, nombres, buscar_parcial=True)
-            calificaciones[key] = get_value(col_idx)
-    
-    elif tipo_evaluacion == 'ADMINISTRATIVA':
+        'relaciones': ['RELACIONES INTERPERSONALES', 'Mantiene relaciones de cordialidad'],
+        'trabajo_equipo': ['TRABAJO EN EQUIPO', 'Apoya a los compañeros'],
+        'actitud_servicio': ['ACTITUD DE SERVICIO', 'Se preocupa por satisfacer']
+    },
+    'ADMINISTRATIVA': {
         # Sección 3: Desempeño en el cargo
-        admin_cols = {
-            'organizacion': ['Conoce y aplica los procedimientos del área'],
-            'cumple_resultados': ['Cumple con los resultados esperados de su función'],
-            'aportes_constructivos': ['Demuestra capacidad para apoyar y generar aportes constructivos'],
-            'realiza_actividades': ['Realiza las actividades encomendadas según las instrucciones'],
-            'analisis': ['Demuestra capacidad para analizar y solucionar los problemas'],
-            'informes': ['Presenta informes, cartas, etc., de manera oportuna'],
-            'aplica_capacitacion': ['Aplica en su desempeño diario los conceptos vistos en capacitaciones'],
-            'uso_equipos': ['Hace uso adecuado del equipo y demás elementos'],
-            'entrega_tareas': ['Entrega los informes o tareas encomendadas']
-        }
-        for key, nombres in admin_cols.items():
-            col_idx = encontrar_columna(headers, nombres, buscar_parcial=True)
-            calificaciones[key] = get_value(col_idx)
-        
+        'organizacion': ['Conoce y aplica los procedimientos del área'],
+        'cumple_resultados': ['Cumple con los resultados esperados de su función'],
+        'aportes_constructivos': ['Demuestra capacidad para apoyar y generar aportes constructivos'],
+        'realiza_actividades': ['Realiza las actividades encomendadas según las instrucciones'],
+        'analisis': ['Demuestra capacidad para analizar y solucionar los problemas'],
+        'informes': ['Presenta informes, cartas, etc., de manera oportuna'],
+        'aplica_capacitacion': ['Aplica en su desempeño diario los conceptos vistos en capacitaciones'],
+        'uso_equipos': ['Hace uso adecuado del equipo y demás elementos'],
+        'entrega_tareas': ['Entrega los informes o tareas encomendadas'],
         # Sección 4: Compromiso y calidad
-        compromiso_cols = {
-            'cumple_politicas': ['Demuestra compromiso con el cumplimiento de los objetivos'],
-            'conoce_calidad': ['Actúa en pro de los intereses de la empresa'],
-            'propone_mejoras': ['Propone alternativas para mejorar el trabajo']
-        }
-        for key, nombres in compromiso_cols.items():
-            col_idx = encontrar_columna(headers, nombres, buscar_parcial=True)
-            calificaciones[key] = get_value(col_idx)
-        
+        'cumple_politicas': ['Demuestra compromiso con el cumplimiento de los objetivos'],
+        'conoce_calidad': ['Actúa en pro de los intereses de la empresa'],
+        'propone_mejoras': ['Propone alternativas para mejorar el trabajo'],
         # Sección 5: Comportamiento
-        comportamiento_cols = {
-            'relaciones': ['RELACIONES INTERPERSONALES'],
-            'trabajo_equipo': ['TRABAJO EN EQUIPO'],
-            'actitud_servicio': ['ACTITUD DE SERVICIO']
-        }
-        for key, nombres in comportamiento_cols.items():
-            col_idx = encontrar_columna(headers, nombres, buscar_parcial=True)
-            calificaciones[key] = get_value(col_idx)
-    
-    elif tipo_evaluacion == 'COMERCIAL':
+        'relaciones': ['RELACIONES INTERPERSONALES'],
+        'trabajo_equipo': ['TRABAJO EN EQUIPO'],
+        'actitud_servicio': ['ACTITUD DE SERVICIO']
+    },
+    'COMERCIAL': {
         # Calificaciones base
-        comercial_cols = {
-            'organizacion': ['ORGANIZA', 'ORGANIZACION', 'PLANIFICA'],
-            'cumple_resultados': ['CUMPLE', 'RESULTADOS', 'OBJETIVOS'],
-            'aplica_capacitacion': ['APLICA', 'CAPACITACION', 'ENTRENAMIENTO'],
-            'uso_equipos': ['USO', 'EQUIPOS', 'RECURSOS'],
-            'ventas': ['VENTAS', 'CUOTAS', 'PANEL MEDICO'],
-            'clientes': ['CLIENTES', 'MEDICOS', 'ATENCION']
-        }
-        for key, nombres in comercial_cols.items():
-            col_idx = encontrar_columna(headers, nombres, buscar_parcial=True)
-            calificaciones[key] = get_value(col_idx)
-        
+        'organizacion': ['ORGANIZA', 'ORGANIZACION', 'PLANIFICA'],
+        'cumple_resultados': ['CUMPLE', 'RESULTADOS', 'OBJETIVOS'],
+        'aplica_capacitacion': ['APLICA', 'CAPACITACION', 'ENTRENAMIENTO'],
+        'uso_equipos': ['USO', 'EQUIPOS', 'RECURSOS'],
+        'ventas': ['VENTAS', 'CUOTAS', 'PANEL MEDICO'],
+        'clientes': ['CLIENTES', 'MEDICOS', 'ATENCION'],
         # Compromiso y calidad
-        compromiso_cols = {
-            'cumple_politicas': ['CUMPLE', 'POLITICAS', 'PROCEDIMIENTOS'],
-            'conoce_calidad': ['CALIDAD', 'POLITICA DE CALIDAD'],
-            'propone_mejoras': ['MEJORAS', 'IDEAS', 'ALTERNATIVAS']
-        }
-        for key, nombres in compromiso_cols.items():
-            col_idx = encontrar_columna(headers, nombres, buscar_parcial=True)
-            calificaciones[key] = get_value(col_idx)
-        
+        'cumple_politicas': ['CUMPLE', 'POLITICAS', 'PROCEDIMIENTOS'],
+        'conoce_calidad': ['CALIDAD', 'POLITICA DE CALIDAD'],
+        'propone_mejoras': ['MEJORAS', 'IDEAS', 'ALTERNATIVAS'],
         # Comportamiento
-        comportamiento_cols = {
-            'relaciones': ['RELACIONES', 'INTERPERSONALES', 'CORDIALIDAD'],
-            'trabajo_equipo': ['EQUIPO', 'COLABORACION'],
-            'actitud_servicio': ['SERVICIO', 'ACTITUD']
-        }
-        for key, nombres in comportamiento_cols.items():
-            col_idx = encontrar_columna(headers, nombres, buscar_parcial=True)
-            calificaciones[key] = get_value(col_idx)
-    
-    elif tipo_evaluacion == 'DIRECTIVOS':
+        'relaciones': ['RELACIONES', 'INTERPERSONALES', 'CORDIALIDAD'],
+        'trabajo_equipo': ['EQUIPO', 'COLABORACION'],
+        'actitud_servicio': ['SERVICIO', 'ACTITUD']
+    },
+    'DIRECTIVOS': {
         # Calificaciones específicas de directivos
-        directivos_cols = {
-            'organizacion': ['ORGANIZA', 'ORGANIZACION', 'PLANIFICA'],
-            'cumple_resultados': ['CUMPLE', 'RESULTADOS', 'OBJETIVOS'],
-            'aplica_capacitacion': ['APLICA', 'CAPACITACION', 'ENTRENAMIENTO'],
-            'uso_equipos': ['USO', 'EQUIPOS', 'RECURSOS'],
-            'liderazgo': ['LIDERAZGO', 'DIRECCION'],
-            'gestion': ['GESTION', 'EFICIENTE'],
-            'evaluacion_equipo': ['EVALUACION', 'ANALISIS', 'EQUIPO']
-        }
-        for key, nombres in directivos_cols.items():
-            col_idx = encontrar_columna(headers, nombres, buscar_parcial=True)
-            calificaciones[key] = get_value(col_idx)
-        
+        'organizacion': ['ORGANIZA', 'ORGANIZACION', 'PLANIFICA'],
+        'cumple_resultados': ['CUMPLE', 'RESULTADOS', 'OBJETIVOS'],
+        'aplica_capacitacion': ['APLICA', 'CAPACITACION', 'ENTRENAMIENTO'],
+        'uso_equipos': ['USO', 'EQUIPOS', 'RECURSOS'],
+        'liderazgo': ['LIDERAZGO', 'DIRECCION'],
+        'gestion': ['GESTION', 'EFICIENTE'],
+        'evaluacion_equipo': ['EVALUACION', 'ANALISIS', 'EQUIPO'],
         # Compromiso y calidad
-        compromiso_cols = {
-            'cumple_politicas': ['CUMPLE', 'POLITICAS', 'PROCEDIMIENTOS'],
-            'conoce_calidad': ['CALIDAD', 'POLITICA DE CALIDAD'],
-            'propone_mejoras': ['MEJORAS', 'IDEAS', 'ALTERNATIVAS']
-        }
-        for key, nombres in compromiso_cols.items():
-            col_idx = encontrar_columna(headers, nombres, buscar_parcial=True)
-            calificaciones[key] = get_value(col_idx)
-        
+        'cumple_politicas': ['CUMPLE', 'POLITICAS', 'PROCEDIMIENTOS'],
+        'conoce_calidad': ['CALIDAD', 'POLITICA DE CALIDAD'],
+        'propone_mejoras': ['MEJORAS', 'IDEAS', 'ALTERNATIVAS'],
         # Comportamiento
-        comportamiento_cols = {
-            'relaciones': ['RELACIONES', 'INTERPERSONALES', 'CORDIALIDAD'],
-            'trabajo_equipo': ['EQUIPO', 'COLABORACION'],
-            'actitud_servicio': ['SERVICIO', 'ACTITUD']
-        }
-        for key, nombres in comportamiento_cols.items():
-            col_idx = encontrar_columna(headers, nombres, buscar_parcial=True)
-            calificaciones[key] = get_value(col_idx)
-    
-    return calificaciones
+        'relaciones': ['RELACIONES', 'INTERPERSONALES', 'CORDIALIDAD'],
+        'trabajo_equipo': ['EQUIPO', 'COLABORACION'],
+        'actitud_servicio': ['SERVICIO', 'ACTITUD']
+    }
+}
 
-def procesar_excel(file_path):
-    """Procesa el archivo Excel y extrae las evaluaciones"""
-    global evaluaciones_data
-    evaluaciones_data = []
+class PlanColumnas:
+    """Plan de columnas de una hoja: se resuelve una sola vez por hoja y tipo de evaluación.
     
-    try:
-        # Cargar con data_only=True para obtener valores calculados de fórmulas
-        workbook = openpyxl.load_workbook(file_path, data_only=True)
-        sheet = workbook.active
+    Guarda el índice de cada columna de identificación, texto y calificación, de modo que
+    extraer los datos de una fila se reduce a accesos por índice.
+    """
+    
+    def __init__(self, headers, tipo_evaluacion):
+        self.headers = headers
+        self.tipo_evaluacion = tipo_evaluacion
         
-        # Obtener headers
-        headers = []
-        for col in range(1, sheet.max_column + 1):
-            cell_value = sheet.cell(row=1, column=col).value
-            headers.append(cell_value if cell_value else f"Col_{col}")
+        # Normalizar headers una sola vez para todas las búsquedas
+        headers_norm = [normalizar_texto(h) for h in headers]
         
-        # Detectar tipo de evaluación
-        tipo_evaluacion = detectar_tipo_evaluacion(headers)
+        def buscar(posibles_nombres, buscar_parcial=True):
+            return encontrar_columna(headers, posibles_nombres, buscar_parcial, headers_norm=headers_norm)
         
-        # Definir columnas principales
-        col_nombre = encontrar_columna(headers, ['NOMBRE', 'COLABORADOR'])
-        col_cargo = encontrar_columna(headers, ['CARGO', 'PUESTO'])
-        col_area = encontrar_columna(headers, ['AREA', 'PROCESO', 'DEPARTAMENTO'])
-        col_jefe = encontrar_columna(headers, ['JEFE', 'SUPERVISOR', 'INMEDIATO'])
-        col_fecha = encontrar_columna(headers, ['FECHA', 'EVALUACION'])
+        # Columnas de identificación
+        self.nombre = buscar(['NOMBRE', 'COLABORADOR'])
+        self.cargo = buscar(['CARGO', 'PUESTO'])
+        self.area = buscar(['AREA', 'PROCESO', 'DEPARTAMENTO'])
+        self.jefe = buscar(['JEFE', 'SUPERVISOR', 'INMEDIATO'])
+        self.fecha = buscar(['FECHA', 'EVALUACION'])
         
         # Buscar columna de periodo con mayor especificidad
-        col_periodo = encontrar_columna(headers, ['PERIODO EVALUADO', 'PERÍODO EVALUADO'], buscar_parcial=False)
-        if col_periodo is None:
-            col_periodo = encontrar_columna(headers, ['PERIODO', 'PERÍODO'], buscar_parcial=True)
+        self.periodo = buscar(['PERIODO EVALUADO', 'PERÍODO EVALUADO'], buscar_parcial=False)
+        if self.periodo is None:
+            self.periodo = buscar(['PERIODO', 'PERÍODO'], buscar_parcial=True)
             # Verificar que no sea una columna de análisis
-            if col_periodo is not None and col_periodo < len(headers):
-                col_name = str(headers[col_periodo]).upper()
+            if self.periodo is not None and self.periodo < len(headers):
+                col_name = str(headers[self.periodo]).upper()
                 if 'ANALISIS' in col_name or 'ANÁLISIS' in col_name:
-                    col_periodo = None  # Ignorar esta columna
+                    self.periodo = None  # Ignorar esta columna
         
         # Buscar columna de promedio/porcentaje (más específica)
-        col_promedio = encontrar_columna(headers, ['PROMEDIO', 'PORCENTAJE'], buscar_parcial=False)
-        if col_promedio is None:
+        self.promedio = buscar(['PROMEDIO', 'PORCENTAJE'], buscar_parcial=False)
+        if self.promedio is None:
             # Búsqueda más amplia si no encuentra exacto
-            col_promedio = encontrar_columna(headers, ['PROMEDIO', 'PORCENTAJE', '%'], buscar_parcial=True)
+            self.promedio = buscar(['PROMEDIO', 'PORCENTAJE', '%'], buscar_parcial=True)
         
         # Buscar columnas de texto con mayor especificidad
-        col_comentario = encontrar_columna(headers, ['COMENTARIOS DEL JEFE INMEDIATO', 'COMENTARIO DEL JEFE', 'FORTALEZAS Y DEBILIDADES'], buscar_parcial=True)
-        col_aportes = encontrar_columna(headers, ['QUE APORTES HIZO USTED', 'QUE APORTES CONSIDERA', 'APORTES'], buscar_parcial=True)
-        col_plan = encontrar_columna(headers, ['PLAN DE MEJORA PROPUESTO'], buscar_parcial=True)
-        
-        print(f"Columnas de texto encontradas - Comentario: {col_comentario}, Aportes: {col_aportes}, Plan: {col_plan}")
-        if col_comentario is not None:
-            print(f"  -> Comentario: '{headers[col_comentario]}'")
-        if col_aportes is not None:
-            print(f"  -> Aportes: '{headers[col_aportes]}'")
-        if col_plan is not None:
-            print(f"  -> Plan: '{headers[col_plan]}'")
+        self.comentario = buscar(['COMENTARIOS DEL JEFE INMEDIATO', 'COMENTARIO DEL JEFE', 'FORTALEZAS Y DEBILIDADES'], buscar_parcial=True)
+        self.aportes = buscar(['QUE APORTES HIZO USTED', 'QUE APORTES CONSIDERA', 'APORTES'], buscar_parcial=True)
+        self.plan = buscar(['PLAN DE MEJORA PROPUESTO'], buscar_parcial=True)
         
-        def get_value(row, col_idx):
-            if col_idx is not None and col_idx < len(row):
-                return row[col_idx] if row[col_idx] is not None else ""
-            return ""
+        # Columnas de calificación del tipo detectado, en el orden del reporte
+        self.calificaciones = [
+            (key, buscar(nombres, buscar_parcial=True))
+            for key, nombres in COLUMNAS_CALIFICACION.get(tipo_evaluacion, {}).items()
+        ]
         
-        def es_columna_texto(col_idx, sample_rows=10):
-            """Verifica si una columna contiene texto largo (no números)"""
-            if col_idx is None:
-                return False
-            
-            # Verificar el nombre de la columna primero
-            if col_idx < len(headers):
-                col_name = str(headers[col_idx]).upper()
-                # Si el nombre indica claramente que es texto, retornar True
-                texto_keywords = ['COMENTARIO', 'APORTES', 'PLAN DE MEJORA', 'FORTALEZA', 'DEBILIDAD', 
-                                 'QUE APORTES', 'ASPECTOS', 'OBJETIVOS', 'CONSIDERA', 'PROPUESTO']
-                if any(keyword in col_name for keyword in texto_keywords):
-                    # Verificar que no sea una columna numérica
-                    if not any(num_keyword in col_name for num_keyword in ['PORCENTAJE', '%', 'PROMEDIO', 'CALIFICACION']):
-                        return True
-            
-            # Verificar el contenido de las primeras filas
-            texto_count = 0
-            numero_count = 0
-            
-            for row_num in range(2, min(sample_rows + 2, sheet.max_row + 1)):
-                row_data = [sheet.cell(row=row_num, column=col).value for col in range(1, sheet.max_column + 1)]
-                value = get_value(row_data, col_idx)
-                
+        # Clasificación de columnas de texto (ver clasificar_columnas_texto)
+        self.columnas_texto = {}
+
+    def clasificar_columnas_texto(self, muestra):
+        """Clasifica las columnas de texto candidatas con una sola pasada por las filas de muestra"""
+        candidatas = [col_idx for col_idx in (self.comentario, self.aportes, self.plan) if col_idx is not None]
+        self.columnas_texto = {}
+        
+        # Primero por el nombre de la columna; solo se revisa el contenido si el nombre no es concluyente
+        por_contenido = []
+        for col_idx in candidatas:
+            if col_idx < len(self.headers) and es_nombre_columna_texto(self.headers[col_idx]):
+                self.columnas_texto[col_idx] = True
+            elif col_idx not in por_contenido:
+                por_contenido.append(col_idx)
+        
+        texto_count = dict.fromkeys(por_contenido, 0)
+        numero_count = dict.fromkeys(por_contenido, 0)
+        for row_data in muestra:
+            for col_idx in por_contenido:
+                value = row_data[col_idx] if col_idx < len(row_data) else None
                 if value:
                     # Si es un string largo, es texto
                     if isinstance(value, str) and len(str(value).strip()) > 15:
-                        texto_count += 1
+                        texto_count[col_idx] += 1
                     # Si es un número, contar como número
                     elif isinstance(value, (int, float)):
-                        numero_count += 1
+                        numero_count[col_idx] += 1
+        
+        # Si hay más texto que números, es columna de texto
+        for col_idx in por_contenido:
+            self.columnas_texto[col_idx] = texto_count[col_idx] > numero_count[col_idx] and texto_count[col_idx] > 0
+    
+    def es_texto(self, col_idx):
+        """Indica si la columna fue clasificada como columna de texto largo (no números)"""
+        return self.columnas_texto.get(col_idx, False)
+    
+    def firma(self):
+        """Firma de todo lo que influye en la extracción además de la fila: headers, tipo y columnas de texto"""
+        return repr((self.headers, self.tipo_evaluacion, sorted(self.columnas_texto.items()))).encode('utf-8')
+
+# Versión de la extracción de evaluaciones: entra en las huellas de fila y de estructura, así que al
+# cambiarla (cuando cambia lo que se extrae de una fila) no se reutilizan evaluaciones extraídas antes
+VERSION_EXTRACCION = 1
+
+def base_huellas(firma_plan):
+    """Hash ya alimentado con la versión de la extracción y la firma del plan de una hoja, que se copia para cada fila"""
+    return hashlib.blake2b(b'v%d:' % VERSION_EXTRACCION + firma_plan, digest_size=16)
+
+def huella_fila(base, row_data):
+    """Huella del contenido crudo de una fila, para reconocerla en una carga posterior del mismo libro.
+    
+    Se calcula para todas las filas, también en la primera carga de un libro, porque se guarda
+    para compararla con las cargas siguientes; cuesta unos microsegundos por fila, menos del 1%
+    de lo que cuesta extraer la evaluación.
+    """
+    huella = base.copy()
+    huella.update(repr(row_data).encode('utf-8'))
+    return huella.hexdigest()
+
+def firma_estructura(tareas):
+    """Firma de la estructura de una carga: hojas y encabezados de cada una, y versión de la extracción"""
+    estructura = [(tarea['hoja'], tarea['encabezados']) for tarea in tareas]
+    return hashlib.blake2b(f'v{VERSION_EXTRACCION}:{estructura!r}'.encode('utf-8'), digest_size=16).hexdigest()
+
+def es_nombre_columna_texto(header):
+    """Verifica si el nombre de la columna indica claramente que contiene texto"""
+    col_name = str(header).upper()
+    texto_keywords = ['COMENTARIO', 'APORTES', 'PLAN DE MEJORA', 'FORTALEZA', 'DEBILIDAD', 
+                     'QUE APORTES', 'ASPECTOS', 'OBJETIVOS', 'CONSIDERA', 'PROPUESTO']
+    if any(keyword in col_name for keyword in texto_keywords):
+        # Verificar que no sea una columna numérica
+        if not any(num_keyword in col_name for num_keyword in ['PORCENTAJE', '%', 'PROMEDIO', 'CALIFICACION']):
+            return True
+    return False
+
+def valor_calificacion(row, col_idx):
+    """Convierte el valor de una celda en calificación (1-5), o 0 si no es válida"""
+    if col_idx is not None and col_idx < len(row):
+        val = row[col_idx]
+        if val is not None and str(val).strip():
+            try:
+                num_val = float(val)
+                # Solo aceptar valores en el rango válido de calificaciones (1-5)
+                if 1 <= num_val <= 5:
+                    return num_val
+                else:
+                    return 0
+            except:
+                return 0
+    return 0
+
+def extraer_calificaciones_por_categoria(headers, row, tipo_evaluacion, plan=None):
+    """Extrae calificaciones específicas según el tipo de evaluación"""
+    if plan is None:
+        plan = PlanColumnas(headers, tipo_evaluacion)
+    
+    return {key: valor_calificacion(row, col_idx) for key, col_idx in plan.calificaciones}
+
+class NormalizadorFechas:
+    """Normaliza la fecha de evaluación y el período evaluado de cada fila.
+    
+    En un mismo libro se repiten unas pocas fechas y períodos en miles de filas, así que
+    los resultados se recuerdan por valor crudo de la celda (hasta `capacidad` valores
+    distintos por caché; al llenarse se vacía). Junto con cada resultado se guardan los
+    mensajes de depuración que lo explican, para registrarlos en las filas muestreadas
+    aunque el valor salga de la caché.
+    """
+    
+    # Palabras que indican que la celda del período no es un período (comentarios, encabezados...)
+    PALABRAS_INVALIDAS = ('ANALISIS', 'ANÁLISIS', 'COMENTARIO', 'OBSERVACION',
+                          'OBSERVACIÓN', 'FORTALEZA', 'DEBILIDAD', 'APORTES',
+                          'PLAN', 'MEJORA', 'QUE', 'COMO', 'CONSIDERA', 'TRA',
+                          'BAJO', 'MEDIO', 'ALTO', 'RESPONSABILIDAD', 'GESTION',
+                          'GESTIÓN')
+    PATRON_INVALIDAS = re.compile('|'.join(map(re.escape, PALABRAS_INVALIDAS)))
+    LARGO_MAXIMO_PERIODO = 25
+    
+    # Formatos de fecha aceptados ('%Y-%m-%d', '%d/%m/%Y', '%Y/%m/%d', '%d-%m-%Y', '%Y%m%d' y
+    # '%d.%m.%Y', en ese orden) agrupados por separador: una fecha solo puede coincidir con
+    # los formatos de su separador, así que basta uno o dos strptime en lugar de los seis
+    FORMATOS_POR_SEPARADOR = {
+        '-': ('%Y-%m-%d', '%d-%m-%Y'),
+        '/': ('%d/%m/%Y', '%Y/%m/%d'),
+        '.': ('%d.%m.%Y',),
+        '': ('%Y%m%d',),
+    }
+    PATRON_SEPARADORES = re.compile(r'[-/.]')
+    PATRON_ANIO = re.compile(r'(19|20)\d{2}')
+    ANIO_POR_DEFECTO = "2025"
+    
+    def __init__(self, capacidad=4096):
+        self.capacidad = capacidad
+        self._fechas = {}
+        self._periodos = {}
+        self._anios = {}
+    
+    def _recordar(self, cache, clave, valor):
+        if len(cache) >= self.capacidad:
+            cache.clear()
+        cache[clave] = valor
+        return valor
+    
+    def fecha(self, valor):
+        """Fecha de la celda como texto, sin la hora ('2024-01-15 00:00:00' -> '2024-01-15')"""
+        # El tipo es parte de la clave: 1, 1.0 y True son iguales como claves pero no como texto
+        clave = (valor.__class__, valor)
+        fecha = self._fechas.get(clave)
+        if fecha is None:
+            if not valor:
+                fecha = ""
+            elif hasattr(valor, 'strftime'):
+                # Objeto datetime de Excel
+                fecha = valor.strftime('%Y-%m-%d')
+            else:
+                fecha = str(valor).split(' ')[0]
+            self._recordar(self._fechas, clave, fecha)
+        return fecha
+    
+    def periodo(self, texto, fecha):
+        """(período, mensajes): el texto de la celda si es un período válido o, si no, el año de la fecha.
+        
+        `mensajes` son pares (formato, argumentos) para log.debug, sin el nombre del colaborador.
+        """
+        valido, mensajes = self._validar_periodo(texto)
+        if valido:
+            return texto, mensajes
+        anio, mensajes_anio = self._anio(fecha)
+        return anio, mensajes + mensajes_anio
+    
+    def _validar_periodo(self, texto):
+        resultado = self._periodos.get(texto)
+        if resultado is not None:
+            return resultado
+        
+        if not texto or texto == "None":
+            return self._recordar(self._periodos, texto, (False, ()))
+        
+        mensajes = []
+        invalido = False
+        coincidencia = self.PATRON_INVALIDAS.search(texto.upper())
+        if coincidencia:
+            invalido = True
+            mensajes.append(("Periodo rechazado: '%s' (contiene '%s')", (texto, coincidencia.group())))
+        # Un período no debería ser muy largo
+        if len(texto) > self.LARGO_MAXIMO_PERIODO:
+            invalido = True
+            mensajes.append(("Periodo rechazado: '%s' (muy largo: %d caracteres)", (texto, len(texto))))
+        if not invalido:
+            mensajes.append(("Periodo aceptado del Excel: '%s'", (texto,)))
+        return self._recordar(self._periodos, texto, (not invalido, tuple(mensajes)))
+    
+    def _anio(self, fecha):
+        resultado = self._anios.get(fecha)
+        if resultado is not None:
+            return resultado
+        
+        mensajes = [("Extrayendo año de fecha: '%s'", (fecha,))]
+        anio = ""
+        # Método 1: parsear la fecha con el formato de su separador
+        separadores = set(self.PATRON_SEPARADORES.findall(fecha))
+        formatos = () if len(separadores) > 1 else self.FORMATOS_POR_SEPARADOR[separadores.pop() if separadores else '']
+        for fmt in formatos:
+            try:
+                anio = str(datetime.strptime(fecha, fmt).year)
+            except ValueError:
+                continue
+            mensajes.append(("  -> Año extraído (formato %s): %s", (fmt, anio)))
+            break
+        
+        # Método 2: buscar un año (19XX o 20XX)
+        if not anio:
+            coincidencia = self.PATRON_ANIO.search(fecha)
+            if coincidencia:
+                anio = coincidencia.group()
+                mensajes.append(("  -> Año extraído (regex): %s", (anio,)))
+        
+        # Método 3: valor por defecto
+        if not anio:
+            anio = self.ANIO_POR_DEFECTO
+            mensajes.append(("  -> Usando año por defecto: %s", (anio,)))
+        return self._recordar(self._anios, fecha, (anio, tuple(mensajes)))
+
+normalizador_fechas = NormalizadorFechas()
+
+def abrir_binario(fuente):
+    """Archivo binario de lectura de una ruta o del contenido de un archivo subido (bytes)"""
+    return io.BytesIO(fuente) if isinstance(fuente, bytes) else open(fuente, 'rb')
+
+def leer_cabecera(fuente, tamano=4096):
+    """Primeros bytes del archivo, para reconocer su formato"""
+    if isinstance(fuente, bytes):
+        return fuente[:tamano]
+    with open(fuente, 'rb') as archivo:
+        return archivo.read(tamano)
+
+# Firmas de los formatos: los .xlsx son un ZIP y los .xls un documento OLE2 (compound file)
+FIRMA_XLSX = b'PK\x03\x04'
+FIRMA_XLS = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+# Bytes de control que no aparecen en un texto (sí tabuladores, saltos de línea y retornos de carro)
+PATRON_BINARIO = re.compile(rb'[\x00-\x08\x0e-\x1f]')
+
+def detectar_formato(cabecera):
+    """Formato según los primeros bytes del archivo ('xlsx', 'xls' o 'csv'), sin mirar la extensión; None si no es ninguno"""
+    if cabecera.startswith(FIRMA_XLSX):
+        return 'xlsx'
+    if cabecera.startswith(FIRMA_XLS):
+        return 'xls'
+    if cabecera.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return 'csv'
+    # Un texto es CSV si la línea de encabezados tiene algún delimitador (hay decenas de columnas)
+    if not PATRON_BINARIO.search(cabecera) and re.search(rb'[,;\t|]', cabecera.split(b'\n', 1)[0]):
+        return 'csv'
+    return None
+
+class LectorLibro(ABC):
+    """Lectura de un archivo de evaluaciones, sea cual sea su formato.
+    
+    Cada lector entrega sus hojas y, por hoja, las filas como tuplas de valores (la primera con
+    los encabezados): números, fechas y celdas vacías (None) como los entrega openpyxl. Así
+    todos los formatos pasan por la misma detección de encabezados y extracción de filas.
+    """
+    
+    @abstractmethod
+    def hojas(self, contar=True):
+        """[(nombre, filas de datos)] de todas las hojas, en orden.
+        
+        Con contar=False, una hoja cuyas filas solo se cuentan leyéndola completa (CSV) entrega
+        None en lugar del número de filas, o 0 si no tiene datos.
+        """
+    
+    @abstractmethod
+    def leer(self, hoja=None):
+        """(columnas, filas de datos o None si aún no se contaron, iterador de filas) de la hoja indicada o de la principal"""
+    
+    def encabezados(self, hoja=None):
+        """Primera fila de la hoja (los encabezados), sin leer el resto"""
+        _, _, filas = self.leer(hoja)
+        try:
+            return tuple(next(filas, None) or ())
+        finally:
+            if hasattr(filas, 'close'):
+                filas.close()
+    
+    def cerrar(self):
+        pass
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.cerrar()
+
+class LectorXlsx(LectorLibro):
+    """Libros .xlsx con openpyxl en modo solo lectura (las filas se leen en streaming)"""
+    
+    def __init__(self, fuente):
+        # Se abre el archivo aquí: openpyxl rechaza las rutas sin extensión de Excel
+        self._archivo = abrir_binario(fuente)
+        try:
+            # data_only=True para obtener valores calculados de fórmulas
+            self.workbook = openpyxl.load_workbook(self._archivo, read_only=True, data_only=True)
+        except Exception:
+            self._archivo.close()
+            raise
+        # Dimensiones ya medidas por nombre de hoja: hojas() y leer() no recorren dos veces la misma
+        self._medidas = {}
+    
+    def _dimensiones(self, sheet):
+        """(columnas, filas de datos) de la hoja.
+        
+        En modo solo lectura openpyxl confía en la dimensión que declara la hoja y corta las
+        filas a ella. Algunos generadores de Excel no la guardan o guardan una desactualizada
+        (p. ej. A1:A1); si falta o abarca una sola fila o columna, se descarta y se mide la
+        hoja recorriéndola, como al cargar el libro completo.
+        """
+        if sheet.title in self._medidas:
+            return self._medidas[sheet.title]
+        if (sheet.max_column or 0) > 1 and (sheet.max_row or 0) > 1:
+            return sheet.max_column, sheet.max_row - 1
+        sheet.reset_dimensions()
+        columnas = filas = 0
+        for filas, fila in enumerate(sheet.iter_rows(values_only=True), start=1):
+            columnas = max(columnas, len(fila))
+        self._medidas[sheet.title] = columnas or 1, max(filas - 1, 0)
+        return self._medidas[sheet.title]
+    
+    def hojas(self, contar=True):
+        return [(sheet.title, self._dimensiones(sheet)[1]) for sheet in self.workbook.worksheets]
+    
+    def leer(self, hoja=None):
+        sheet = self.workbook[hoja] if hoja is not None else self.workbook.active
+        columnas, filas = self._dimensiones(sheet)
+        return columnas, filas, sheet.iter_rows(min_row=1, max_col=columnas, values_only=True)
+    
+    def cerrar(self):
+        self.workbook.close()
+        self._archivo.close()
+
+class LectorXls(LectorLibro):
+    """Libros de Excel 97-2003 (.xls) con xlrd, con los valores convertidos como en openpyxl"""
+    
+    def __init__(self, fuente):
+        if not XLRD_AVAILABLE:
+            raise ValueError('Para leer libros .xls instale xlrd (pip install xlrd)')
+        opciones = {'file_contents': fuente} if isinstance(fuente, bytes) else {'filename': fuente}
+        self.libro = xlrd.open_workbook(**opciones)
+    
+    def hojas(self, contar=True):
+        return [(sheet.name, max(sheet.nrows - 1, 0)) for sheet in self.libro.sheets()]
+    
+    def leer(self, hoja=None):
+        sheet = self.libro.sheet_by_name(hoja) if hoja is not None else self.libro.sheet_by_index(0)
+        filas = (tuple(map(self._valor, sheet.row(fila))) for fila in range(sheet.nrows))
+        return max(sheet.ncols, 1), max(sheet.nrows - 1, 0), filas
+    
+    def _valor(self, celda):
+        # xlrd guarda todos los números como float y las fechas como número de serie
+        if celda.ctype == xlrd.XL_CELL_NUMBER:
+            return int(celda.value) if celda.value.is_integer() else celda.value
+        if celda.ctype == xlrd.XL_CELL_DATE:
+            try:
+                return xlrd.xldate.xldate_as_datetime(celda.value, self.libro.datemode)
+            except (xlrd.xldate.XLDateError, OverflowError):
+                return celda.value
+        if celda.ctype == xlrd.XL_CELL_TEXT:
+            return celda.value
+        if celda.ctype == xlrd.XL_CELL_BOOLEAN:
+            return bool(celda.value)
+        return None  # Vacías, en blanco o con error
+    
+    def cerrar(self):
+        self.libro.release_resources()
+
+def _bytes_como_cp1252(error):
+    """Manejador de errores de decodificación: lee como Windows-1252 los bytes que no son UTF-8 válido"""
+    return error.object[error.start:error.end].decode('cp1252', errors='replace'), error.end
+
+codecs.register_error('novaderma-cp1252', _bytes_como_cp1252)
+
+class LectorCsv(LectorLibro):
+    """Archivos CSV (como los que exporta el formulario de RR. HH.), leídos en streaming.
+    
+    La codificación (UTF-8, con o sin BOM, UTF-16 con BOM o, si no es UTF-8 válido,
+    Windows-1252/Latin-1) y el delimitador (coma, punto y coma, tabulador o barra) se
+    deciden con los primeros KB; si más adelante aparece algún byte que no es UTF-8, ese
+    byte se lee como Windows-1252. Los números se convierten como lo haría Excel (con coma
+    decimal si el delimitador no es la coma) y las celdas vacías quedan en None; las fechas
+    quedan como texto, igual que en una celda de texto de Excel. Las filas solo se cuentan
+    (una lectura completa más) cuando se pide su número.
+    """
+    
+    HOJA = 'CSV'
+    DELIMITADORES = ',;\t|'
+    MUESTRA_BYTES = 32 * 1024
+    DETECCION_BYTES = 64 * 1024
+    PATRON_ENTERO = re.compile(r'[-+]?\d+')
+    PATRON_DECIMAL = re.compile(r'[-+]?(?:\d+\.\d*|\.\d+)')
+    
+    def __init__(self, fuente):
+        self.fuente = fuente
+        self._lectura = None
+        self._filas = None
+        self.codificacion, self.errores = self._detectar_codificacion()
+        with self._abrir_texto() as texto:
+            muestra = texto.read(self.MUESTRA_BYTES)
+        # Sin la última línea, que puede estar cortada
+        if '\n' in muestra.rstrip('\r\n'):
+            muestra = muestra[:muestra.rstrip('\r\n').rfind('\n') + 1]
+        try:
+            dialecto = csv.Sniffer().sniff(muestra, delimiters=self.DELIMITADORES)
+            self.dialecto, self.delimitador = dialecto, dialecto.delimiter
+        except csv.Error:
+            # Muy pocas filas para el Sniffer: el delimitador más frecuente en los encabezados
+            encabezados = muestra.split('\n', 1)[0]
+            self.dialecto = csv.excel
+            self.delimitador = max(self.DELIMITADORES, key=encabezados.count)
+        self.coma_decimal = self.delimitador != ','
+    
+    def _detectar_codificacion(self):
+        """(codificación, manejador de errores) según los primeros KB del archivo"""
+        with abrir_binario(self.fuente) as binario:
+            inicio = binario.read(self.DETECCION_BYTES)
+        if inicio.startswith(codecs.BOM_UTF8):
+            return 'utf-8-sig', 'novaderma-cp1252'
+        if inicio.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+            return 'utf-16', 'replace'
+        try:
+            # Sin final=True: el último carácter de la muestra puede estar cortado
+            codecs.getincrementaldecoder('utf-8')().decode(inicio)
+        except UnicodeDecodeError:
+            # errors='replace': los pocos bytes que Windows-1252 no define no detienen la lectura
+            return 'cp1252', 'replace'
+        return 'utf-8', 'novaderma-cp1252'
+    
+    def _abrir_texto(self):
+        return io.TextIOWrapper(abrir_binario(self.fuente), encoding=self.codificacion, errors=self.errores, newline='')
+    
+    def _registros(self):
+        with self._abrir_texto() as texto:
+            yield from csv.reader(texto, self.dialecto, delimiter=self.delimitador)
+    
+    def _contar(self):
+        return max(sum(1 for _ in self._registros()) - 1, 0)
+    
+    def _valor(self, texto):
+        texto = texto.strip()
+        if not texto:
+            return None
+        if self.PATRON_ENTERO.fullmatch(texto):
+            return int(texto)
+        numero = texto.replace(',', '.', 1) if self.coma_decimal else texto
+        if self.PATRON_DECIMAL.fullmatch(numero):
+            return float(numero)
+        return texto
+    
+    def _tiene_datos(self):
+        registros = self._registros()
+        try:
+            return next(itertools.islice(registros, 1, None), None) is not None
+        finally:
+            registros.close()
+    
+    def hojas(self, contar=True):
+        if self._filas is None:
+            if not contar:
+                return [(self.HOJA, None if self._tiene_datos() else 0)]
+            self._filas = self._contar()
+        return [(self.HOJA, self._filas)]
+    
+    def leer(self, hoja=None):
+        registros = self._lectura = self._registros()
+        encabezados = next(registros, [])
+        filas = (tuple(map(self._valor, registro)) for registro in registros)
+        return max(len(encabezados), 1), self._filas, itertools.chain([tuple(encabezados)], filas)
+    
+    def cerrar(self):
+        if self._lectura is not None:
+            self._lectura.close()
+
+# Lector de cada formato reconocido por detectar_formato
+LECTORES = {'xlsx': LectorXlsx, 'xls': LectorXls, 'csv': LectorCsv}
+
+def abrir_lector(fuente):
+    """Lector del archivo (ruta o bytes), elegido por su contenido y no por la extensión"""
+    formato = detectar_formato(leer_cabecera(fuente))
+    if formato is None:
+        raise ValueError('Formato de archivo no reconocido. Use un libro de Excel (.xlsx o .xls) o un archivo CSV')
+    return LECTORES[formato](fuente)
+
+def iterar_evaluaciones(file_path, progreso=None):
+    """Lee el archivo (Excel o CSV) fila a fila y va entregando cada evaluación procesada.
+    
+    La memoria se mantiene acotada sin importar el número de filas: solo se conservan
+    en memoria las filas de muestra usadas para clasificar las columnas de texto.
+    Si se indica `progreso`, se llama con (filas leídas, filas totales) por cada fila de datos.
+    """
+    for _, evaluacion in iterar_evaluaciones_con_huella(file_path, progreso):
+        yield evaluacion
+
+def iterar_evaluaciones_con_huella(file_path, progreso=None, reutilizar=None, hoja=None, total_filas=None):
+    """Como iterar_evaluaciones, pero entrega (huella, evaluacion) por cada fila.
+    
+    Si se indica `reutilizar`, se llama con la huella de cada fila y, si retorna una
+    evaluación (la misma fila en una carga anterior), se entrega esa en lugar de volver
+    a extraer la fila. Con `hoja` se lee esa hoja en lugar de la hoja activa. `file_path`
+    puede ser también el contenido del archivo en memoria (bytes); el formato se reconoce
+    por el contenido (ver abrir_lector). `total_filas` es el número de filas de datos de la
+    hoja si ya se conoce; si no, se cuentan solo cuando hay que informar el avance.
+    """
+    lector = abrir_lector(file_path)
+    try:
+        max_column, filas_hoja, filas = lector.leer(hoja)
+        if total_filas is None:
+            total_filas = filas_hoja
+        if total_filas is None and progreso is not None:
+            hojas = lector.hojas()
+            total_filas = dict(hojas).get(hoja, hojas[0][1])
+        
+        # Obtener headers
+        primera_fila = next(filas, None) or ()
+        headers = []
+        for col in range(1, max_column + 1):
+            cell_value = primera_fila[col - 1] if col <= len(primera_fila) else None
+            headers.append(cell_value if cell_value else f"Col_{col}")
+        
+        # Filas de muestra para clasificar columnas de texto (no se puede volver atrás en modo solo lectura)
+        muestra = list(itertools.islice(filas, MUESTRA_FILAS_TEXTO))
+        
+        with metricas.cronometrar('novaderma_encabezados_segundos'):
+            # Detectar tipo de evaluación
+            tipo_evaluacion = detectar_tipo_evaluacion(headers)
             
-            # Si hay más texto que números, es columna de texto
-            return texto_count > numero_count and texto_count > 0
+            # Resolver todas las columnas una sola vez para esta hoja
+            plan = PlanColumnas(headers, tipo_evaluacion)
+            plan.clasificar_columnas_texto(muestra)
+        
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Columnas de texto - Comentario: %s, Aportes: %s, Plan: %s",
+                      *(f"{col_idx} ('{headers[col_idx]}')" if col_idx is not None else None
+                        for col_idx in (plan.comentario, plan.aportes, plan.plan)))
+        
+        base = base_huellas(plan.firma())
+        # Detalle de extracción por fila: solo en DEBUG y para una de cada LOG_MUESTREO_FILAS filas
+        depurar_filas = log.isEnabledFor(logging.DEBUG)
         
-        # Procesar filas de datos
-        for row_num in range(2, sheet.max_row + 1):
-            row_data = [sheet.cell(row=row_num, column=col).value for col in range(1, sheet.max_column + 1)]
+        def get_value(row, col_idx):
+            if col_idx is not None and col_idx < len(row):
+                return row[col_idx] if row[col_idx] is not None else ""
+            return ""
+        
+        # Procesar filas de datos (primero las de muestra, luego el resto en streaming)
+        for row_num, row_data in enumerate(itertools.chain(muestra, filas), start=2):
+            if progreso is not None:
+                progreso(row_num - 1, total_filas)
+            detalle = depurar_filas and (row_num - 2) % LOG_MUESTREO_FILAS == 0
             
-            nombre = get_value(row_data, col_nombre)
+            nombre = get_value(row_data, plan.nombre)
             if not nombre or str(nombre).strip() == "":
                 continue
             
+            # Fila sin cambios respecto a la carga anterior: reutilizar la evaluación ya extraída
+            huella = huella_fila(base, row_data)
+            if reutilizar is not None:
+                anterior = reutilizar(huella)
+                if anterior is not None:
+                    anterior['id'] = row_num - 1
+                    yield huella, anterior
+                    continue
+            
             # Extraer calificaciones específicas por tipo
-            calificaciones = extraer_calificaciones_por_categoria(headers, row_data, tipo_evaluacion)
+            calificaciones = extraer_calificaciones_por_categoria(headers, row_data, tipo_evaluacion, plan)
             
             # Calcular promedio inteligente
             promedio = 0
             
             # Prioridad 1: Usar promedio/porcentaje del Excel si existe y es válido
-            if col_promedio is not None:
-                valor_promedio = get_value(row_data, col_promedio)
+            if plan.promedio is not None:
+                valor_promedio = get_value(row_data, plan.promedio)
                 if valor_promedio and isinstance(valor_promedio, (int, float)):
                     try:
                         promedio = float(valor_promedio)
@@ -438,471 +1307,920 @@ def procesar_excel(file_path):
             
             # Obtener textos (buscar en columnas de texto)
             comentario_jefe = ""
-            if col_comentario is not None and es_columna_texto(col_comentario):
-                val = get_value(row_data, col_comentario)
+            if plan.es_texto(plan.comentario):
+                val = get_value(row_data, plan.comentario)
                 # Solo usar si es texto y no un número
                 if val and isinstance(val, str) and len(str(val).strip()) > 5:
                     comentario_jefe = str(val)
             
             aportes = ""
-            if col_aportes is not None and es_columna_texto(col_aportes):
-                val = get_value(row_data, col_aportes)
+            if plan.es_texto(plan.aportes):
+                val = get_value(row_data, plan.aportes)
                 # Solo usar si es texto y no un número
                 if val and isinstance(val, str) and len(str(val).strip()) > 5:
                     aportes = str(val)
             
             plan_mejora = ""
-            if col_plan is not None and es_columna_texto(col_plan):
-                val = get_value(row_data, col_plan)
+            if plan.es_texto(plan.plan):
+                val = get_value(row_data, plan.plan)
                 # Solo usar si es texto y no un número
                 if val and isinstance(val, str) and len(str(val).strip()) > 5:
                     plan_mejora = str(val)
             
-            # Obtener periodo y fecha
-            fecha_evaluacion = get_value(row_data, col_fecha)
-            
-            # Limpiar fecha: eliminar hora si existe y formatear
-            if fecha_evaluacion:
-                fecha_str = str(fecha_evaluacion)
-                # Si es un objeto datetime de Excel
-                if hasattr(fecha_evaluacion, 'strftime'):
-                    fecha_str = fecha_evaluacion.strftime('%Y-%m-%d')
-                else:
-                    # Eliminar hora si existe (formato: "2024-01-15 00:00:00" -> "2024-01-15")
-                    if ' ' in fecha_str:
-                        fecha_str = fecha_str.split(' ')[0]
-                fecha_evaluacion = fecha_str
-            else:
-                fecha_evaluacion = ""
-            
-            # Obtener periodo evaluado con validación
-            periodo_evaluado = ""
-            periodo_temp = ""
+            # Obtener periodo y fecha (si el periodo no es válido, se usa el año de la fecha)
+            fecha_evaluacion = normalizador_fechas.fecha(get_value(row_data, plan.fecha))
+            periodo_temp = str(get_value(row_data, plan.periodo)).strip() if plan.periodo is not None else ""
+            periodo_evaluado, mensajes = normalizador_fechas.periodo(periodo_temp, fecha_evaluacion)
+            if detalle:
+                for mensaje, argumentos in mensajes:
+                    log.debug("[%s] " + mensaje, nombre, *argumentos)
             
-            # Intentar obtener el valor de la columna periodo
-            if col_periodo is not None:
-                periodo_temp = str(get_value(row_data, col_periodo)).strip()
+            evaluacion = {
+                'id': row_num - 1,
+                'nombre': str(nombre).upper(),
+                'cargo': str(get_value(row_data, plan.cargo)).upper(),
+                'area': str(get_value(row_data, plan.area)).upper(),
+                'jefe': str(get_value(row_data, plan.jefe)).upper(),
+                'fecha': fecha_evaluacion,
+                'periodo': periodo_evaluado,
+                'promedio': round(promedio, 1),
+                'rendimiento': calcular_rendimiento(promedio),
+                'comentario_jefe': comentario_jefe.upper(),
+                'aportes': aportes.upper(),
+                'plan_mejora': plan_mejora.upper(),
+                'tipo_evaluacion': tipo_evaluacion,
+                'calificaciones': calificaciones
+            }
             
-            # VALIDACIÓN: Verificar que sea un periodo válido
-            es_periodo_valido = False
-            if periodo_temp and periodo_temp != "None" and periodo_temp != "":
-                # Lista de palabras que indican que NO es un periodo
-                palabras_invalidas = ['ANALISIS', 'ANÁLISIS', 'COMENTARIO', 'OBSERVACION', 
-                                     'OBSERVACIÓN', 'FORTALEZA', 'DEBILIDAD', 'APORTES', 
-                                     'PLAN', 'MEJORA', 'QUE', 'COMO', 'CONSIDERA', 'TRA',
-                                     'BAJO', 'MEDIO', 'ALTO', 'RESPONSABILIDAD', 'GESTION',
-                                     'GESTIÓN']
-                
-                periodo_upper = periodo_temp.upper()
-                contiene_invalida = False
-                
-                for palabra in palabras_invalidas:
-                    if palabra in periodo_upper:
-                        contiene_invalida = True
-                        print(f"[{nombre}] Periodo rechazado: '{periodo_temp}' (contiene '{palabra}')")
-                        break
-                
-                # Validar longitud (un periodo no debería ser muy largo)
-                if len(periodo_temp) > 25:
-                    contiene_invalida = True
-                    print(f"[{nombre}] Periodo rechazado: '{periodo_temp}' (muy largo: {len(periodo_temp)} caracteres)")
-                
-                # Si pasa todas las validaciones, es válido
-                if not contiene_invalida:
-                    es_periodo_valido = True
-                    periodo_evaluado = periodo_temp
-                    print(f"[{nombre}] Periodo aceptado del Excel: '{periodo_evaluado}'")
-            
-            # Si NO hay periodo válido, extraer año de la fecha
-            if not es_periodo_valido or not periodo_evaluado:
-                print(f"[{nombre}] Extrayendo año de fecha: '{fecha_evaluacion}'")
-                
-                try:
-                    from datetime import datetime
-                    import re
-                    
-                    año_extraido = ""
-                    
-                    # Método 1: Parsear fecha en formatos comunes
-                    formatos = ['%Y-%m-%d', '%d/%m/%Y', '%Y/%m/%d', '%d-%m-%Y', '%Y%m%d', '%d.%m.%Y']
-                    for fmt in formatos:
-                        try:
-                            fecha_obj = datetime.strptime(fecha_evaluacion, fmt)
-                            año_extraido = str(fecha_obj.year)
-                            print(f"[{nombre}]   -> Año extraído (formato {fmt}): {año_extraido}")
-                            break
-                        except:
-                            continue
-                    
-                    # Método 2: Buscar patrón de año (20XX o 19XX)
-                    if not año_extraido:
-                        year_match = re.search(r'(19|20)\d{2}', fecha_evaluacion)
-                        if year_match:
-                            año_extraido = year_match.group()
-                            print(f"[{nombre}]   -> Año extraído (regex): {año_extraido}")
-                    
-                    # Método 3: Valor por defecto
-                    if not año_extraido:
-                        año_extraido = "2025"
-                        print(f"[{nombre}]   -> Usando año por defecto: {año_extraido}")
-                    
-                    periodo_evaluado = año_extraido
-                    
-                except Exception as e:
-                    print(f"[{nombre}]   -> Error: {e}, usando 2025")
-                    periodo_evaluado = "2025"
-            
-            evaluacion = {
-                'id': row_num - 1,
-                'nombre': str(nombre).upper(),
-                'cargo': str(get_value(row_data, col_cargo)).upper(),
-                'area': str(get_value(row_data, col_area)).upper(),
-                'jefe': str(get_value(row_data, col_jefe)).upper(),
-                'fecha': fecha_evaluacion,
-                'periodo': periodo_evaluado,
-                'promedio': round(promedio, 1),
-                'rendimiento': calcular_rendimiento(promedio),
-                'comentario_jefe': comentario_jefe.upper(),
-                'aportes': aportes.upper(),
-                'plan_mejora': plan_mejora.upper(),
-                'tipo_evaluacion': tipo_evaluacion,
-                'calificaciones': calificaciones
-            }
-            
-            evaluaciones_data.append(evaluacion)
-        
-        return evaluaciones_data
+            yield huella, evaluacion
+    finally:
+        lector.cerrar()
+
+class Evaluacion:
+    """Evaluación extraída de una fila, en la forma compacta con que vuelve del pool de lectura.
+    
+    Solo se usa para pasar las evaluaciones de una hoja del proceso que la lee al principal
+    (ver leer_hoja), donde esperan su turno hasta que se entregan como dict; el resto de la
+    aplicación trabaja con dicts. En lugar de un dict por fila (con sus 14 claves y otro dict
+    de calificaciones) usa __slots__, comparte entre filas los textos que se repiten (cargo,
+    área, jefe, tipo...) y guarda las calificaciones en un array de floats con el orden fijo
+    de criterios de su tipo de evaluación (COLUMNAS_CALIFICACION); 0 es una calificación no
+    válida, como en el dict. Al serializarla pesa alrededor de un 25% menos que el dict; el
+    resto son los textos propios de cada fila (nombre, comentarios).
+    
+    a_dict() entrega la forma de siempre: la del JSON de las respuestas y la que usan
+    reporte.html y generar_pdf_reportlab.
+    """
+    
+    CAMPOS = ('id', 'nombre', 'cargo', 'area', 'jefe', 'fecha', 'periodo', 'promedio', 'rendimiento',
+              'comentario_jefe', 'aportes', 'plan_mejora', 'tipo_evaluacion')
+    # Campos que solo están en las evaluaciones de una carga (origen de la fila)
+    CAMPOS_OPCIONALES = ('archivo', 'hoja')
+    # Textos que se repiten entre filas y se comparten en memoria
+    CAMPOS_COMPARTIDOS = ('cargo', 'area', 'jefe', 'fecha', 'periodo', 'rendimiento', 'tipo_evaluacion',
+                          'archivo', 'hoja')
+    
+    __slots__ = CAMPOS + CAMPOS_OPCIONALES + ('criterios', 'calificaciones')
+    
+    # Orden de los criterios de cada tipo de evaluación: se arma con COLUMNAS_CALIFICACION en
+    # cada proceso, así que no viaja con cada evaluación. Solo una evaluación cuyas
+    # calificaciones no siguen el orden de su tipo guarda el suyo en `criterios`
+    CRITERIOS = {tipo: tuple(columnas) for tipo, columnas in COLUMNAS_CALIFICACION.items()}
+    
+    @classmethod
+    def desde_dict(cls, datos):
+        """Evaluación compacta a partir del dict extraído de una fila (o leído del almacén)"""
+        evaluacion = cls()
+        for campo in cls.CAMPOS + cls.CAMPOS_OPCIONALES:
+            valor = datos.get(campo)
+            if campo in cls.CAMPOS_COMPARTIDOS and isinstance(valor, str):
+                valor = sys.intern(valor)
+            setattr(evaluacion, campo, valor)
+        calificaciones = datos.get('calificaciones') or {}
+        criterios = tuple(calificaciones)
+        evaluacion.criterios = None if criterios == cls.CRITERIOS.get(evaluacion.tipo_evaluacion, ()) else criterios
+        evaluacion.calificaciones = array.array('d', calificaciones.values())
+        return evaluacion
+    
+    def __getstate__(self):
+        # Solo los valores, en el orden de __slots__: sin el nombre de cada campo en cada evaluación
+        return tuple(getattr(self, campo) for campo in self.__slots__)
+    
+    def __setstate__(self, estado):
+        for campo, valor in zip(self.__slots__, estado):
+            setattr(self, campo, valor)
+    
+    def a_dict(self):
+        """Dict de la evaluación, idéntico al que se extrajo de la fila"""
+        datos = {campo: getattr(self, campo) for campo in self.CAMPOS}
+        criterios = self.criterios if self.criterios is not None else self.CRITERIOS.get(self.tipo_evaluacion, ())
+        # Las calificaciones no válidas vuelven a ser el entero 0, como las deja valor_calificacion
+        datos['calificaciones'] = {criterio: valor if valor else 0
+                                   for criterio, valor in zip(criterios, self.calificaciones)}
+        for campo in self.CAMPOS_OPCIONALES:
+            valor = getattr(self, campo)
+            if valor is not None:
+                datos[campo] = valor
+        return datos
+
+def como_dict(evaluacion):
+    """Forma de dict de una evaluación, sea compacta (Evaluacion) o ya un dict"""
+    return evaluacion.a_dict() if isinstance(evaluacion, Evaluacion) else evaluacion
+
+def procesar_excel(file_path):
+    """Procesa todas las hojas del archivo Excel y extrae las evaluaciones"""
+    try:
+        return [evaluacion for _, evaluacion in iterar_carga([(file_path, os.path.basename(file_path))])]
         
     except Exception as e:
-        print(f"Error al procesar Excel: {e}")
+        log.error("Error al procesar Excel: %s", e, exc_info=con_traza())
         raise e
 
-def generar_pdf_reportlab(evaluacion):
-    """Genera PDF usando ReportLab replicando exactamente el diseño del HTML original"""
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=0.5*inch, bottomMargin=0.5*inch, 
-                           leftMargin=0.5*inch, rightMargin=0.5*inch)
-    
-    # Estilos que replican el CSS original
-    styles = getSampleStyleSheet()
-    
-    # Estilo para el título principal
-    main_title_style = ParagraphStyle(
-        'MainTitle',
-        parent=styles['Heading1'],
-        fontSize=16,
-        spaceAfter=6,
-        alignment=1,  # Centrado
-        fontName='Helvetica-Bold',
-        textColor=colors.black
-    )
-    
-    # Estilo para subtítulo
-    subtitle_style = ParagraphStyle(
-        'Subtitle',
-        parent=styles['Normal'],
-        fontSize=11,
-        spaceAfter=12,
-        alignment=1,  # Centrado
-        fontName='Helvetica',
-        textColor=colors.black
-    )
-    
-    # Estilo para títulos de sección
-    section_title_style = ParagraphStyle(
-        'SectionTitle',
-        parent=styles['Heading2'],
-        fontSize=12,
-        spaceAfter=6,
-        spaceBefore=12,
-        fontName='Helvetica-Bold',
-        textColor=colors.black,
-        borderWidth=1,
-        borderColor=colors.lightgrey,
-        borderPadding=3
-    )
-    
-    # Estilo para texto normal
-    normal_style = ParagraphStyle(
-        'CustomNormal',
-        parent=styles['Normal'],
-        fontSize=11,
-        spaceAfter=3,
-        fontName='Helvetica',
-        textColor=colors.black
-    )
-    
-    # Estilo para labels en negrita
-    label_style = ParagraphStyle(
-        'LabelStyle',
-        parent=styles['Normal'],
-        fontSize=11,
-        spaceAfter=3,
-        fontName='Helvetica-Bold',
-        textColor=colors.black
-    )
-    
-    story = []
-    
-    # === HEADER CON LOGO Y CÓDIGOS ===
-    # Intentar cargar el logo
-    logo_path = os.path.join('static', 'logo.png')
-    header_data = []
-    
-    if os.path.exists(logo_path):
-        from reportlab.lib.utils import ImageReader
-        try:
-            # Crear tabla para el header con logo y códigos
-            logo_img = ImageReader(logo_path)
-            # Redimensionar logo a altura máxima de 45px (como en CSS)
-            logo_height = 45
-            logo_width = logo_height * (logo_img.getSize()[0] / logo_img.getSize()[1])
-            
-            header_data = [
-                [
-                    # Logo
-                    logo_img,
-                    # Códigos
-                    Paragraph("<b>CODIGO:</b> FT-RH-042<br/><b>VERSION:</b> 1<br/><b>VIGENCIA:</b> 2026/02/03", 
-                             ParagraphStyle('CodeStyle', parent=styles['Normal'], fontSize=10, alignment=2))
-                ]
-            ]
-            
-            header_table = Table(header_data, colWidths=[2*inch, 2*inch])
-            header_table.setStyle(TableStyle([
-                ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-                ('ALIGN', (0, 0), (0, 0), 'LEFT'),   # Logo a la izquierda
-                ('ALIGN', (1, 0), (1, 0), 'RIGHT'),  # Códigos a la derecha
-                ('LEFTPADDING', (0, 0), (-1, -1), 0),
-                ('RIGHTPADDING', (0, 0), (-1, -1), 0),
-                ('TOPPADDING', (0, 0), (-1, -1), 0),
-                ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-            ]))
+@contextmanager
+def transaccion(conexion):
+    """Confirma la transacción al salir (o la revierte si hubo error) y cierra la conexión"""
+    try:
+        with conexion:
+            yield conexion
+    finally:
+        conexion.close()
+
+class AlmacenCargas:
+    """Almacén compartido de cargas procesadas, en SQLite sobre disco local.
+    
+    Cada carga recibe un upload_id y expira después de `ttl` segundos. Al ser un archivo
+    compartido, todos los workers de gunicorn ven las mismas cargas, y el navegador solo
+    necesita enviar upload_id + id de evaluación para generar un PDF.
+    
+    Las cargas en segundo plano pasan por los estados 'procesando' -> 'completada' o 'error';
+    mientras se procesan ya se pueden leer las evaluaciones guardadas hasta el momento.
+    """
+    
+    # Columnas añadidas después de la primera versión del esquema (para bases ya existentes)
+    COLUMNAS_NUEVAS = {
+        'cargas': {
+            'estado': "TEXT NOT NULL DEFAULT 'completada'",
+            'filas_leidas': 'INTEGER NOT NULL DEFAULT 0',
+            'filas_totales': 'INTEGER NOT NULL DEFAULT 0',
+            'error': 'TEXT',
+            'actualizada': 'REAL',
+            'cambios': 'TEXT',
+            'firma': 'TEXT',
+        },
+        'evaluaciones': {
+            'huella': 'TEXT',
+            # Campos por los que se filtra y ordena la consulta (ver COLUMNAS_CONSULTA); promedio sin
+            # tipo para guardar el número tal como lo entrega json_extract (entero o real)
+            'nombre': 'TEXT',
+            'cargo': 'TEXT',
+            'area': 'TEXT',
+            'jefe': 'TEXT',
+            'tipo_evaluacion': 'TEXT',
+            'promedio': '',
+            'rendimiento': 'TEXT',
+            'orden_rendimiento': 'INTEGER',
+        },
+    }
+    
+    # Valor de cada columna de la consulta a partir del JSON de la evaluación; el rendimiento se
+    # ordena de Deficiente a Sobresaliente. Se calculan al guardar cada evaluación para que la
+    # consulta filtre y ordene por columnas indexadas en lugar de leer el JSON de cada fila
+    COLUMNAS_CONSULTA = {
+        **{campo: f"COALESCE(json_extract(datos, '$.{campo}'), '')"
+           for campo in ('nombre', 'cargo', 'area', 'jefe', 'tipo_evaluacion', 'rendimiento')},
+        'promedio': "COALESCE(json_extract(datos, '$.promedio'), 0)",
+        'orden_rendimiento': "CASE json_extract(datos, '$.rendimiento') {} ELSE -1 END".format(
+            ' '.join(f"WHEN '{rendimiento}' THEN {i}" for i, rendimiento in enumerate(RENDIMIENTOS))),
+    }
+    # Expresión SQL por la que se ordena cada campo, con un índice (upload_id, columna, eval_id)
+    ORDEN_CONSULTA = {
+        'id': 'e.eval_id',
+        'nombre': 'e.nombre',
+        'cargo': 'e.cargo',
+        'area': 'e.area',
+        'jefe': 'e.jefe',
+        'promedio': 'e.promedio',
+        'rendimiento': 'e.orden_rendimiento',
+    }
+    
+    def __init__(self, ruta, ttl, inactividad):
+        self.ruta = ruta
+        self.ttl = ttl
+        self.inactividad = inactividad
+        os.makedirs(os.path.dirname(ruta) or '.', exist_ok=True)
+        with self._conectar() as conexion:
+            conexion.execute('PRAGMA journal_mode=WAL')
+            conexion.execute("""
+                CREATE TABLE IF NOT EXISTS cargas (
+                    upload_id TEXT PRIMARY KEY,
+                    nombre_archivo TEXT,
+                    creada REAL NOT NULL,
+                    expira REAL NOT NULL,
+                    total INTEGER NOT NULL DEFAULT 0
+                )""")
+            conexion.execute("""
+                CREATE TABLE IF NOT EXISTS evaluaciones (
+                    upload_id TEXT NOT NULL,
+                    eval_id INTEGER NOT NULL,
+                    datos TEXT NOT NULL,
+                    PRIMARY KEY (upload_id, eval_id)
+                )""")
+            agregadas = set()
+            for tabla, columnas in self.COLUMNAS_NUEVAS.items():
+                existentes = {fila[1] for fila in conexion.execute(f'PRAGMA table_info({tabla})')}
+                for columna, definicion in columnas.items():
+                    if columna not in existentes:
+                        conexion.execute(f'ALTER TABLE {tabla} ADD COLUMN {columna} {definicion}')
+                        agregadas.add(columna)
+            if agregadas & set(self.COLUMNAS_CONSULTA):
+                # Evaluaciones guardadas antes de existir las columnas de la consulta
+                conexion.execute('UPDATE evaluaciones SET ' + ', '.join(
+                    f'{columna} = {expresion}' for columna, expresion in self.COLUMNAS_CONSULTA.items()))
+            conexion.execute('CREATE INDEX IF NOT EXISTS cargas_firma ON cargas (firma, creada)')
+            for expresion in self.ORDEN_CONSULTA.values():
+                columna = expresion.removeprefix('e.')
+                if columna != 'eval_id':
+                    conexion.execute(f'CREATE INDEX IF NOT EXISTS evaluaciones_{columna} '
+                                     f'ON evaluaciones (upload_id, {columna}, eval_id)')
+    
+    def _conectar(self):
+        # Una conexión por operación: seguro entre hilos y procesos
+        return transaccion(sqlite3.connect(self.ruta, timeout=30))
+    
+    def crear(self, nombre_archivo='', estado='procesando'):
+        """Registra una carga vacía y retorna su upload_id"""
+        self.limpiar_expiradas()
+        upload_id = uuid.uuid4().hex
+        ahora = time.time()
+        with self._conectar() as conexion:
+            conexion.execute("""
+                INSERT INTO cargas (upload_id, nombre_archivo, creada, expira, total, estado, actualizada)
+                VALUES (?, ?, ?, ?, 0, ?, ?)""",
+                (upload_id, nombre_archivo, ahora, ahora + self.ttl, estado, ahora))
+        return upload_id
+    
+    def agregar(self, upload_id, evaluaciones, filas_leidas=None, filas_totales=None, huellas=None):
+        """Añade evaluaciones (con la huella de su fila, si se indica) y actualiza el avance en la misma transacción"""
+        huellas = huellas or itertools.repeat(None)
+        filas = [(upload_id, evaluacion['id'], json.dumps(evaluacion, ensure_ascii=False), huella)
+                 for evaluacion, huella in zip(evaluaciones, huellas)]
+        with self._conectar() as conexion:
+            conexion.executemany(f"""
+                INSERT OR REPLACE INTO evaluaciones (upload_id, eval_id, datos, huella, {', '.join(self.COLUMNAS_CONSULTA)})
+                SELECT upload_id, eval_id, datos, huella, {', '.join(self.COLUMNAS_CONSULTA.values())}
+                FROM (SELECT ? AS upload_id, ? AS eval_id, ? AS datos, ? AS huella)""", filas)
+            conexion.execute("""
+                UPDATE cargas SET total = total + ?,
+                    filas_leidas = COALESCE(?, filas_leidas),
+                    filas_totales = COALESCE(?, filas_totales),
+                    actualizada = ?
+                WHERE upload_id = ?""",
+                (len(filas), filas_leidas, filas_totales, time.time(), upload_id))
+    
+    def tocar(self, upload_id):
+        """Registra que la carga sigue en curso aunque no haya evaluaciones nuevas que guardar"""
+        with self._conectar() as conexion:
+            conexion.execute('UPDATE cargas SET actualizada = ? WHERE upload_id = ?', (time.time(), upload_id))
+    
+    def finalizar(self, upload_id, error=None, cambios=None, firma=None):
+        """Marca la carga como completada (con el resumen de cambios, si hubo carga anterior, y la firma de su estructura) o como fallida"""
+        with self._conectar() as conexion:
+            conexion.execute("""
+                UPDATE cargas SET estado = ?, error = ?, cambios = ?, firma = ?, actualizada = ?,
+                    filas_leidas = CASE WHEN ? IS NULL THEN filas_totales ELSE filas_leidas END
+                WHERE upload_id = ?""",
+                ('error' if error else 'completada', error,
+                 json.dumps(cambios) if cambios is not None else None, firma, time.time(), error, upload_id))
+    
+    def guardar(self, evaluaciones, nombre_archivo='', huellas=None, cambios=None, firma=None):
+        """Guarda una carga completa y retorna su upload_id"""
+        evaluaciones = list(evaluaciones)
+        upload_id = self.crear(nombre_archivo)
+        self.agregar(upload_id, evaluaciones, len(evaluaciones), len(evaluaciones), huellas)
+        self.finalizar(upload_id, cambios=cambios, firma=firma)
+        return upload_id
+    
+    def cargas_candidatas(self, firma, nombre_archivo='', solicitada=None, limite=5):
+        """upload_ids de las cargas completadas con esa firma de estructura, con las que comparar una carga nueva.
+        
+        Con `solicitada` (el upload_anterior que envió el cliente) solo se considera esa carga,
+        y únicamente si tiene la misma firma; si no, las `limite` más recientes con esa firma,
+        primero las del mismo nombre de archivo.
+        """
+        with self._conectar() as conexion:
+            if solicitada:
+                filas = conexion.execute("""
+                    SELECT upload_id FROM cargas
+                    WHERE upload_id = ? AND firma = ? AND estado = 'completada' AND expira > ?""",
+                    (solicitada, firma, time.time())).fetchall()
+            else:
+                filas = conexion.execute("""
+                    SELECT upload_id FROM cargas
+                    WHERE firma = ? AND estado = 'completada' AND expira > ?
+                    ORDER BY nombre_archivo = ? DESC, creada DESC LIMIT ?""",
+                    (firma, time.time(), nombre_archivo, limite)).fetchall()
+        return [fila[0] for fila in filas]
+    
+    def colaboradores_por_huella(self, upload_id):
+        """{huella: (id, nombre)} de las evaluaciones de una carga, sin decodificar sus datos completos"""
+        with self._conectar() as conexion:
+            cursor = conexion.execute("""
+                SELECT huella, eval_id, json_extract(datos, '$.nombre') FROM evaluaciones
+                WHERE upload_id = ? AND huella IS NOT NULL""", (upload_id,))
+            return {huella: (eval_id, nombre) for huella, eval_id, nombre in cursor}
+    
+    def evaluaciones_por_huella(self, upload_id):
+        """Evaluaciones de una carga indexadas por la huella de su fila"""
+        with self._conectar() as conexion:
+            cursor = conexion.execute('SELECT huella, datos FROM evaluaciones WHERE upload_id = ? AND huella IS NOT NULL',
+                                      (upload_id,))
+            return {huella: json.loads(datos) for huella, datos in cursor}
+    
+    def estado(self, upload_id):
+        """Retorna el estado y avance de la carga, o None si expiró o no existe"""
+        with self._conectar() as conexion:
+            fila = conexion.execute("""
+                SELECT estado, filas_leidas, filas_totales, total, error, actualizada, nombre_archivo, cambios
+                FROM cargas WHERE upload_id = ? AND expira > ?""",
+                (upload_id, time.time())).fetchone()
+        if fila is None:
+            return None
+        estado, filas_leidas, filas_totales, total, error, actualizada, nombre_archivo, cambios = fila
+        # Si el worker que procesaba la carga murió, el estado quedaría en 'procesando' para siempre
+        if estado == 'procesando' and actualizada is not None and time.time() - actualizada > self.inactividad:
+            estado = 'error'
+            error = 'El procesamiento se interrumpió. Vuelva a subir el archivo.'
+        return {
+            'upload_id': upload_id,
+            'estado': estado,
+            'filas_leidas': filas_leidas,
+            'filas_totales': filas_totales,
+            'total': total,
+            'error': error,
+            'archivo': nombre_archivo,
+            'cambios': json.loads(cambios) if cambios else None,
+        }
+    
+    def existe(self, upload_id):
+        with self._conectar() as conexion:
+            fila = conexion.execute('SELECT 1 FROM cargas WHERE upload_id = ? AND expira > ?',
+                                    (upload_id, time.time())).fetchone()
+        return fila is not None
+    
+    def obtener_evaluacion(self, upload_id, eval_id):
+        """Retorna una evaluación de la carga, o None si la carga expiró o no existe"""
+        with self._conectar() as conexion:
+            fila = conexion.execute("""
+                SELECT e.datos FROM evaluaciones e JOIN cargas c ON c.upload_id = e.upload_id
+                WHERE e.upload_id = ? AND e.eval_id = ? AND c.expira > ?""",
+                (upload_id, eval_id, time.time())).fetchone()
+        return json.loads(fila[0]) if fila else None
+    
+    def iterar_evaluaciones(self, upload_id, desde=0):
+        """Recorre las evaluaciones de una carga en orden, sin cargarlas todas en memoria.
+        
+        Con `desde` solo se entregan las evaluaciones con id mayor (resultados parciales).
+        """
+        with self._conectar() as conexion:
+            cursor = conexion.execute('SELECT datos FROM evaluaciones WHERE upload_id = ? AND eval_id > ? ORDER BY eval_id',
+                                      (upload_id, desde))
+            for (datos,) in cursor:
+                yield json.loads(datos)
+    
+    # Campos de las filas resumidas de la consulta (sin comentarios, aportes ni calificaciones)
+    CAMPOS_RESUMEN = ('nombre', 'cargo', 'area', 'jefe', 'tipo_evaluacion', 'promedio', 'rendimiento')
+    FILTROS_CONSULTA = ('area', 'cargo', 'jefe', 'rendimiento', 'tipo_evaluacion')
+    def consultar(self, upload_id, filtros=None, buscar='', orden='id', descendente=False, limite=50, cursor=None):
+        """Una página de evaluaciones resumidas de la carga, filtradas y ordenadas.
+        
+        `filtros` es {campo: [valores]} sobre FILTROS_CONSULTA (sin distinguir mayúsculas) y
+        `buscar` busca un texto en nombre, cargo o área. Se filtra y ordena por las columnas de
+        COLUMNAS_CONSULTA; cada orden tiene su índice, así que una página sin filtros lee solo
+        sus filas. La paginación es por cursor: el cursor es (valor de orden, id) de la última
+        fila entregada y la página siguiente empieza en él, aunque la carga cambie entre una y
+        otra. El total recorre las columnas de todas las filas de la carga, sin leer su JSON.
+        Retorna (filas, siguiente_cursor, total)
+        con siguiente_cursor None en la última página, o None si la carga expiró o no existe.
+        """
+        condiciones = ['e.upload_id = ?']
+        parametros = [upload_id]
+        for campo, valores in (filtros or {}).items():
+            valores = [str(valor).strip().upper() for valor in valores if str(valor).strip()]
+            if campo not in self.FILTROS_CONSULTA or not valores:
+                continue
+            condiciones.append(f"UPPER(TRIM(e.{campo})) IN ({', '.join('?' * len(valores))})")
+            parametros.extend(valores)
+        if buscar:
+            busqueda = ' OR '.join(f"instr(UPPER(e.{campo}), ?) > 0" for campo in ('nombre', 'cargo', 'area'))
+            condiciones.append(f'({busqueda})')
+            parametros.extend([buscar.strip().upper()] * 3)
+        
+        expresion = self.ORDEN_CONSULTA[orden]
+        comparacion, sentido = ('<', 'DESC') if descendente else ('>', 'ASC')
+        columnas = ', '.join(f"json_extract(e.datos, '$.{campo}')" for campo in self.CAMPOS_RESUMEN)
+        
+        with self._conectar() as conexion:
+            if not conexion.execute('SELECT 1 FROM cargas WHERE upload_id = ? AND expira > ?',
+                                    (upload_id, time.time())).fetchone():
+                return None
             
-            story.append(header_table)
+            filtro = ' AND '.join(condiciones)
+            total = conexion.execute(f'SELECT COUNT(*) FROM evaluaciones e WHERE {filtro}', parametros).fetchone()[0]
+            if cursor is not None:
+                valor, ultimo_id = cursor
+                filtro += f' AND ({expresion} {comparacion} ? OR ({expresion} = ? AND e.eval_id {comparacion} ?))'
+                parametros = parametros + [valor, valor, ultimo_id]
             
-        except Exception as e:
-            print(f"Error cargando logo: {e}")
-            # Fallback sin logo
-            header_data = [
-                [
-                    Paragraph("<b>LABORATORIOS NOVADERMA S.A.</b>", 
-                             ParagraphStyle('CompanyName', parent=styles['Normal'], fontSize=20, fontName='Helvetica-Bold')),
-                    Paragraph("<b>CODIGO:</b> FT-RH-042<br/><b>VERSION:</b> 1<br/><b>VIGENCIA:</b> 2026/02/03", 
-                             ParagraphStyle('CodeStyle', parent=styles['Normal'], fontSize=10, alignment=2))
-                ]
-            ]
-            header_table = Table(header_data, colWidths=[4*inch, 2*inch])
-            header_table.setStyle(TableStyle([
-                ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-                ('ALIGN', (0, 0), (0, 0), 'LEFT'),
-                ('ALIGN', (1, 0), (1, 0), 'RIGHT'),
-                ('LEFTPADDING', (0, 0), (-1, -1), 0),
-                ('RIGHTPADDING', (0, 0), (-1, -1), 0),
-                ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
-            ]))
-            story.append(header_table)
+            filas = conexion.execute(f"""
+                SELECT e.eval_id, {expresion}, {columnas} FROM evaluaciones e
+                WHERE {filtro}
+                ORDER BY {expresion} {sentido}, e.eval_id {sentido}
+                LIMIT ?""", parametros + [limite + 1]).fetchall()
+        
+        siguiente = None
+        if len(filas) > limite:
+            filas = filas[:limite]
+            siguiente = (filas[-1][1], filas[-1][0])
+        evaluaciones = [dict(zip(('id',) + self.CAMPOS_RESUMEN, (fila[0],) + fila[2:])) for fila in filas]
+        return evaluaciones, siguiente, total
+    
+    def limpiar_expiradas(self):
+        ahora = time.time()
+        with self._conectar() as conexion:
+            conexion.execute('DELETE FROM evaluaciones WHERE upload_id IN (SELECT upload_id FROM cargas WHERE expira <= ?)', (ahora,))
+            conexion.execute('DELETE FROM cargas WHERE expira <= ?', (ahora,))
+
+almacen_cargas = AlmacenCargas(CARGAS_DB_PATH, CARGAS_TTL_HORAS * 3600, CARGAS_INACTIVIDAD)
+
+class ComparacionCarga:
+    """Compara una carga con la carga anterior del mismo libro usando las huellas de fila.
+    
+    Las candidatas se eligen al planificar la lectura (preparar), por la firma de estructura
+    de la carga: la que indicó el cliente, solo si tiene la misma firma, o las más recientes
+    con esa firma. Las filas cuya huella ya existía en la primera candidata se reutilizan sin
+    volver a extraerlas. Dos libros del mismo formulario tienen la misma estructura, así que
+    al terminar se toma como carga anterior la candidata con más filas idénticas, y solo si
+    se repiten al menos COINCIDENCIA_MINIMA de las filas de la carga más chica; si no, no hay
+    resumen de cambios. Respecto a ella, las filas distintas se clasifican como modificadas
+    (el colaborador ya estaba en la carga anterior) o agregadas, y los colaboradores de la
+    carga anterior que ya no aparecen se reportan como eliminados.
+    """
+    
+    COINCIDENCIA_MINIMA = 0.5
+    
+    def __init__(self, nombre_archivo='', solicitada=None):
+        self.nombre_archivo = nombre_archivo
+        # Solo se considera un upload_id bien formado
+        self.solicitada = solicitada if solicitada and re.fullmatch(r'[0-9a-f]{32}', solicitada) else None
+        self.firma = None
+        self.candidatas = {}
+        # Carga de la que se reutilizan las filas idénticas mientras se lee
+        self.upload_anterior = None
+        self.anteriores = {}
+        # (huella, id, nombre) de cada fila nueva, para compararlas al final
+        self.filas = []
+    
+    def preparar(self, firma):
+        """Busca las cargas candidatas según la firma de estructura de esta carga y lee sus huellas"""
+        self.firma = firma
+        candidatas = almacen_cargas.cargas_candidatas(firma, self.nombre_archivo, self.solicitada)
+        if not candidatas:
+            if self.solicitada:
+                log.info("Carga anterior %s ignorada: no existe o tiene otra estructura", self.solicitada)
+            return
+        self.candidatas = {upload_id: almacen_cargas.colaboradores_por_huella(upload_id) for upload_id in candidatas}
+        self.upload_anterior = candidatas[0]
+        self.anteriores = almacen_cargas.evaluaciones_por_huella(self.upload_anterior)
+    
+    def reutilizar(self, huella):
+        """Evaluación ya extraída de una fila idéntica en la carga anterior, o None"""
+        anterior = self.anteriores.get(huella)
+        return dict(anterior) if anterior is not None else None
+    
+    def registrar(self, huella, evaluacion):
+        if self.candidatas:
+            self.filas.append((huella, evaluacion['id'], evaluacion['nombre']))
+    
+    def resumen(self):
+        """Cambios respecto a la carga anterior del mismo libro, o None si no hay una"""
+        if not self.candidatas:
+            return None
+        upload_anterior, anteriores = max(
+            self.candidatas.items(), key=lambda candidata: sum(huella in candidata[1] for huella, _, _ in self.filas))
+        sin_cambios = sum(huella in anteriores for huella, _, _ in self.filas)
+        if sin_cambios < self.COINCIDENCIA_MINIMA * min(len(anteriores), len(self.filas)):
+            log.info("Sin carga anterior del mismo libro: la más parecida (%s) comparte %d filas",
+                     upload_anterior, sin_cambios)
+            return None
+        
+        # Ids de la carga anterior por colaborador, que se van emparejando con las filas nuevas
+        pendientes = {}
+        for eval_id, nombre in anteriores.values():
+            pendientes.setdefault(nombre, []).append(eval_id)
+        agregadas = []
+        modificadas = []
+        for huella, eval_id, nombre in self.filas:
+            anterior = anteriores.get(huella)
+            ids = pendientes.get(nombre)
+            if anterior is not None:
+                if ids and anterior[0] in ids:
+                    ids.remove(anterior[0])
+            elif ids:
+                ids.pop(0)
+                modificadas.append(eval_id)
+            else:
+                agregadas.append(eval_id)
+        eliminadas = sorted(
+            ({'id': eval_id, 'nombre': nombre} for nombre, ids in pendientes.items() for eval_id in ids),
+            key=lambda eliminada: eliminada['id'])
+        return {
+            'upload_anterior': upload_anterior,
+            'agregadas': agregadas,
+            'modificadas': modificadas,
+            'eliminadas': eliminadas,
+            'sin_cambios': sin_cambios,
+            # Evaluaciones cuyo PDF hay que volver a generar; el resto sale de la caché
+            'por_renderizar': sorted(agregadas + modificadas),
+        }
+
+def planificar_hojas(archivos, contar=True):
+    """Una tarea de lectura por cada hoja con datos de los archivos [(origen, nombre_archivo)], en orden.
+    
+    El origen es una ruta o un ArchivoSubido; la tarea lleva su `fuente` (la ruta o, si el
+    archivo está en memoria, sus bytes), que se puede enviar a otro proceso. `base` es el
+    número de filas de datos de las hojas anteriores: desplaza los ids para que sean únicos
+    en toda la carga (con una sola hoja los ids siguen siendo fila - 1); `encabezados` entra
+    en la firma de estructura de la carga (ver firma_estructura). Con contar=False,
+    las filas de un CSV se cuentan solo si le siguen otros archivos; si no, `filas` es None.
+    """
+    tareas = []
+    base = 0
+    for posicion, (origen, nombre_archivo) in enumerate(archivos):
+        fuente = origen.fuente() if isinstance(origen, ArchivoSubido) else origen
+        with abrir_lector(fuente) as lector:
+            for hoja, filas in lector.hojas(contar=contar or posicion < len(archivos) - 1):
+                if filas == 0:
+                    continue
+                tareas.append({'fuente': fuente, 'archivo': nombre_archivo, 'hoja': hoja, 'base': base, 'filas': filas,
+                               'encabezados': lector.encabezados(hoja)})
+                base += filas or 0
+    return tareas
+
+def iterar_hoja(tarea, reutilizar=None, progreso=None):
+    """(huella, evaluacion) de una hoja, con el id desplazado y el archivo y hoja de origen"""
+    for huella, evaluacion in iterar_evaluaciones_con_huella(tarea['fuente'], progreso, reutilizar, tarea['hoja'], tarea['filas']):
+        evaluacion['id'] += tarea['base']
+        evaluacion['archivo'] = tarea['archivo']
+        evaluacion['hoja'] = tarea['hoja']
+        yield huella, evaluacion
+
+def leer_hoja(tarea, upload_anterior=None):
+    """Lee una hoja completa dentro de un proceso del pool de lectura.
+    
+    Las filas sin cambios se toman de la carga anterior leyendo el almacén desde el
+    propio proceso, sin pasar las evaluaciones anteriores entre procesos. Las evaluaciones
+    vuelven como Evaluacion compactas: pesan menos al serializarlas y mientras esperan su
+    turno en el proceso principal.
+    """
+    reutilizar = None
+    if upload_anterior:
+        anteriores = almacen_cargas.evaluaciones_por_huella(upload_anterior)
+        
+        def reutilizar(huella):
+            anterior = anteriores.get(huella)
+            return dict(anterior) if anterior is not None else None
+    try:
+        return [(huella, Evaluacion.desde_dict(evaluacion)) for huella, evaluacion in iterar_hoja(tarea, reutilizar)]
+    finally:
+        metricas.guardar()
+
+_pool_lectura = None
+_lock_pool_lectura = threading.Lock()
+
+def pool_lectura():
+    """Pool de procesos para leer hojas en paralelo (se crea en el primer uso, uno por worker de gunicorn)"""
+    global _pool_lectura
+    with _lock_pool_lectura:
+        if _pool_lectura is None:
+            log.info("Iniciando pool de lectura de Excel con %d procesos", CARGAS_PROCESOS)
+            _pool_lectura = ProcessPoolExecutor(max_workers=CARGAS_PROCESOS)
+        return _pool_lectura
+
+def cerrar_pool_lectura(pool=None):
+    """Cierra el pool de lectura (o lo descarta si es `pool` y se rompió); el siguiente uso crea otro"""
+    global _pool_lectura
+    with _lock_pool_lectura:
+        if pool is not None and _pool_lectura is not pool:
+            return
+        pool, _pool_lectura = _pool_lectura, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+atexit.register(cerrar_pool_lectura)
+
+def iterar_carga(archivos, comparacion=None, progreso=None, latido=None):
+    """(huella, evaluacion) de todas las hojas de los archivos [(origen, nombre_archivo)], en orden.
+    
+    Con varias hojas, cada una se lee en su propio proceso del pool de lectura y el tiempo
+    total se acerca al de la hoja más lenta; una sola hoja se lee en este proceso. Mientras
+    se espera una hoja del pool se llama a `latido` cada CARGAS_INACTIVIDAD / 4 segundos,
+    para que una hoja grande no haga pasar la carga por interrumpida. La
+    comparación elige su carga anterior con la firma de estructura de estas hojas; las filas
+    sin cambios respecto a ella se reutilizan y todas se registran en la comparación.
+    """
+    # Sin avance que informar no hace falta contar las filas de un CSV antes de leerlo
+    tareas = planificar_hojas(archivos, contar=progreso is not None)
+    filas_totales = sum(tarea['filas'] or 0 for tarea in tareas)
+    upload_anterior = None
+    if comparacion is not None:
+        comparacion.preparar(firma_estructura(tareas))
+        upload_anterior = comparacion.upload_anterior
+    reutilizar = comparacion.reutilizar if upload_anterior else None
+    
+    if len(tareas) <= 1 or CARGAS_PROCESOS <= 0:
+        def avance(tarea):
+            if progreso is None:
+                return None
+            return lambda filas_leidas, _: progreso(tarea['base'] + filas_leidas, filas_totales)
+        resultados = (iterar_hoja(tarea, reutilizar, avance(tarea)) for tarea in tareas)
     else:
-        # Sin logo disponible
-        header_data = [
-            [
-                Paragraph("<b>LABORATORIOS NOVADERMA S.A.</b>", 
-                         ParagraphStyle('CompanyName', parent=styles['Normal'], fontSize=20, fontName='Helvetica-Bold')),
-                Paragraph("<b>CODIGO:</b> FT-RH-042<br/><b>VERSION:</b> 1<br/><b>VIGENCIA:</b> 2026/02/03", 
-                         ParagraphStyle('CodeStyle', parent=styles['Normal'], fontSize=10, alignment=2))
-            ]
-        ]
-        header_table = Table(header_data, colWidths=[4*inch, 2*inch])
-        header_table.setStyle(TableStyle([
-            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-            ('ALIGN', (0, 0), (0, 0), 'LEFT'),
-            ('ALIGN', (1, 0), (1, 0), 'RIGHT'),
-            ('LEFTPADDING', (0, 0), (-1, -1), 0),
-            ('RIGHTPADDING', (0, 0), (-1, -1), 0),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
-        ]))
-        story.append(header_table)
-    
-    # === TÍTULOS PRINCIPALES ===
-    story.append(Paragraph("RESULTADOS EVALUACIÓN DE DESEMPEÑO LABORAL", main_title_style))
-    story.append(Paragraph("Evaluación de desempeño y competencias del trabajador", subtitle_style))
-    
-    # === SECCIÓN 1: DATOS DE IDENTIFICACIÓN ===
-    story.append(Paragraph("1. Datos de identificación del colaborador", section_title_style))
-    
-    datos_identificacion = [
-        ["Empresa:", "LABORATORIOS NOVADERMA S.A."],
-        ["Área / Proceso:", evaluacion.get('area', '').upper()],
-        ["Cargo:", evaluacion.get('cargo', '').upper()],
-        ["Nombre del colaborador:", evaluacion.get('nombre', '').upper()],
-        ["Jefe inmediato:", evaluacion.get('jefe', '').upper()],
-        ["Período evaluado:", evaluacion.get('periodo', '').upper()],
-        ["Fecha de evaluación:", evaluacion.get('fecha', '').upper()]
-    ]
-    
-    for label, value in datos_identificacion:
-        story.append(Paragraph(f"<b>{label}</b> {value}", normal_style))
-    
-    story.append(Spacer(1, 12))
-    
-    # === SECCIÓN 2: RESUMEN DEL DESEMPEÑO ===
-    story.append(Paragraph("2. Resumen del desempeño", section_title_style))
-    
-    # Crear tabla para promedio y rendimiento (como en el HTML original)
-    promedio = evaluacion.get('promedio', 0)
-    rendimiento = evaluacion.get('rendimiento', 'NO EVALUADO')
-    
-    resumen_data = [
-        [f"PROMEDIO: {promedio:.1f}", f"RENDIMIENTO: {rendimiento.upper()}"]
-    ]
-    
-    resumen_table = Table(resumen_data, colWidths=[2.5*inch, 2.5*inch])
-    resumen_table.setStyle(TableStyle([
-        ('FONTNAME', (0, 0), (-1, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 11),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ('BACKGROUND', (0, 0), (-1, -1), colors.lightgrey),
-        ('GRID', (0, 0), (-1, -1), 1, colors.grey),
-        ('TOPPADDING', (0, 0), (-1, -1), 8),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-    ]))
-    
-    story.append(resumen_table)
-    story.append(Spacer(1, 6))
-    
-    # Comentario del jefe
-    comentario = evaluacion.get('comentario_jefe', 'Sin comentarios').upper()
-    story.append(Paragraph(f"<b>Comentario del jefe inmediato:</b><br/>{comentario}", normal_style))
-    
-    story.append(Spacer(1, 12))
-    
-    # === SECCIÓN 3: DESEMPEÑO EN EL CARGO ===
-    story.append(Paragraph("3. Desempeño en el cargo (1 a 5)", section_title_style))
-    
-    calificaciones = evaluacion.get('calificaciones', {})
-    tipo_evaluacion = evaluacion.get('tipo_evaluacion', 'OPERATIVO')
-    
-    # Crear tabla de calificaciones
-    cal_data = []
-    
-    # Calificaciones base adaptadas por tipo
-    if calificaciones.get('organizacion', 0) > 0:
-        if tipo_evaluacion == 'COMERCIAL':
-            label = "Planificación y organización del trabajo comercial:"
-        elif tipo_evaluacion == 'DIRECTIVOS':
-            label = "Organización y planificación estratégica:"
-        elif tipo_evaluacion == 'ADMINISTRATIVA':
-            label = "Organización de tareas administrativas:"
+        pool = pool_lectura()
+        futures = [pool.submit(leer_hoja, tarea, upload_anterior) for tarea in tareas]
+        
+        def esperar(future):
+            while True:
+                try:
+                    return future.result(timeout=CARGAS_INACTIVIDAD / 4)
+                except FuturesTimeoutError:
+                    if latido is not None:
+                        latido()
+        
+        def en_orden():
+            # Se entregan en el orden de las hojas para que los ids lleguen crecientes
+            try:
+                for tarea, future in zip(tareas, futures):
+                    yield ((huella, evaluacion.a_dict()) for huella, evaluacion in esperar(future))
+                    if progreso is not None:
+                        progreso(tarea['base'] + tarea['filas'], filas_totales)
+            except BrokenProcessPool:
+                cerrar_pool_lectura(pool)
+                raise
+            finally:
+                for future in futures:
+                    future.cancel()
+        resultados = en_orden()
+    
+    inicio = time.perf_counter()
+    total = 0
+    for filas in resultados:
+        for huella, evaluacion in filas:
+            if comparacion is not None:
+                comparacion.registrar(huella, evaluacion)
+            total += 1
+            yield huella, evaluacion
+    
+    segundos = time.perf_counter() - inicio
+    metricas.observar('novaderma_carga_filas', total)
+    metricas.observar('novaderma_lectura_segundos', segundos)
+    log.info("Carga leída: %d evaluaciones de %d hojas en %.2fs", total, len(tareas), segundos)
+
+def procesar_carga(upload_id, archivos, comparacion=None):
+    """Procesa el Excel de una carga guardando resultados parciales y el avance, y entrega cada evaluación.
+    
+    Las evaluaciones se guardan por lotes (cada CARGAS_LOTE evaluaciones o cada medio
+    segundo) para que el estado consultado por el navegador avance sin escribir en
+    SQLite por cada fila. Al final se guardan la firma de estructura y, si hubo carga anterior
+    del mismo libro, el resumen de cambios.
+    Los errores se propagan: quien consume la carga la marca como fallida.
+    """
+    avance = {'leidas': 0, 'totales': 0}
+    
+    def progreso(filas_leidas, filas_totales):
+        avance['leidas'] = filas_leidas
+        avance['totales'] = filas_totales
+    
+    lote = []
+    huellas = []
+    ultimo_guardado = time.monotonic()
+    for huella, evaluacion in iterar_carga(archivos, comparacion, progreso, lambda: almacen_cargas.tocar(upload_id)):
+        lote.append(evaluacion)
+        huellas.append(huella)
+        if len(lote) >= CARGAS_LOTE or time.monotonic() - ultimo_guardado >= 0.5:
+            almacen_cargas.agregar(upload_id, lote, avance['leidas'], avance['totales'], huellas)
+            lote = []
+            huellas = []
+            ultimo_guardado = time.monotonic()
+        yield evaluacion
+    almacen_cargas.agregar(upload_id, lote, avance['leidas'], avance['totales'], huellas)
+    if comparacion is not None:
+        almacen_cargas.finalizar(upload_id, cambios=comparacion.resumen(), firma=comparacion.firma)
+    else:
+        almacen_cargas.finalizar(upload_id)
+
+def procesar_carga_en_segundo_plano(upload_id, archivos, comparacion=None):
+    """Procesa una carga asíncrona; si falla, la carga queda en estado 'error'"""
+    try:
+        for _ in procesar_carga(upload_id, archivos, comparacion):
+            pass
+    except Exception as e:
+        log.error("Error al procesar carga %s: %s", upload_id, e, exc_info=con_traza())
+        metricas.incrementar('novaderma_errores_total', etapa='carga')
+        almacen_cargas.finalizar(upload_id, error=f'Error al procesar el archivo: {str(e)}')
+    finally:
+        liberar_archivos(archivos)
+
+# Hilos que procesan las cargas asíncronas (por worker de gunicorn)
+ejecutor_cargas = ThreadPoolExecutor(max_workers=CARGAS_TRABAJOS, thread_name_prefix='carga')
+atexit.register(ejecutor_cargas.shutdown, wait=False)
+
+def percentil(ordenados, q):
+    """Percentil q (0-100) de una lista ordenada, con interpolación lineal como numpy.percentile"""
+    posicion = (len(ordenados) - 1) * q / 100
+    inferior = math.floor(posicion)
+    superior = min(inferior + 1, len(ordenados) - 1)
+    return ordenados[inferior] + (ordenados[superior] - ordenados[inferior]) * (posicion - inferior)
+
+def redondear(valor, decimales=2):
+    """Redondea para la respuesta JSON; NaN (sin datos) se convierte en None"""
+    valor = float(valor)
+    return None if math.isnan(valor) else round(valor, decimales)
+
+class TablaPuntajes:
+    """Puntajes de una carga organizados por columnas para calcular estadísticas en bloque.
+    
+    Las calificaciones forman una matriz filas x criterios con NaN donde no hay una
+    calificación válida (1 a 5). Con NumPy los promedios por fila, las bandas de
+    rendimiento y los agregados por grupo se calculan de forma vectorial; sin NumPy se
+    usan listas de Python con los mismos resultados.
+    """
+    
+    # Campo de la evaluación -> clave del grupo en la respuesta
+    GRUPOS = {'area': 'por_area', 'jefe': 'por_jefe', 'tipo_evaluacion': 'por_tipo'}
+    PERCENTILES = (10, 25, 50, 75, 90)
+    
+    def __init__(self, evaluaciones):
+        importar_numpy()
+        self.grupos = {campo: [] for campo in self.GRUPOS}
+        promedios = []
+        rendimientos = []
+        self.criterios = []
+        columnas = {}
+        filas = []
+        for evaluacion in evaluaciones:
+            for campo, valores in self.grupos.items():
+                valores.append(str(evaluacion.get(campo) or '').strip().upper() or f'SIN {campo.upper()}')
+            promedios.append(float(evaluacion.get('promedio') or 0))
+            rendimientos.append(evaluacion.get('rendimiento'))
+            fila = {}
+            for clave, valor in (evaluacion.get('calificaciones') or {}).items():
+                if clave not in columnas:
+                    columnas[clave] = len(self.criterios)
+                    self.criterios.append(clave)
+                if isinstance(valor, (int, float)) and 1 <= valor <= 5:
+                    fila[columnas[clave]] = float(valor)
+            filas.append(fila)
+        self.total = len(filas)
+        
+        if NUMPY_AVAILABLE:
+            self.promedios = np.asarray(promedios, dtype=float)
+            self.calificaciones = np.full((self.total, len(self.criterios)), np.nan)
+            for i, fila in enumerate(filas):
+                for j, valor in fila.items():
+                    self.calificaciones[i, j] = valor
         else:
-            label = "Organización del trabajo y cumplimiento de tiempos:"
-        cal_data.append([label, f"{calificaciones['organizacion']} / 5"])
-    
-    if calificaciones.get('cumple_resultados', 0) > 0:
-        if tipo_evaluacion == 'COMERCIAL':
-            label = "Cumplimiento de objetivos comerciales y cuotas:"
-        elif tipo_evaluacion == 'DIRECTIVOS':
-            label = "Cumplimiento de resultados del área dirigida:"
-        elif tipo_evaluacion == 'ADMINISTRATIVA':
-            label = "Cumplimiento de tareas y procedimientos:"
+            self.promedios = promedios
+            self.calificaciones = [[fila.get(j, math.nan) for j in range(len(self.criterios))] for fila in filas]
+        
+        self.promedios_calificaciones = self._promedios_por_fila()
+        
+        # La clasificación guardada es la que muestra el reporte (se calculó con el promedio sin
+        # redondear); solo las evaluaciones sin una clasificación conocida se clasifican aquí
+        guardadas = [RENDIMIENTOS.index(r) if r in RENDIMIENTOS else -1 for r in rendimientos]
+        calculadas = clasificar_rendimientos(self.promedios)
+        if NUMPY_AVAILABLE:
+            guardadas = np.asarray(guardadas, dtype=int)
+            self.bandas = np.where(guardadas >= 0, guardadas, calculadas)
         else:
-            label = "Cumple con los resultados esperados de su función:"
-        cal_data.append([label, f"{calificaciones['cumple_resultados']} / 5"])
-    
-    if calificaciones.get('aplica_capacitacion', 0) > 0:
-        cal_data.append(["Aplica conceptos de capacitaciones y entrenamientos:", f"{calificaciones['aplica_capacitacion']} / 5"])
-    
-    # Calificaciones específicas por tipo
-    if tipo_evaluacion == 'COMERCIAL':
-        if calificaciones.get('ventas', 0) > 0:
-            cal_data.append(["Cumplimiento de cuotas y panel médico:", f"{calificaciones['ventas']} / 5"])
-        if calificaciones.get('clientes', 0) > 0:
-            cal_data.append(["Atención y relación con clientes/médicos:", f"{calificaciones['clientes']} / 5"])
-    
-    elif tipo_evaluacion == 'DIRECTIVOS':
-        if calificaciones.get('liderazgo', 0) > 0:
-            cal_data.append(["Liderazgo y dirección de equipos:", f"{calificaciones['liderazgo']} / 5"])
-        if calificaciones.get('gestion', 0) > 0:
-            cal_data.append(["Gestión eficiente de recursos:", f"{calificaciones['gestion']} / 5"])
-        if calificaciones.get('evaluacion_equipo', 0) > 0:
-            cal_data.append(["Evaluación y análisis de resultados del equipo:", f"{calificaciones['evaluacion_equipo']} / 5"])
-    
-    elif tipo_evaluacion == 'ADMINISTRATIVA':
-        if calificaciones.get('analisis', 0) > 0:
-            cal_data.append(["Análisis y solución de problemas:", f"{calificaciones['analisis']} / 5"])
-        if calificaciones.get('informes', 0) > 0:
-            cal_data.append(["Entrega de informes y tareas:", f"{calificaciones['informes']} / 5"])
-        if calificaciones.get('planificacion', 0) > 0:
-            cal_data.append(["Planificación y cumplimiento del plan de trabajo:", f"{calificaciones['planificacion']} / 5"])
-    
-    # Agregar más calificaciones comunes
-    for key, label in [
-        ('uso_equipos', 'Uso adecuado de equipos y recursos:'),
-        ('cumple_politicas', 'Cumple con políticas, procedimientos, normas y horarios:'),
-        ('conoce_calidad', 'Conoce y aplica la política de calidad:'),
-        ('propone_mejoras', 'Propone alternativas de mejora e ideas constructivas:'),
-        ('relaciones', 'Relaciones interpersonales y cordialidad:'),
-        ('trabajo_equipo', 'Trabajo en equipo y colaboración:'),
-        ('actitud_servicio', 'Actitud de servicio:')
-    ]:
-        if calificaciones.get(key, 0) > 0:
-            cal_data.append([label, f"{calificaciones[key]} / 5"])
-    
-    if cal_data:
-        cal_table = Table(cal_data, colWidths=[4.5*inch, 1*inch])
-        cal_table.setStyle(TableStyle([
-            ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
-            ('FONTSIZE', (0, 0), (-1, -1), 10),
-            ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-            ('ALIGN', (1, 0), (1, -1), 'CENTER'),
-            ('LEFTPADDING', (0, 0), (-1, -1), 6),
-            ('RIGHTPADDING', (0, 0), (-1, -1), 6),
-            ('TOPPADDING', (0, 0), (-1, -1), 4),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 4),
-            ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-            ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
-        ]))
-        story.append(cal_table)
-    
-    story.append(Spacer(1, 12))
-    
-    # === SECCIÓN 6: APORTES ===
-    story.append(Paragraph("6. Aportes", section_title_style))
-    aportes = evaluacion.get('aportes', 'Sin aportes registrados').upper()
-    story.append(Paragraph(aportes, normal_style))
-    
-    story.append(Spacer(1, 12))
-    
-    # === SECCIÓN 7: PLAN DE MEJORA ===
-    story.append(Paragraph("7. Plan de mejora", section_title_style))
-    plan_mejora = evaluacion.get('plan_mejora', 'Sin plan de mejora registrado').upper()
-    story.append(Paragraph(f"<b>Acción de mejora:</b><br/>{plan_mejora}", normal_style))
-    
-    # === FOOTER ===
-    story.append(Spacer(1, 20))
-    footer_text = """Este formato se utiliza como registro de evaluación de desempeño y competencias del trabajador, 
-    en coherencia con las políticas internas de LABORATORIOS NOVADERMA S.A. y con los lineamientos 
-    del Sistema de Gestión de la Calidad."""
-    
-    footer_style = ParagraphStyle(
-        'Footer',
-        parent=styles['Normal'],
-        fontSize=10,
-        textColor=colors.black,
-        borderWidth=1,
-        borderColor=colors.lightgrey,
-        borderPadding=5,
-        spaceBefore=10
-    )
-    
-    story.append(Paragraph(footer_text, footer_style))
-    
-    # Generar PDF
-    doc.build(story)
+            self.bandas = [g if g >= 0 else c for g, c in zip(guardadas, calculadas)]
+    
+    def _promedios_por_fila(self):
+        """Promedio de las calificaciones válidas de cada fila (NaN si no tiene ninguna)"""
+        if NUMPY_AVAILABLE:
+            validas = ~np.isnan(self.calificaciones)
+            cuentas = validas.sum(axis=1)
+            sumas = np.where(validas, self.calificaciones, 0).sum(axis=1)
+            return np.divide(sumas, cuentas, out=np.full(self.total, np.nan), where=cuentas > 0)
+        promedios = []
+        for fila in self.calificaciones:
+            validas = [valor for valor in fila if not math.isnan(valor)]
+            promedios.append(sum(validas) / len(validas) if validas else math.nan)
+        return promedios
+    
+    def _indices_por_grupo(self, campo):
+        """{valor del grupo: índices de sus filas}, ordenado por valor"""
+        valores = self.grupos[campo]
+        if NUMPY_AVAILABLE:
+            nombres, codigos = np.unique(np.asarray(valores, dtype=object), return_inverse=True)
+            orden = np.argsort(codigos, kind='stable')
+            limites = np.searchsorted(codigos[orden], np.arange(len(nombres) + 1))
+            return {str(nombre): orden[limites[k]:limites[k + 1]] for k, nombre in enumerate(nombres)}
+        indices = {}
+        for i, valor in enumerate(valores):
+            indices.setdefault(valor, []).append(i)
+        return dict(sorted(indices.items()))
+    
+    def estadisticas(self, indices=None):
+        """Estadísticas de las filas indicadas (todas si no se indican)"""
+        if indices is None:
+            indices = np.arange(self.total) if NUMPY_AVAILABLE else list(range(self.total))
+        if len(indices) == 0:
+            return {'total': 0}
+        
+        if NUMPY_AVAILABLE:
+            promedios = np.sort(self.promedios[indices])
+            promedios_calificaciones = self.promedios_calificaciones[indices]
+            promedios_calificaciones = promedios_calificaciones[~np.isnan(promedios_calificaciones)]
+            conteo_bandas = np.bincount(self.bandas[indices], minlength=len(RENDIMIENTOS))
+            calificaciones = self.calificaciones[indices]
+            cuentas = (~np.isnan(calificaciones)).sum(axis=0)
+            sumas = np.nansum(calificaciones, axis=0)
+            medias_criterios = {criterio: sumas[j] / cuentas[j]
+                                for j, criterio in enumerate(self.criterios) if cuentas[j]}
+            resumen = {
+                'promedio': promedios.mean(),
+                'promedio_calificaciones': promedios_calificaciones.mean() if len(promedios_calificaciones) else math.nan,
+                'percentiles': dict(zip(self.PERCENTILES, np.percentile(promedios, self.PERCENTILES))),
+            }
+        else:
+            promedios = sorted(self.promedios[i] for i in indices)
+            promedios_calificaciones = [self.promedios_calificaciones[i] for i in indices
+                                        if not math.isnan(self.promedios_calificaciones[i])]
+            conteo_bandas = [0] * len(RENDIMIENTOS)
+            for i in indices:
+                conteo_bandas[self.bandas[i]] += 1
+            medias_criterios = {}
+            for j, criterio in enumerate(self.criterios):
+                valores = [self.calificaciones[i][j] for i in indices if not math.isnan(self.calificaciones[i][j])]
+                if valores:
+                    medias_criterios[criterio] = sum(valores) / len(valores)
+            resumen = {
+                'promedio': sum(promedios) / len(promedios),
+                'promedio_calificaciones': (sum(promedios_calificaciones) / len(promedios_calificaciones)
+                                            if promedios_calificaciones else math.nan),
+                'percentiles': {q: percentil(promedios, q) for q in self.PERCENTILES},
+            }
+        
+        return {
+            'total': int(len(indices)),
+            'promedio': redondear(resumen['promedio']),
+            'promedio_calificaciones': redondear(resumen['promedio_calificaciones']),
+            'percentiles': {f'p{q}': redondear(valor) for q, valor in resumen['percentiles'].items()},
+            'rendimiento': {rendimiento: int(cantidad) for rendimiento, cantidad in zip(RENDIMIENTOS, conteo_bandas)},
+            'calificaciones': {criterio: redondear(media) for criterio, media in medias_criterios.items()},
+        }
+    
+    def agregados(self, campos=None):
+        """Estadísticas generales y por cada campo de agrupación (área, jefe y tipo por defecto)"""
+        resultado = {'total': self.total, 'general': self.estadisticas()}
+        for campo in campos or self.GRUPOS:
+            resultado[self.GRUPOS[campo]] = {
+                valor: self.estadisticas(indices) for valor, indices in self._indices_por_grupo(campo).items()
+            }
+        return resultado
+
+def generar_pdf_reportlab(evaluacion):
+    """Genera PDF usando ReportLab replicando exactamente el diseño del HTML original"""
+    buffer = BytesIO()
+    titulo = f"Evaluación de desempeño - {como_dict(evaluacion).get('nombre', '')}"
+    doc = importar_renderizador('reporte_reportlab').documento_reportlab(buffer, titulo)
+    doc.build(historia_reportlab(evaluacion))
     buffer.seek(0)
     return buffer
 
+def historia_reportlab(evaluacion, como_form=False):
+    """Flowables de ReportLab con el reporte de una evaluación (dict o Evaluacion)"""
+    return recursos_render.plantilla_reportlab().historia(como_dict(evaluacion), como_form)
+
+def generar_pdf_consolidado_reportlab(evaluaciones, destino):
+    """Escribe en `destino` un PDF de ReportLab con todas las evaluaciones, una por página nueva.
+    
+    Retorna el número de evaluaciones incluidas.
+    """
+    reporte_reportlab = importar_renderizador('reporte_reportlab')
+    total = 0
+    
+    def bloques():
+        nonlocal total
+        for evaluacion in evaluaciones:
+            bloque = historia_reportlab(evaluacion, como_form=True)
+            if total:
+                bloque.insert(0, reporte_reportlab.PageBreak())
+            total += 1
+            yield bloque
+    
+    reporte_reportlab.documento_reportlab(destino).build(reporte_reportlab.HistoriaPerezosa(bloques()))
+    return total
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -923,7 +2241,7 @@ def test_pdf():
             </body>
             </html>
             """
-            pdf_bytes = HTML(string=html_simple).write_pdf()
+            pdf_bytes = importar_renderizador('weasyprint').HTML(string=html_simple).write_pdf()
             pdf_buffer = BytesIO(pdf_bytes)
             pdf_buffer.seek(0)
             
@@ -933,21 +2251,25 @@ def test_pdf():
                             mimetype='application/pdf')
                             
         except Exception as weasy_error:
-            print(f"WeasyPrint falló: {weasy_error}")
+            log.warning("WeasyPrint falló: %s", weasy_error)
             
             # Usar ReportLab como alternativa
-            if REPORTLAB_AVAILABLE:
+            try:
+                rl = importar_renderizador('reporte_reportlab')
+            except ImportError:
+                rl = None
+            if rl is not None:
                 buffer = BytesIO()
-                doc = SimpleDocTemplate(buffer, pagesize=A4)
+                doc = rl.SimpleDocTemplate(buffer, pagesize=rl.A4)
                 
-                styles = getSampleStyleSheet()
+                styles = rl.getSampleStyleSheet()
                 story = []
                 
-                story.append(Paragraph("Prueba de PDF con ReportLab", styles['Title']))
-                story.append(Spacer(1, 12))
-                story.append(Paragraph("Si ves esto, ReportLab funciona correctamente.", styles['Normal']))
-                story.append(Spacer(1, 12))
-                story.append(Paragraph("WeasyPrint no está disponible, usando ReportLab como alternativa.", styles['Normal']))
+                story.append(rl.Paragraph("Prueba de PDF con ReportLab", styles['Title']))
+                story.append(rl.Spacer(1, 12))
+                story.append(rl.Paragraph("Si ves esto, ReportLab funciona correctamente.", styles['Normal']))
+                story.append(rl.Spacer(1, 12))
+                story.append(rl.Paragraph("WeasyPrint no está disponible, usando ReportLab como alternativa.", styles['Normal']))
                 
                 doc.build(story)
                 buffer.seek(0)
@@ -963,123 +2285,1049 @@ def test_pdf():
         import traceback
         return f"Error general: {str(e)}<br><br><pre>{traceback.format_exc()}</pre>", 500
 
+class ArchivoSubido:
+    """Contenido de un archivo subido, escrito directamente por Werkzeug al recibir el formulario.
+    
+    Se mantiene en memoria hasta `limite` bytes; si el archivo es más grande pasa a un archivo
+    temporal con nombre único (mkstemp) y la extensión del archivo subido en UPLOAD_FOLDER,
+    que se borra al liberarlo. Así las
+    subidas no se copian a disco para leerlas y dos subidas con el mismo nombre no comparten
+    ningún archivo. Werkzeug lo cierra al terminar la petición, pero las cargas asíncronas y en
+    streaming se leen después: tomar() lo reserva para la carga y desde entonces solo liberar()
+    lo descarta.
+    """
+    
+    # Extensión que se conserva en el archivo temporal; cualquier otra se reemplaza por .subida
+    PATRON_EXTENSION = re.compile(r'\.[A-Za-z0-9]{1,10}')
+    
+    def __init__(self, limite, nombre_archivo=None):
+        self.limite = limite
+        extension = os.path.splitext(os.path.basename(nombre_archivo or ''))[1]
+        self.extension = extension if self.PATRON_EXTENSION.fullmatch(extension) else '.subida'
+        self.tamano = 0
+        self.ruta = None
+        self._flujo = io.BytesIO()
+        self._datos = None
+        self._tomado = False
+    
+    # Interfaz de archivo que usan Werkzeug y FileStorage: escribir, rebobinar y leer
+    def write(self, datos):
+        if self.ruta is None and self.tamano + len(datos) > self.limite:
+            fd, self.ruta = tempfile.mkstemp(suffix=self.extension, dir=UPLOAD_FOLDER)
+            en_disco = os.fdopen(fd, 'w+b')
+            en_disco.write(self._flujo.getbuffer())
+            self._flujo.close()
+            self._flujo = en_disco
+        self.tamano += len(datos)
+        return self._flujo.write(datos)
+    
+    def read(self, *args):
+        return self._flujo.read(*args)
+    
+    def readline(self, *args):
+        return self._flujo.readline(*args)
+    
+    def seek(self, *args):
+        return self._flujo.seek(*args)
+    
+    def tell(self):
+        return self._flujo.tell()
+    
+    def close(self):
+        if not self._tomado:
+            self.liberar()
+    
+    def tomar(self):
+        self._tomado = True
+        return self
+    
+    def fuente(self):
+        """Lo que reciben los lectores: la ruta del archivo temporal o, en memoria, los bytes"""
+        if self.ruta is not None:
+            self._flujo.flush()
+            return self.ruta
+        if self._datos is None:
+            self._datos = self._flujo.getvalue()
+        return self._datos
+    
+    def liberar(self):
+        self._flujo.close()
+        self._datos = None
+        if self.ruta is not None:
+            try:
+                os.remove(self.ruta)
+            except OSError:
+                pass
+
+class PeticionNovaderma(Request):
+    # _get_file_stream es un punto de extensión privado de Werkzeug, verificado con 3.0 y 3.1:
+    # ver el pin Werkzeug>=3.0,<3.2 en requirements.txt antes de actualizar Werkzeug
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        # Werkzeug escribe cada archivo subido en un ArchivoSubido en lugar de su SpooledTemporaryFile
+        return ArchivoSubido(int(CARGAS_MEMORIA_MB * 1024 * 1024), filename)
+
+app.request_class = PeticionNovaderma
+
+def tomar_archivos_subidos(files):
+    """Reserva los archivos subidos para la carga y retorna [(ArchivoSubido, nombre_archivo)]"""
+    archivos = [(file.stream.tomar(), file.filename) for file in files]
+    metricas.observar('novaderma_carga_bytes', sum(subido.tamano for subido, _ in archivos))
+    return archivos
+
+def liberar_archivos(archivos):
+    for subido, _ in archivos:
+        subido.liberar()
+
+def quiere_ndjson():
+    """Si el cliente pidió la respuesta de /upload en streaming (formato=ndjson o Accept: application/x-ndjson)"""
+    if request.values.get('formato') == 'ndjson':
+        return True
+    return request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson']) == 'application/x-ndjson'
+
+def generar_ndjson(upload_id, archivos, comparacion=None, resumen=False):
+    """Procesa la carga entregando bloques de líneas NDJSON: una por evaluación y al final {"fin": estado}.
+    
+    Las líneas se juntan por CARGAS_LOTE evaluaciones o cada medio segundo, para que el cliente
+    reciba las evaluaciones mientras se procesan sin escribir en la red por cada fila. La carga
+    también queda guardada en el almacén (el upload_id va en la cabecera X-Upload-Id); si el
+    procesamiento falla, el estado final trae el error.
+    """
+    lineas = []
+    ultimo_envio = time.monotonic()
+    try:
+        try:
+            for evaluacion in procesar_carga(upload_id, archivos, comparacion):
+                lineas.append(json.dumps(resumir_evaluacion(evaluacion) if resumen else evaluacion, ensure_ascii=False))
+                if len(lineas) >= CARGAS_LOTE or time.monotonic() - ultimo_envio >= 0.5:
+                    yield ('\n'.join(lineas) + '\n').encode('utf-8')
+                    lineas = []
+                    ultimo_envio = time.monotonic()
+        except GeneratorExit:
+            almacen_cargas.finalizar(upload_id, error='La conexión se cerró antes de terminar la carga. Vuelva a subir el archivo.')
+            raise
+        except Exception as e:
+            log.error("Error al procesar carga %s: %s", upload_id, e, exc_info=con_traza())
+            metricas.incrementar('novaderma_errores_total', etapa='carga')
+            almacen_cargas.finalizar(upload_id, error=f'Error al procesar el archivo: {str(e)}')
+        lineas.append(json.dumps({'fin': almacen_cargas.estado(upload_id)}, ensure_ascii=False))
+        yield ('\n'.join(lineas) + '\n').encode('utf-8')
+    finally:
+        # También si el cliente se desconecta a mitad de la carga
+        liberar_archivos(archivos)
+
+def comprimir_gzip(bloques):
+    """Comprime en gzip un flujo de bloques, vaciando el compresor tras cada uno para no retrasar su envío"""
+    compresor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for bloque in bloques:
+        yield compresor.compress(bloque) + compresor.flush(zlib.Z_SYNC_FLUSH)
+    yield compresor.flush()
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
     try:
-        if 'file' not in request.files:
-            return jsonify({'error': 'No se seleccionó archivo'}), 400
-        
-        file = request.files['file']
-        if file.filename == '':
+        # Uno o varios archivos (p. ej. un libro por tipo de evaluación); se leen todas sus hojas
+        files = [file for file in request.files.getlist('file') if file and file.filename]
+        if not files:
             return jsonify({'error': 'No se seleccionó archivo'}), 400
         
-        if file and file.filename.lower().endswith(('.xlsx', '.xls')):
-            # Guardar archivo temporalmente
-            filename = file.filename
-            filepath = os.path.join(UPLOAD_FOLDER, filename)
-            file.save(filepath)
+        # El formato se reconoce por el contenido: un CSV o un .xlsx con otra extensión también se leen
+        if all(detectar_formato(leer_cabecera(file.stream.fuente())) for file in files):
+            filename = ', '.join(file.filename for file in files)
+            
+            # Carga anterior del mismo libro (se elige por la estructura al leerlo): solo se vuelven
+            # a extraer las filas que cambiaron
+            comparacion = ComparacionCarga(filename, request.values.get('upload_anterior'))
+            
+            # Modo asíncrono: responder de inmediato y procesar en segundo plano
+            if es_verdadero(request.values.get('async')):
+                upload_id = almacen_cargas.crear(filename)
+                archivos = tomar_archivos_subidos(files)
+                ejecutor_cargas.submit(procesar_carga_en_segundo_plano, upload_id, archivos, comparacion)
+                return jsonify({
+                    'success': True,
+                    'upload_id': upload_id,
+                    'estado': 'procesando',
+                    'estado_url': f'/upload/{upload_id}/estado',
+                    'eventos_url': f'/upload/{upload_id}/eventos'
+                }), 202
+            
+            # Modo streaming: cada evaluación como una línea JSON a medida que se extrae
+            if quiere_ndjson():
+                upload_id = almacen_cargas.crear(filename)
+                archivos = tomar_archivos_subidos(files)
+                resumen = es_verdadero(request.values.get('resumen'))
+                bloques = generar_ndjson(upload_id, archivos, comparacion, resumen)
+                headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no', 'X-Upload-Id': upload_id,
+                           'Vary': 'Accept, Accept-Encoding'}
+                if request.accept_encodings['gzip']:
+                    bloques = comprimir_gzip(bloques)
+                    headers['Content-Encoding'] = 'gzip'
+                return Response(bloques, mimetype='application/x-ndjson', headers=headers)
             
-            # Procesar Excel
-            evaluaciones = procesar_excel(filepath)
+            # Procesar los archivos tal como llegaron (en memoria o en su archivo temporal)
+            archivos = tomar_archivos_subidos(files)
             
-            # Limpiar archivo temporal
             try:
-                os.remove(filepath)
-            except:
-                pass
+                filas = list(iterar_carga(archivos, comparacion))
+            finally:
+                liberar_archivos(archivos)
+            evaluaciones = [evaluacion for _, evaluacion in filas]
+            cambios = comparacion.resumen()
+            
+            # Guardar la carga en el almacén compartido
+            upload_id = almacen_cargas.guardar(evaluaciones, filename, [huella for huella, _ in filas], cambios,
+                                               comparacion.firma)
             
             return jsonify({
                 'success': True,
+                'upload_id': upload_id,
                 'evaluaciones': evaluaciones,
-                'total': len(evaluaciones)
+                'total': len(evaluaciones),
+                'cambios': cambios
             })
         else:
-            return jsonify({'error': 'Formato de archivo no válido. Use .xlsx o .xls'}), 400
+            return jsonify({'error': 'Formato de archivo no válido. Use .xlsx, .xls o .csv'}), 400
             
     except Exception as e:
+        log.error("Error al procesar el archivo: %s", e, exc_info=con_traza())
+        metricas.incrementar('novaderma_errores_total', etapa='carga')
         return jsonify({'error': f'Error al procesar el archivo: {str(e)}'}), 500
 
-@app.route('/generar-pdf/<int:eval_id>', methods=['POST'])
+def resumir_evaluacion(evaluacion):
+    """Fila resumida de una evaluación (la que muestra la tabla del navegador)"""
+    return {campo: evaluacion.get(campo) for campo in ('id',) + AlmacenCargas.CAMPOS_RESUMEN}
+
+def iterar_para_respuesta(upload_id, desde=0, resumen=False):
+    """Evaluaciones de la carga con id mayor a `desde`, completas o resumidas"""
+    evaluaciones = almacen_cargas.iterar_evaluaciones(upload_id, desde)
+    return map(resumir_evaluacion, evaluaciones) if resumen else evaluaciones
+
+@app.route('/upload/<upload_id>/estado')
+def estado_carga(upload_id):
+    """Avance de una carga y las evaluaciones con id mayor a `desde` (resultados parciales).
+    
+    Con ?resumen=true las evaluaciones llegan como filas resumidas.
+    """
+    estado = almacen_cargas.estado(upload_id)
+    if estado is None:
+        return jsonify({'error': CARGA_NO_ENCONTRADA}), 404
+    
+    desde = request.args.get('desde', 0, type=int)
+    estado['evaluaciones'] = list(iterar_para_respuesta(upload_id, desde, es_verdadero(request.args.get('resumen'))))
+    return jsonify(estado)
+
+@app.route('/upload/<upload_id>/estadisticas')
+def estadisticas_carga(upload_id):
+    """Promedios, distribución de rendimiento y percentiles de la carga, en general y por grupo.
+    
+    Con ?agrupar=area|jefe|tipo_evaluacion (puede repetirse) se limita a esos grupos.
+    """
+    if not almacen_cargas.existe(upload_id):
+        return jsonify({'error': CARGA_NO_ENCONTRADA}), 404
+    
+    campos = request.args.getlist('agrupar')
+    invalidos = [campo for campo in campos if campo not in TablaPuntajes.GRUPOS]
+    if invalidos:
+        return jsonify({'error': f'Agrupación no válida: {", ".join(invalidos)}. Use "area", "jefe" o "tipo_evaluacion"'}), 400
+    
+    tabla = TablaPuntajes(almacen_cargas.iterar_evaluaciones(upload_id))
+    return jsonify(tabla.agregados(campos))
+
+def codificar_cursor(cursor):
+    """Cursor de paginación opaco para el navegador"""
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode('utf-8')).decode('ascii')
+
+def decodificar_cursor(texto):
+    """(valor, id) de un cursor de paginación; ValueError si no es válido"""
+    try:
+        valor, eval_id = json.loads(base64.urlsafe_b64decode(texto.encode('ascii')))
+    except Exception:
+        raise ValueError('Cursor no válido')
+    if not isinstance(eval_id, int) or not isinstance(valor, (str, int, float)):
+        raise ValueError('Cursor no válido')
+    return valor, eval_id
+
+@app.route('/upload/<upload_id>/evaluaciones')
+def consultar_evaluaciones(upload_id):
+    """Página de evaluaciones resumidas de una carga.
+    
+    Parámetros: area, cargo, jefe, rendimiento y tipo_evaluacion (pueden repetirse), buscar,
+    orden (id, nombre, cargo, area, jefe, promedio o rendimiento), dir (asc o desc), limite
+    y cursor (el `siguiente` de la página anterior). El detalle completo de cada evaluación
+    se pide a /upload/<upload_id>/evaluaciones/<eval_id>.
+    """
+    orden = request.args.get('orden', 'id')
+    if orden not in AlmacenCargas.ORDEN_CONSULTA:
+        return jsonify({'error': f'Orden no válido: {orden}. Use {", ".join(AlmacenCargas.ORDEN_CONSULTA)}'}), 400
+    direccion = request.args.get('dir', 'asc').lower()
+    if direccion not in ('asc', 'desc'):
+        return jsonify({'error': 'Dirección no válida. Use "asc" o "desc"'}), 400
+    limite = request.args.get('limite', CONSULTA_POR_PAGINA, type=int)
+    limite = min(max(limite, 1), CONSULTA_MAX_POR_PAGINA)
+    
+    cursor = request.args.get('cursor')
+    try:
+        cursor = decodificar_cursor(cursor) if cursor else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    filtros = {campo: request.args.getlist(campo) for campo in AlmacenCargas.FILTROS_CONSULTA}
+    resultado = almacen_cargas.consultar(upload_id, filtros, request.args.get('buscar', ''),
+                                         orden, direccion == 'desc', limite, cursor)
+    if resultado is None:
+        return jsonify({'error': CARGA_NO_ENCONTRADA}), 404
+    
+    evaluaciones, siguiente, total = resultado
+    return jsonify({
+        'evaluaciones': evaluaciones,
+        'total': total,
+        'siguiente': codificar_cursor(siguiente) if siguiente is not None else None
+    })
+
+@app.route('/upload/<upload_id>/evaluaciones/<int:eval_id>')
+def detalle_evaluacion(upload_id, eval_id):
+    """Evaluación completa (comentarios, aportes, plan de mejora y calificaciones)"""
+    evaluacion = almacen_cargas.obtener_evaluacion(upload_id, eval_id)
+    if evaluacion is None:
+        return jsonify({'error': CARGA_NO_ENCONTRADA}), 404
+    return jsonify(evaluacion)
+
+def evento_sse(evento, datos, id_evento=None):
+    """Formatea un mensaje de Server-Sent Events"""
+    mensaje = f'event: {evento}\n'
+    if id_evento is not None:
+        mensaje += f'id: {id_evento}\n'
+    return mensaje + f'data: {json.dumps(datos, ensure_ascii=False)}\n\n'
+
+@app.route('/upload/<upload_id>/eventos')
+def eventos_carga(upload_id):
+    """Envía el avance de una carga por Server-Sent Events hasta que termine.
+    
+    Cada conexión dura como máximo CARGAS_SSE_SEGUNDOS para no chocar con el timeout de
+    gunicorn; el navegador se reconecta solo y, gracias a Last-Event-ID, continúa desde la
+    última evaluación recibida. Con ?resumen=true las evaluaciones llegan como filas resumidas.
+    """
+    if almacen_cargas.estado(upload_id) is None:
+        return jsonify({'error': CARGA_NO_ENCONTRADA}), 404
+    
+    desde = request.headers.get('Last-Event-ID', type=int)
+    if desde is None:
+        desde = request.args.get('desde', 0, type=int)
+    resumen = es_verdadero(request.args.get('resumen'))
+    
+    def generar():
+        ultimo_id = desde
+        limite = time.monotonic() + CARGAS_SSE_SEGUNDOS
+        yield 'retry: 1000\n\n'
+        while True:
+            estado = almacen_cargas.estado(upload_id)
+            if estado is None:
+                yield evento_sse('error', {'error': CARGA_NO_ENCONTRADA})
+                return
+            
+            nuevas = list(iterar_para_respuesta(upload_id, ultimo_id, resumen))
+            if nuevas:
+                ultimo_id = nuevas[-1]['id']
+            estado['evaluaciones'] = nuevas
+            
+            terminada = estado['estado'] != 'procesando'
+            yield evento_sse('fin' if terminada else 'progreso', estado, ultimo_id)
+            if terminada or time.monotonic() >= limite:
+                return
+            time.sleep(0.5)
+    
+    return Response(stream_with_context(generar()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def generar_html_reporte(evaluacion, css_inline=False):
+    """Renderiza la plantilla reporte.html de una evaluación (requiere contexto de la aplicación).
+    
+    Por defecto el CSS no se incluye en el HTML: WeasyPrint usa la hoja ya parseada del
+    registro de recursos. Con css_inline=True se incrusta en un bloque <style>.
+    """
+    # Obtener logo
+    try:
+        logo_base64 = get_logo_base64()
+    except Exception as e:
+        log.warning("No se pudo cargar el logo: %s", e)
+        logo_base64 = ''
+    
+    # Renderizar HTML
+    return render_template('reporte.html', 
+                           evaluacion=como_dict(evaluacion),
+                           logo_src=f'data:image/png;base64,{logo_base64}' if logo_base64 else '',
+                           css_reporte=recursos_render.css_texto() if css_inline else '')
+
+def generar_html_consolidado(evaluaciones, css_inline=False):
+    """Renderiza varias evaluaciones en un solo documento HTML, cada una en una página nueva.
+    
+    El logo se referencia por archivo en lugar de repetirse en base64 en cada reporte.
+    """
+    return render_template('reporte_consolidado.html',
+                           evaluaciones=map(como_dict, evaluaciones),
+                           logo_src=recursos_render.logo_url(),
+                           css_reporte=recursos_render.css_texto() if css_inline else '')
+
+def _pdf_weasyprint(html_content, evaluacion):
+    """Genera el PDF con WeasyPrint reutilizando el CSS parseado y la configuración de fuentes.
+    
+    WeasyPrint ya reduce las fuentes a los caracteres usados y comprime los streams; además
+    se optimizan las imágenes sin pérdida y se limita su resolución a la del logo reducido,
+    como en wkhtmltopdf. Sin fechas en los metadatos del HTML ni identificador, la misma
+    evaluación produce siempre el mismo PDF.
+    """
+    weasyprint = importar_renderizador('weasyprint')
+    css = recursos_render.css_weasyprint()
+    html_doc = weasyprint.HTML(string=html_content, base_url='.')
+    return html_doc.write_pdf(stylesheets=[css] if css is not None else None,
+                              font_config=recursos_render.font_config(),
+                              optimize_images=True, dpi=72 * RecursosRender.PIXELES_POR_PUNTO)
+
+# Fechas de creación y modificación que escribe wkhtmltopdf (no se pueden desactivar)
+PATRON_FECHAS_PDF = re.compile(rb'(/(?:CreationDate|ModDate) ?\(D:)\d{14}')
+
+def fijar_fechas_pdf(pdf_bytes):
+    """Reemplaza las fechas de los metadatos por una fija del mismo largo (las posiciones de la
+    tabla xref no cambian), para que la misma evaluación produzca siempre el mismo PDF"""
+    return PATRON_FECHAS_PDF.sub(rb'\g<1>20000101000000', pdf_bytes)
+
+def _pdf_pdfkit(html_content, evaluacion):
+    """Genera el PDF con pdfkit (wkhtmltopdf)"""
+    pdfkit = importar_renderizador('pdfkit')
+    # Configuración para pdfkit
+    options = {
+        'page-size': 'A4',
+        'margin-top': '0.75in',
+        'margin-right': '0.75in',
+        'margin-bottom': '0.75in',
+        'margin-left': '0.75in',
+        'encoding': "UTF-8",
+        'no-outline': None,
+        'enable-local-file-access': None,
+        # Por defecto las imágenes se incrustan a 600 ppp; el logo ya viene reducido a 216
+        'image-dpi': str(72 * RecursosRender.PIXELES_POR_PUNTO),
+    }
+    # wkhtmltopdf necesita el CSS dentro del HTML
+    html_pdfkit = html_content.replace('</head>', f'<style>{recursos_render.css_texto()}</style></head>', 1)
+    return fijar_fechas_pdf(pdfkit.from_string(html_pdfkit, False, options=options))
+
+def _pdf_reportlab(html_content, evaluacion):
+    """Genera el PDF con ReportLab directamente desde la evaluación (funcionalidad limitada)"""
+    return generar_pdf_reportlab(evaluacion).getvalue()
+
+def _sondear_weasyprint():
+    importar_renderizador('weasyprint').HTML(string='<p>Novaderma</p>').write_pdf()
+
+def _sondear_pdfkit():
+    importar_renderizador('pdfkit').configuration()  # Falla si no encuentra el ejecutable wkhtmltopdf
+
+def _sondear_reportlab():
+    importar_renderizador('reporte_reportlab').sondear()
+
+# Backends de PDF en orden de preferencia: nombre -> (generar, sondear)
+BACKENDS_PDF = {
+    'weasyprint': (_pdf_weasyprint, _sondear_weasyprint),
+    'pdfkit': (_pdf_pdfkit, _sondear_pdfkit),
+    'reportlab': (_pdf_reportlab, _sondear_reportlab),
+}
+
+def generar_pdf_desde_html(html_content, evaluacion, backends=None):
+    """Convierte el HTML del reporte en PDF probando los backends indicados en orden.
+    
+    Retorna (pdf_bytes, backend_usado, fallos), donde fallos es una lista de
+    (backend, mensaje) de los backends que fallaron antes. Si todos fallan, pdf_bytes es None.
+    """
+    fallos = []
+    for nombre in backends or list(BACKENDS_PDF):
+        generar = BACKENDS_PDF[nombre][0]
+        try:
+            with metricas.cronometrar('novaderma_render_segundos', backend=nombre, documento='individual'):
+                pdf_bytes = generar(html_content, evaluacion)
+            log.debug("PDF generado con %s: %d bytes", nombre, len(pdf_bytes))
+            return pdf_bytes, nombre, fallos
+        except Exception as e:
+            log.warning("%s falló: %s", nombre, e, exc_info=con_traza())
+            metricas.incrementar('novaderma_backend_fallos_total', backend=nombre)
+            fallos.append((nombre, str(e)))
+    return None, None, fallos
+
+def generar_pdf_consolidado(evaluaciones, destino, backends=None):
+    """Escribe en `destino` un único PDF con todas las evaluaciones, probando los backends en orden.
+    
+    Con hasta PDF_CONSOLIDADO_MAX_HTML evaluaciones, los backends HTML renderizan un solo
+    documento (CSS, fuentes y logo se cargan una vez). Con más, solo se usa ReportLab, que
+    construye la historia a medida que la escribe y mantiene la memoria acotada; los backends
+    HTML se reportan en `fallos` con el motivo OMITIDO_POR_TAMANO.
+    Retorna (total, backend_usado, fallos); si todos fallan, backend_usado es None.
+    """
+    evaluaciones = iter(evaluaciones)
+    primeras = list(itertools.islice(evaluaciones, PDF_CONSOLIDADO_MAX_HTML + 1))
+    fallos = []
+    for nombre in backends or list(BACKENDS_PDF):
+        inicio = time.perf_counter()
+        try:
+            if nombre == 'reportlab':
+                total = generar_pdf_consolidado_reportlab(itertools.chain(primeras, evaluaciones), destino)
+            elif len(primeras) <= PDF_CONSOLIDADO_MAX_HTML:
+                pdf_bytes = BACKENDS_PDF[nombre][0](generar_html_consolidado(primeras), None)
+                with open(destino, 'wb') as f:
+                    f.write(pdf_bytes)
+                total = len(primeras)
+            else:
+                fallos.append((nombre, OMITIDO_POR_TAMANO))
+                continue
+            metricas.observar('novaderma_render_segundos', time.perf_counter() - inicio, backend=nombre, documento='consolidado')
+            log.info("PDF consolidado generado con %s: %d evaluaciones, %d bytes", nombre, total, os.path.getsize(destino))
+            return total, nombre, fallos
+        except Exception as e:
+            log.warning("%s falló en el PDF consolidado: %s", nombre, e, exc_info=con_traza())
+            metricas.incrementar('novaderma_backend_fallos_total', backend=nombre)
+            fallos.append((nombre, str(e)))
+    return 0, None, fallos
+
+class SelectorBackends:
+    """Elige el backend de PDF según su salud, con un circuit breaker por backend.
+    
+    Cada backend se sondea antes del primer render (importar los renderizadores es lento,
+    así que no se hace al arrancar el worker salvo con PRECALENTAR); uno que falla en el
+    sondeo, o que acumula `umbral` fallos seguidos, queda abierto y no se intenta durante `espera` segundos.
+    Pasado ese tiempo se permite un intento de prueba: si funciona el backend se cierra,
+    si falla vuelve a abrirse.
+    """
+    
+    def __init__(self, nombres, umbral, espera):
+        self.umbral = umbral
+        self.espera = espera
+        self._lock = threading.Lock()
+        self._lock_sondeo = threading.Lock()
+        self._sondeado = False
+        self._estado = {
+            nombre: {
+                'estado': 'cerrado',
+                'disponible': None,
+                'fallos_consecutivos': 0,
+                'fallos_totales': 0,
+                'exitos': 0,
+                'ultimo_error': None,
+                'abierto_desde': None,
+            }
+            for nombre in nombres
+        }
+    
+    def _abrir(self, estado, error):
+        estado['estado'] = 'abierto'
+        estado['abierto_desde'] = time.time()
+        estado['ultimo_error'] = error
+    
+    def sondear(self):
+        """Verifica qué backends funcionan en este servidor"""
+        for nombre, (_, sondear) in BACKENDS_PDF.items():
+            try:
+                sondear()
+                disponible, error = True, None
+            except Exception as e:
+                disponible, error = False, str(e)
+            with self._lock:
+                estado = self._estado[nombre]
+                estado['disponible'] = disponible
+                if disponible:
+                    estado['estado'] = 'cerrado'
+                    estado['fallos_consecutivos'] = 0
+                else:
+                    self._abrir(estado, error)
+            if disponible:
+                log.info("Backend PDF %s: disponible", nombre)
+            else:
+                log.warning("Backend PDF %s: no disponible (%s)", nombre, error)
+        self._sondeado = True
+    
+    def asegurar_sondeo(self):
+        """Sondea los backends si todavía no se hizo en este proceso"""
+        if self._sondeado:
+            return
+        with self._lock_sondeo:
+            if not self._sondeado:
+                self.sondear()
+    
+    def disponible(self, nombre):
+        """Indica si el backend pasó el sondeo (None si aún no se sondeó)"""
+        with self._lock:
+            return self._estado[nombre]['disponible']
+    
+    def candidatos(self):
+        """Backends a intentar, en orden de preferencia"""
+        self.asegurar_sondeo()
+        ahora = time.time()
+        candidatos = []
+        with self._lock:
+            for nombre, estado in self._estado.items():
+                if estado['estado'] == 'abierto' and ahora - estado['abierto_desde'] >= self.espera:
+                    estado['estado'] = 'semiabierto'  # Permitir un intento de prueba
+                if estado['estado'] != 'abierto':
+                    candidatos.append(nombre)
+        # Si todos están abiertos, intentar igualmente en orden antes que fallar sin probar
+        return candidatos or list(self._estado)
+    
+    def preferido(self):
+        """Backend con que se intentaría el próximo render, sin sondear ni cambiar estados.
+        
+        Es el primero que no está abierto o cuya espera ya pasó (antes del sondeo, el primero).
+        """
+        ahora = time.time()
+        with self._lock:
+            for nombre, estado in self._estado.items():
+                if estado['estado'] != 'abierto' or ahora - estado['abierto_desde'] >= self.espera:
+                    return nombre
+            return next(iter(self._estado))
+    
+    def registrar(self, backend_usado, fallos):
+        """Registra el resultado de un render: los backends que fallaron y el que funcionó"""
+        with self._lock:
+            for nombre, error in fallos:
+                estado = self._estado[nombre]
+                estado['fallos_consecutivos'] += 1
+                estado['fallos_totales'] += 1
+                estado['ultimo_error'] = error
+                if estado['estado'] == 'semiabierto' or estado['fallos_consecutivos'] >= self.umbral:
+                    if estado['estado'] != 'abierto':
+                        log.warning("Circuit breaker abierto para %s: %s", nombre, error)
+                    self._abrir(estado, error)
+            if backend_usado is not None:
+                estado = self._estado[backend_usado]
+                estado['exitos'] += 1
+                estado['fallos_consecutivos'] = 0
+                estado['estado'] = 'cerrado'
+                estado['disponible'] = True
+    
+    def reporte(self):
+        """Estado de cada backend para el endpoint de salud"""
+        with self._lock:
+            reporte = {}
+            for nombre, estado in self._estado.items():
+                datos = dict(estado)
+                if estado['abierto_desde'] is not None:
+                    datos['abierto_desde'] = datetime.fromtimestamp(estado['abierto_desde']).isoformat(timespec='seconds')
+                reporte[nombre] = datos
+            return reporte
+
+selector_backends = SelectorBackends(list(BACKENDS_PDF), umbral=PDF_BREAKER_FALLOS, espera=PDF_BREAKER_ESPERA)
+
+def _inicializar_worker_pdf():
+    """Precalienta un proceso del pool: carga el renderizador, las fuentes y el CSS del reporte"""
+    recursos_render.logo_base64()
+    if selector_backends.disponible('weasyprint') is False:
+        return
+    try:
+        weasyprint = importar_renderizador('weasyprint')
+        css = recursos_render.css_weasyprint()
+        weasyprint.HTML(string='<html><body><div class="main-title">Novaderma</div></body></html>').write_pdf(
+            stylesheets=[css] if css is not None else None, font_config=recursos_render.font_config())
+        log.info("Worker PDF %d listo (WeasyPrint precargado)", os.getpid())
+    except Exception as e:
+        log.warning("Worker PDF %d sin WeasyPrint: %s", os.getpid(), e)
+
+def _trabajo_pdf(html_content, evaluacion, backends):
+    """Trabajo ejecutado dentro de un proceso del pool"""
+    try:
+        return generar_pdf_desde_html(html_content, evaluacion, backends)
+    finally:
+        metricas.guardar()
+
+def _trabajo_pdf_consolidado(origen, filtros, destino, backends):
+    """Trabajo del PDF consolidado: lee las evaluaciones dentro del proceso del pool.
+    
+    `origen` es un upload_id (se recorre el almacén sin pasar las evaluaciones entre
+    procesos) o una lista de evaluaciones.
+    """
+    evaluaciones = almacen_cargas.iterar_evaluaciones(origen) if isinstance(origen, str) else origen
+    try:
+        with app.app_context():
+            return generar_pdf_consolidado(filtrar_evaluaciones(evaluaciones, filtros), destino, backends)
+    finally:
+        metricas.guardar()
+
+class MotorPDF:
+    """Motor de renderizado PDF respaldado por un pool de procesos precalentados.
+    
+    Cada proceso carga WeasyPrint y sus fuentes una sola vez al iniciar, y los PDFs se
+    generan fuera del hilo de la petición con un tiempo máximo por trabajo. Con tamano=0
+    se renderiza en el mismo proceso, como antes. El backend de cada trabajo lo elige el
+    selector de backends, que recibe el resultado para actualizar su circuit breaker.
+    """
+    
+    def __init__(self, tamano, timeout, selector):
+        self.tamano = tamano
+        self.timeout = timeout
+        self.selector = selector
+        self._pool = None
+        self._lock = threading.Lock()
+    
+    def _obtener_pool(self):
+        # El pool se crea en el primer uso para no heredarlo entre procesos de gunicorn
+        with self._lock:
+            if self._pool is None:
+                log.info("Iniciando pool de renderizado PDF con %d procesos", self.tamano)
+                self._pool = ProcessPoolExecutor(max_workers=self.tamano,
+                                                 initializer=_inicializar_worker_pdf)
+            return self._pool
+    
+    def _reiniciar_pool(self, pool):
+        """Descarta un pool bloqueado o roto; el siguiente trabajo crea uno nuevo"""
+        with self._lock:
+            if self._pool is not pool:
+                return
+            self._pool = None
+        # Terminar los procesos que siguen ocupados (p. ej. un render que excedió el tiempo)
+        for proceso in list((pool._processes or {}).values()):
+            proceso.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+    
+    def _esperar(self, pool, future, timeout=None):
+        timeout = timeout or self.timeout
+        try:
+            return future.result(timeout=timeout)
+        except FuturesTimeoutError:
+            log.warning("Render PDF excedió %gs, reiniciando pool", timeout)
+            metricas.incrementar('novaderma_errores_total', etapa='timeout_pdf')
+            self._reiniciar_pool(pool)
+            raise TimeoutError(f"La generación del PDF excedió {timeout:g} segundos")
+        except BrokenProcessPool:
+            self._reiniciar_pool(pool)
+            raise
+    
+    def _resultado(self, resultado):
+        """Registra el resultado en el selector y retorna (bytes del PDF, backend que lo generó)"""
+        pdf_bytes, backend_usado, fallos = resultado
+        self.selector.registrar(backend_usado, fallos)
+        if pdf_bytes is None:
+            raise Exception(', '.join(f"{nombre}: {error}" for nombre, error in fallos))
+        return pdf_bytes, backend_usado
+    
+    def renderizar(self, html_content, evaluacion):
+        """Genera un PDF y retorna (sus bytes, backend que lo generó)"""
+        backends = self.selector.candidatos()
+        if self.tamano <= 0:
+            return self._resultado(generar_pdf_desde_html(html_content, evaluacion, backends))
+        
+        pool = self._obtener_pool()
+        return self._resultado(self._esperar(pool, pool.submit(_trabajo_pdf, html_content, evaluacion, backends)))
+    
+    def renderizar_lote(self, evaluaciones, en_cache=None):
+        """Genera los PDFs de varias evaluaciones en paralelo.
+        
+        Consume `evaluaciones` a medida que hay procesos libres y entrega
+        (evaluacion, pdf_bytes, backend, error) en el mismo orden. Si se indica `en_cache`, se
+        llama con cada evaluación al tomarla; si retorna los bytes de un PDF ya generado, se
+        entregan con backend None, sin generar el HTML ni renderizar.
+        """
+        if self.tamano <= 0:
+            for evaluacion in evaluaciones:
+                listo = en_cache(evaluacion) if en_cache is not None else None
+                if listo is not None:
+                    yield evaluacion, listo, None, None
+                    continue
+                try:
+                    resultado = generar_pdf_desde_html(generar_html_reporte(evaluacion), evaluacion,
+                                                       self.selector.candidatos())
+                    yield evaluacion, *self._resultado(resultado), None
+                except Exception as e:
+                    yield evaluacion, None, None, e
+            return
+        
+        # Ventana acotada de trabajos en curso para no acumular PDFs en memoria; los que ya
+        # están en caché ocupan su lugar en la ventana para entregarse en orden
+        pendientes = deque()
+        evaluaciones = iter(evaluaciones)
+        agotado = False
+        while True:
+            while not agotado and len(pendientes) < self.tamano * 2:
+                evaluacion = next(evaluaciones, None)
+                if evaluacion is None:
+                    agotado = True
+                    break
+                listo = en_cache(evaluacion) if en_cache is not None else None
+                if listo is not None:
+                    pendientes.append((evaluacion, None, listo))
+                    continue
+                # El HTML se genera a medida que el motor tiene procesos libres
+                pool = self._obtener_pool()
+                future = pool.submit(_trabajo_pdf, generar_html_reporte(evaluacion), evaluacion,
+                                     self.selector.candidatos())
+                pendientes.append((evaluacion, pool, future))
+            
+            if not pendientes:
+                return
+            
+            evaluacion, pool, future = pendientes.popleft()
+            if pool is None:
+                yield evaluacion, future, None, None
+                continue
+            try:
+                yield evaluacion, *self._resultado(self._esperar(pool, future)), None
+            except Exception as e:
+                yield evaluacion, None, None, e
+    
+    def renderizar_consolidado(self, origen, filtros, destino, timeout):
+        """Genera el PDF consolidado en el archivo `destino` y retorna el número de evaluaciones"""
+        backends = self.selector.candidatos()
+        if self.tamano <= 0:
+            total, backend_usado, fallos = _trabajo_pdf_consolidado(origen, filtros, destino, backends)
+        else:
+            pool = self._obtener_pool()
+            total, backend_usado, fallos = self._esperar(
+                pool, pool.submit(_trabajo_pdf_consolidado, origen, filtros, destino, backends), timeout)
+        
+        # Un backend omitido por el tamaño del documento no falló: no cuenta para su circuit breaker
+        self.selector.registrar(backend_usado, [fallo for fallo in fallos if fallo[1] != OMITIDO_POR_TAMANO])
+        if backend_usado is None:
+            if not fallos:
+                raise RuntimeError('No hay backends de PDF para generar el consolidado')
+            raise Exception(', '.join(f"{nombre}: {error}" for nombre, error in fallos))
+        return total
+    
+    def cerrar(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+motor_pdf = MotorPDF(PDF_POOL_SIZE, PDF_JOB_TIMEOUT, selector_backends)
+atexit.register(motor_pdf.cerrar)
+
+_huellas_archivos = {}
+
+def huella_archivo(ruta):
+    """Hash del contenido de un archivo, recalculado solo cuando cambia su fecha de modificación"""
+    try:
+        stat = os.stat(ruta)
+    except OSError:
+        return ''
+    firma = (stat.st_mtime_ns, stat.st_size)
+    guardada = _huellas_archivos.get(ruta)
+    if guardada is None or guardada[0] != firma:
+        with open(ruta, 'rb') as f:
+            guardada = (firma, hashlib.sha256(f.read()).hexdigest())
+        _huellas_archivos[ruta] = guardada
+    return guardada[1]
+
+# Versión de la forma en que se escriben los PDFs (compresión, logo, metadatos): al cambiarla,
+# los PDFs guardados en la caché en disco con la forma anterior dejan de usarse
+VERSION_SALIDA_PDF = 3
+
+def clave_pdf(evaluacion, backend):
+    """Clave de contenido del PDF: datos de la evaluación + versión de las plantillas del reporte, su CSS y el logo.
+    
+    Incluye el backend que lo genera: un PDF de un backend de respaldo (p. ej. ReportLab
+    mientras WeasyPrint falla) no se entrega cuando el backend preferido vuelve a funcionar.
+    """
+    h = hashlib.sha256(f'v{VERSION_SALIDA_PDF}:{backend}'.encode('ascii'))
+    evaluacion = como_dict(evaluacion)
+    # El id y el origen (archivo/hoja) no aparecen en el PDF: una fila que solo cambió de posición reutiliza su PDF
+    contenido = {campo: valor for campo, valor in evaluacion.items() if campo not in ('id', 'archivo', 'hoja')}
+    h.update(json.dumps(contenido, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8'))
+    for plantilla in ('reporte.html', '_reporte_contenido.html'):
+        h.update(huella_archivo(os.path.join(app.root_path, 'templates', plantilla)).encode('ascii'))
+    h.update(huella_archivo(recursos_render.css_path).encode('ascii'))
+    h.update(huella_archivo(os.path.join('static', 'logo.png')).encode('ascii'))
+    return h.hexdigest()
+
+class CachePDF:
+    """Caché de PDFs generados, direccionada por contenido.
+    
+    Tiene un nivel en memoria (LRU limitado por tamaño) y un nivel en disco dentro de
+    OUTPUT_FOLDER compartido entre workers, donde se eliminan los archivos usados hace
+    más tiempo cuando se supera el tamaño máximo. Cada proceso lleva la cuenta del tamaño
+    en disco a partir de un recorrido inicial y de sus propias escrituras; la carpeta solo
+    se vuelve a recorrer cuando esa cuenta supera el máximo o cada ESCRITURAS_POR_RECORRIDO
+    escrituras, para sumar lo que escribieron los demás workers.
+    """
+    
+    ESCRITURAS_POR_RECORRIDO = 200
+    FRACCION_TRAS_DESALOJO = 0.9
+    
+    def __init__(self, carpeta, max_memoria, max_disco):
+        self.carpeta = carpeta
+        self.max_memoria = max_memoria
+        self.max_disco = max_disco
+        self._memoria = OrderedDict()
+        self._bytes_memoria = 0
+        self._lock = threading.Lock()
+        self.aciertos_memoria = 0
+        self.aciertos_disco = 0
+        self.fallos = 0
+        self._bytes_disco = 0
+        self._escrituras = 0
+        if self.max_disco > 0:
+            os.makedirs(self.carpeta, exist_ok=True)
+            self._desalojar_disco()
+    
+    def _ruta(self, clave):
+        return os.path.join(self.carpeta, f"{clave}.pdf")
+    
+    def _guardar_memoria(self, clave, pdf_bytes):
+        if len(pdf_bytes) > self.max_memoria:
+            return
+        with self._lock:
+            anterior = self._memoria.pop(clave, None)
+            if anterior is not None:
+                self._bytes_memoria -= len(anterior)
+            self._memoria[clave] = pdf_bytes
+            self._bytes_memoria += len(pdf_bytes)
+            # Desalojar los menos usados recientemente
+            while self._bytes_memoria > self.max_memoria:
+                _, desalojado = self._memoria.popitem(last=False)
+                self._bytes_memoria -= len(desalojado)
+    
+    def obtener(self, clave):
+        """Retorna los bytes del PDF en caché o None"""
+        with self._lock:
+            pdf_bytes = self._memoria.get(clave)
+            if pdf_bytes is not None:
+                self._memoria.move_to_end(clave)
+                self.aciertos_memoria += 1
+                metricas.incrementar('novaderma_cache_pdf_total', resultado='memoria')
+                return pdf_bytes
+        
+        if self.max_disco > 0:
+            ruta = self._ruta(clave)
+            try:
+                with open(ruta, 'rb') as f:
+                    pdf_bytes = f.read()
+                os.utime(ruta)  # Marcar como usado recientemente
+            except OSError:
+                pdf_bytes = None
+            if pdf_bytes:
+                self.aciertos_disco += 1
+                metricas.incrementar('novaderma_cache_pdf_total', resultado='disco')
+                self._guardar_memoria(clave, pdf_bytes)
+                return pdf_bytes
+        
+        self.fallos += 1
+        metricas.incrementar('novaderma_cache_pdf_total', resultado='fallo')
+        return None
+    
+    def guardar(self, clave, pdf_bytes):
+        self._guardar_memoria(clave, pdf_bytes)
+        if self.max_disco <= 0 or len(pdf_bytes) > self.max_disco:
+            return
+        try:
+            # Escritura atómica: otro worker nunca ve un PDF a medio escribir
+            fd, temporal = tempfile.mkstemp(dir=self.carpeta, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(pdf_bytes)
+            ruta = self._ruta(clave)
+            try:
+                anterior = os.path.getsize(ruta)  # Otro worker pudo guardar el mismo PDF
+            except OSError:
+                anterior = 0
+            os.replace(temporal, ruta)
+            with self._lock:
+                self._bytes_disco += len(pdf_bytes) - anterior
+                self._escrituras += 1
+                recorrer = (self._bytes_disco > self.max_disco
+                            or self._escrituras % self.ESCRITURAS_POR_RECORRIDO == 0)
+            if recorrer:
+                self._desalojar_disco()
+        except OSError as e:
+            log.warning("No se pudo guardar el PDF en caché de disco: %s", e)
+    
+    def _desalojar_disco(self):
+        """Recorre la carpeta, recalcula su tamaño y, si supera el máximo, elimina los PDFs usados hace más tiempo"""
+        archivos = []
+        total = 0
+        for entrada in os.scandir(self.carpeta):
+            if entrada.name.endswith('.pdf'):
+                try:
+                    stat = entrada.stat()
+                except OSError:
+                    continue
+                archivos.append((stat.st_mtime, stat.st_size, entrada.path))
+                total += stat.st_size
+        if total > self.max_disco:
+            # Eliminar los usados hace más tiempo hasta quedar con un margen bajo el límite,
+            # así las escrituras siguientes no vuelven a recorrer la carpeta cada vez
+            objetivo = self.max_disco * self.FRACCION_TRAS_DESALOJO
+            archivos.sort()
+            for _, tamano, ruta in archivos:
+                if total <= objetivo:
+                    break
+                try:
+                    os.remove(ruta)
+                    total -= tamano
+                except OSError:
+                    pass
+        with self._lock:
+            self._bytes_disco = total
+
+cache_pdf = CachePDF(os.path.join(OUTPUT_FOLDER, 'cache_pdf'),
+                     max_memoria=PDF_CACHE_MEMORIA_MB * 1024 * 1024,
+                     max_disco=PDF_CACHE_DISCO_MB * 1024 * 1024)
+
+def renderizar_pdf(evaluacion):
+    """Genera el PDF de una evaluación (o lo toma de la caché) y retorna sus bytes"""
+    # Se busca el PDF del backend con que se renderizaría ahora
+    pdf_bytes = cache_pdf.obtener(clave_pdf(evaluacion, selector_backends.preferido()))
+    if pdf_bytes is None:
+        pdf_bytes, backend = motor_pdf.renderizar(generar_html_reporte(evaluacion), evaluacion)
+        cache_pdf.guardar(clave_pdf(evaluacion, backend), pdf_bytes)
+    return pdf_bytes
+
+def sanitizar_nombre_archivo(texto):
+    """Reemplaza caracteres especiales para usar el texto en nombres de archivo"""
+    return ''.join(c if c.isalnum() or c in (' ', '_') else '_' for c in str(texto)).replace(' ', '_')
+
+def nombre_archivo_pdf(evaluacion, eval_id):
+    """Nombre del archivo PDF de una evaluación"""
+    return f"evaluacion_{sanitizar_nombre_archivo(evaluacion['nombre'])}_{eval_id}.pdf"
+
+def datos_peticion():
+    """Datos de la petición: JSON, formulario (con JSON opcional en el campo 'datos') o query string"""
+    data = request.get_json(silent=True)
+    if data is None:
+        if request.form.get('datos'):
+            data = json.loads(request.form['datos'])
+        else:
+            data = {**request.args.to_dict(), **request.form.to_dict()}
+    return data or {}
+
+def es_verdadero(valor):
+    """Interpreta valores booleanos que llegan como texto en formularios o query string"""
+    if isinstance(valor, str):
+        return valor.strip().lower() not in ('0', 'false', 'no', '')
+    return bool(valor)
+
+CARGA_NO_ENCONTRADA = 'La carga expiró o no existe. Vuelva a subir el archivo.'
+
+@app.route('/generar-pdf/<int:eval_id>', methods=['GET', 'POST'])
 def generar_pdf(eval_id):
     try:
-        data = request.json
+        data = datos_peticion()
+        # Evaluación editada en el navegador, o la de una carga guardada (upload_id + eval_id)
         evaluacion = data.get('evaluacion')
-        download = data.get('download', True)  # Por defecto descarga
+        download = es_verdadero(data.get('download', True))  # Por defecto descarga
+        upload_id = data.get('upload_id')
+        
+        if not evaluacion and upload_id:
+            evaluacion = almacen_cargas.obtener_evaluacion(upload_id, eval_id)
+            if evaluacion is None:
+                return jsonify({'error': CARGA_NO_ENCONTRADA}), 404
         
         if not evaluacion:
             return jsonify({'error': 'No se recibieron datos'}), 400
         
-        # Obtener logo
         try:
-            logo_base64 = get_logo_base64()
+            pdf_bytes = renderizar_pdf(evaluacion)
         except Exception as e:
-            print(f"Advertencia: No se pudo cargar el logo: {e}")
-            logo_base64 = ''
+            log.error("Error al generar PDF de %s: %s", evaluacion.get('nombre'), e, exc_info=con_traza())
+            metricas.incrementar('novaderma_errores_total', etapa='pdf')
+            return jsonify({'error': f'Error al generar PDF: {str(e)}'}), 500
+        metricas.observar('novaderma_pdf_bytes', len(pdf_bytes), documento='individual')
         
-        # Renderizar HTML
-        html_content = render_template('reporte.html', 
-                                      evaluacion=evaluacion,
-                                      logo_base64=logo_base64)
-        
-        # Intentar primero con WeasyPrint (método preferido)
-        try:
-            print("Intentando generar PDF con WeasyPrint...")
-            
-            # Configurar WeasyPrint
-            from weasyprint import HTML
-            
-            # Generar PDF con WeasyPrint sin CSS extra
-            html_doc = HTML(string=html_content, base_url='.')
-            pdf_bytes = html_doc.write_pdf()
-            pdf_buffer = BytesIO(pdf_bytes)
-            pdf_buffer.seek(0)
-            
-            print(f"PDF generado exitosamente con WeasyPrint. Tamaño: {len(pdf_bytes)} bytes")
-            
-        except Exception as weasy_error:
-            print(f"WeasyPrint falló: {weasy_error}")
-            import traceback
-            print(f"Traceback completo:\n{traceback.format_exc()}")
-            
-            # Intentar con pdfkit como segunda opción
-            try:
-                if PDFKIT_AVAILABLE:
-                    print("Intentando con pdfkit...")
-                    # Configuración para pdfkit
-                    options = {
-                        'page-size': 'A4',
-                        'margin-top': '0.75in',
-                        'margin-right': '0.75in',
-                        'margin-bottom': '0.75in',
-                        'margin-left': '0.75in',
-                        'encoding': "UTF-8",
-                        'no-outline': None,
-                        'enable-local-file-access': None
-                    }
-                    
-                    pdf_bytes = pdfkit.from_string(html_content, False, options=options)
-                    pdf_buffer = BytesIO(pdf_bytes)
-                    pdf_buffer.seek(0)
-                    
-                    print(f"PDF generado exitosamente con pdfkit. Tamaño: {len(pdf_bytes)} bytes")
-                    
-                else:
-                    raise Exception("pdfkit no disponible")
-                    
-            except Exception as pdfkit_error:
-                print(f"pdfkit también falló: {pdfkit_error}")
-                
-                # Usar ReportLab como última alternativa
-                if REPORTLAB_AVAILABLE:
-                    print("Usando ReportLab como última alternativa...")
-                    pdf_buffer = generar_pdf_reportlab(evaluacion)
-                    print("PDF generado con ReportLab (funcionalidad limitada)")
-                else:
-                    return jsonify({'error': f'Error al generar PDF: WeasyPrint: {str(weasy_error)}, pdfkit: {str(pdfkit_error)}'}), 500
+        pdf_buffer = BytesIO(pdf_bytes)
+        pdf_buffer.seek(0)
         
         # Nombre del archivo (sanitizar caracteres especiales)
-        nombre_sanitizado = ''.join(c if c.isalnum() or c in (' ', '_') else '_' for c in evaluacion['nombre'])
-        pdf_filename = f"evaluacion_{nombre_sanitizado.replace(' ', '_')}_{eval_id}.pdf"
+        pdf_filename = nombre_archivo_pdf(evaluacion, eval_id)
         
         # Si download=False, mostrar en el navegador (previsualización)
         as_attachment = download
@@ -1090,11 +3338,245 @@ def generar_pdf(eval_id):
                         mimetype='application/pdf')
                         
     except Exception as e:
-        import traceback
-        error_detail = traceback.format_exc()
-        print(f"Error general al generar PDF:\n{error_detail}")
+        log.error("Error general al generar PDF: %s", e, exc_info=con_traza())
+        metricas.incrementar('novaderma_errores_total', etapa='pdf')
         return jsonify({'error': f'Error al generar PDF: {str(e)}'}), 500
 
+class SalidaZipStreaming(io.RawIOBase):
+    """Destino de escritura para zipfile que acumula los bytes hasta que se envían al cliente.
+    
+    No admite seek/tell, por lo que zipfile escribe cada archivo con descriptor de datos y
+    el ZIP se puede enviar por partes mientras se generan los PDFs.
+    """
+    
+    def __init__(self):
+        super().__init__()
+        self._partes = []
+    
+    def writable(self):
+        return True
+    
+    def write(self, datos):
+        self._partes.append(bytes(datos))
+        return len(datos)
+    
+    def extraer(self):
+        """Retorna y descarta los bytes acumulados desde la última extracción"""
+        datos = b''.join(self._partes)
+        self._partes = []
+        return datos
+
+def generar_zip_pdfs(evaluaciones, agrupar=None):
+    """Genera un ZIP con el PDF de cada evaluación, entregando los bytes a medida que se producen"""
+    salida = SalidaZipStreaming()
+    errores = []
+    enviados = {'pdfs': 0, 'bytes_pdf': 0, 'bytes_zip': 0}
+    
+    def en_cache(evaluacion):
+        # Se consulta al tomar cada evaluación, sin recorrer antes toda la carga
+        return cache_pdf.obtener(clave_pdf(evaluacion, selector_backends.preferido()))
+    
+    def pdfs():
+        for evaluacion, pdf_bytes, backend, error in motor_pdf.renderizar_lote(evaluaciones, en_cache):
+            if error is None and backend is not None:
+                cache_pdf.guardar(clave_pdf(evaluacion, backend), pdf_bytes)
+            yield evaluacion, pdf_bytes, error
+    
+    with zipfile.ZipFile(salida, mode='w', compression=zipfile.ZIP_DEFLATED) as zip_file:
+        for evaluacion, pdf_bytes, error in pdfs():
+            eval_id = evaluacion.get('id', 0)
+            nombre_pdf = nombre_archivo_pdf(evaluacion, eval_id)
+            
+            # Agrupar en carpetas por área o jefe si se solicitó
+            if agrupar:
+                carpeta = sanitizar_nombre_archivo(str(evaluacion.get(agrupar) or '').strip()) or f"SIN_{agrupar.upper()}"
+                nombre_pdf = f"{carpeta}/{nombre_pdf}"
+            
+            if error is not None:
+                log.warning("Error al generar PDF de %s: %s", evaluacion.get('nombre'), error)
+                metricas.incrementar('novaderma_errores_total', etapa='zip')
+                errores.append(f"{nombre_pdf}: {error}")
+                continue
+            
+            zip_file.writestr(nombre_pdf, pdf_bytes)
+            metricas.observar('novaderma_pdf_bytes', len(pdf_bytes), documento='zip')
+            enviados['pdfs'] += 1
+            enviados['bytes_pdf'] += len(pdf_bytes)
+            bloque = salida.extraer()
+            enviados['bytes_zip'] += len(bloque)
+            yield bloque
+        
+        if errores:
+            zip_file.writestr('ERRORES.txt', '\n'.join(errores))
+    
+    # Directorio central del ZIP
+    bloque = salida.extraer()
+    enviados['bytes_zip'] += len(bloque)
+    log.info("ZIP enviado: %d PDFs, %d bytes de PDFs, %d bytes en total",
+             enviados['pdfs'], enviados['bytes_pdf'], enviados['bytes_zip'])
+    yield bloque
+
+@app.route('/generar-pdf-zip', methods=['POST'])
+def generar_pdf_zip():
+    """Descarga todos los PDFs de una carga en un único ZIP generado en streaming"""
+    try:
+        # Acepta JSON o un formulario (descarga nativa del navegador)
+        data = datos_peticion()
+        
+        # Evaluaciones de una carga guardada (upload_id) o enviadas en la petición
+        upload_id = data.get('upload_id')
+        evaluaciones = data.get('evaluaciones') or []
+        agrupar = data.get('agrupar') or None
+        
+        if upload_id:
+            if not almacen_cargas.existe(upload_id):
+                return jsonify({'error': CARGA_NO_ENCONTRADA}), 404
+            evaluaciones = almacen_cargas.iterar_evaluaciones(upload_id)
+        elif not evaluaciones:
+            return jsonify({'error': 'No se recibieron datos'}), 400
+        
+        if agrupar not in (None, 'area', 'jefe'):
+            return jsonify({'error': 'Agrupación no válida. Use "area" o "jefe"'}), 400
+        
+        fecha = datetime.now().strftime('%Y%m%d_%H%M')
+        zip_filename = f"evaluaciones_{fecha}.zip"
+        
+        return Response(stream_with_context(generar_zip_pdfs(evaluaciones, agrupar)),
+                        mimetype='application/zip',
+                        headers={'Content-Disposition': f'attachment; filename="{zip_filename}"'})
+        
+    except Exception as e:
+        return jsonify({'error': f'Error al generar ZIP: {str(e)}'}), 500
+
+def filtrar_evaluaciones(evaluaciones, filtros):
+    """Entrega solo las evaluaciones cuyos campos coinciden con los filtros (p. ej. {'area': 'VENTAS'})"""
+    for evaluacion in evaluaciones:
+        if all(str(evaluacion.get(campo) or '').strip().upper() == valor for campo, valor in filtros.items()):
+            yield evaluacion
+
+def leer_y_borrar(ruta, tamano_bloque=64 * 1024):
+    """Entrega el contenido de un archivo por bloques y lo borra al terminar"""
+    try:
+        with open(ruta, 'rb') as f:
+            while True:
+                bloque = f.read(tamano_bloque)
+                if not bloque:
+                    break
+                yield bloque
+    finally:
+        try:
+            os.remove(ruta)
+        except OSError:
+            pass
+
+@app.route('/generar-pdf-consolidado', methods=['GET', 'POST'])
+def descargar_pdf_consolidado():
+    """Descarga un único PDF con todas las evaluaciones de una carga (opcionalmente de un área o jefe)"""
+    # Acepta JSON, formulario (descarga nativa del navegador) o parámetros de la URL
+    data = datos_peticion()
+    
+    upload_id = data.get('upload_id')
+    evaluaciones = data.get('evaluaciones') or []
+    filtros = {campo: str(data[campo]).strip().upper() for campo in ('area', 'jefe') if data.get(campo)}
+    
+    if upload_id:
+        if not almacen_cargas.existe(upload_id):
+            return jsonify({'error': CARGA_NO_ENCONTRADA}), 404
+        origen = upload_id
+    elif evaluaciones:
+        origen = evaluaciones
+    else:
+        return jsonify({'error': 'No se recibieron datos'}), 400
+    
+    descriptor, ruta = tempfile.mkstemp(suffix='.pdf', dir=OUTPUT_FOLDER)
+    os.close(descriptor)
+    try:
+        total = motor_pdf.renderizar_consolidado(origen, filtros, ruta, PDF_CONSOLIDADO_TIMEOUT)
+    except Exception as e:
+        os.remove(ruta)
+        log.error("Error al generar PDF consolidado: %s", e, exc_info=con_traza())
+        metricas.incrementar('novaderma_errores_total', etapa='consolidado')
+        return jsonify({'error': f'Error al generar PDF consolidado: {str(e)}'}), 500
+    
+    if total == 0:
+        os.remove(ruta)
+        return jsonify({'error': 'No hay evaluaciones que coincidan con el filtro'}), 404
+    
+    tamano = os.path.getsize(ruta)
+    metricas.observar('novaderma_pdf_bytes', tamano, documento='consolidado')
+    
+    fecha = datetime.now().strftime('%Y%m%d_%H%M')
+    sufijo = ''.join(f"_{sanitizar_nombre_archivo(valor)}" for valor in filtros.values())
+    pdf_filename = f"evaluaciones{sufijo}_{fecha}.pdf"
+    disposition = 'attachment' if es_verdadero(data.get('download', True)) else 'inline'
+    
+    return Response(leer_y_borrar(ruta), mimetype='application/pdf',
+                    headers={'Content-Disposition': f'{disposition}; filename="{pdf_filename}"',
+                             'Content-Length': str(tamano),
+                             'X-Total-Evaluaciones': str(total)})
+
+@app.route('/metrics')
+def metrics():
+    """Métricas de todos los procesos del servicio en el formato de texto de Prometheus"""
+    return Response(metricas.texto(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/estado-pdf')
+def estado_pdf():
+    """Estado de los backends de PDF (disponibilidad, circuit breaker y contadores de fallos)
+    y tiempos de arranque de este worker"""
+    return jsonify({'backends': selector_backends.reporte(), 'arranque': tiempos_arranque})
+
+@app.before_request
+def medir_primera_peticion():
+    if 'primera_peticion' not in tiempos_arranque:
+        g.inicio_peticion = time.perf_counter()
+
+@app.after_request
+def registrar_primera_peticion(response):
+    """Registra la latencia de la primera petición de cada worker (la que paga el arranque en frío)"""
+    inicio = g.pop('inicio_peticion', None)
+    if inicio is not None and 'primera_peticion' not in tiempos_arranque:
+        ms = round((time.perf_counter() - inicio) * 1000, 1)
+        tiempos_arranque['primera_peticion'] = {'ruta': request.path, 'ms': ms}
+        log.info("Primera petición del worker: %s %s en %.0f ms", request.method, request.path, ms)
+    return response
+
+# Evaluación ficticia para el reporte de prueba del precalentamiento
+EVALUACION_PRUEBA = {
+    'id': 0, 'nombre': 'PRUEBA', 'cargo': 'PRUEBA', 'area': 'PRUEBA', 'jefe': 'PRUEBA',
+    'fecha': '2025-01-01', 'periodo': '2025', 'promedio': 4.0, 'rendimiento': 'Satisfactorio',
+    'comentario_jefe': '', 'aportes': '', 'plan_mejora': '', 'tipo_evaluacion': 'OPERATIVO',
+    'calificaciones': dict.fromkeys(COLUMNAS_CALIFICACION['OPERATIVO'], 4),
+}
+
+def precalentar():
+    """Sondea los backends y genera un reporte de prueba con el primero disponible.
+    
+    Deja importados los renderizadores y cargados el CSS, las fuentes, el logo y la
+    plantilla de ReportLab. No pasa por la caché ni por las métricas de render.
+    """
+    inicio = time.perf_counter()
+    selector_backends.sondear()
+    with app.app_context():
+        html_content = generar_html_reporte(EVALUACION_PRUEBA)
+    for nombre in selector_backends.candidatos():
+        try:
+            pdf_bytes = BACKENDS_PDF[nombre][0](html_content, EVALUACION_PRUEBA)
+        except Exception as e:
+            log.warning("Precalentamiento: %s falló: %s", nombre, e)
+            continue
+        ms = round((time.perf_counter() - inicio) * 1000, 1)
+        tiempos_arranque['precalentamiento'] = {'backend': nombre, 'ms': ms}
+        log.info("Precalentado en %.0f ms: reporte de prueba con %s (%d bytes)", ms, nombre, len(pdf_bytes))
+        return
+    log.warning("Precalentamiento: ningún backend pudo generar el reporte de prueba")
+
+if PRECALENTAR:
+    precalentar()
+tiempos_arranque['importacion_ms'] = round((time.perf_counter() - _inicio_importacion) * 1000, 1)
+log.info("Aplicación importada en %.0f ms%s", tiempos_arranque['importacion_ms'],
+         ' (con precalentamiento)' if PRECALENTAR else '; los renderizadores de PDF se importan al primer uso')
+
 if __name__ == '__main__':
     # En desarrollo
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,249 @@
+"""
+Benchmarks de lectura de Excel y CSV, resolución de encabezados y backends de PDF.
+
+Genera libros sintéticos de cada diseño y el mismo contenido como CSV (ver libros.py), mide
+cada caso por separado (mejor tiempo de varias repeticiones y pico de memoria de Python con
+tracemalloc) y compara contra una línea base guardada.
+
+Uso (desde la raíz del proyecto):
+    python benchmarks/ejecutar.py --guardar-base        # medir y guardar la línea base
+    python benchmarks/ejecutar.py                       # medir y comparar con la línea base
+    python benchmarks/ejecutar.py --filas 2000 --solo lectura
+
+Termina con código 1 si algún caso es más lento (o usa más memoria) que la línea base
+por encima de la tolerancia.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASE_POR_DEFECTO = os.path.join(RAIZ, 'benchmarks', 'resultados', 'base.json')
+
+# Veces que se repite la resolución de encabezados en un caso (es demasiado rápida para medirla una vez)
+ITERACIONES_ENCABEZADOS = 200
+# Filas de muestra para clasificar las columnas de texto, como al leer un libro
+FILAS_MUESTRA = 20
+
+
+@contextlib.contextmanager
+def silencio():
+    """Descarta la salida estándar mientras se mide.
+    
+    app.py ya no imprime: registra con el logger 'novaderma', que cargar_app deja en
+    WARNING. Esto solo descarta lo que escriban en stdout las bibliotecas que usa."""
+    with open(os.devnull, 'w') as nulo, contextlib.redirect_stdout(nulo):
+        yield
+
+
+def cargar_app(directorio):
+    """Importa app.py sin pool de PDFs, sin logs informativos, sin métricas en disco y con
+    el almacén de cargas en un directorio temporal"""
+    os.environ.setdefault('PDF_POOL_SIZE', '0')
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    os.environ['CARGAS_DB_PATH'] = os.path.join(directorio, 'cargas.sqlite3')
+    # Sin carpeta: al salir ya se borró el directorio temporal y no habría dónde guardarlas
+    os.environ['METRICAS_DIR'] = ''
+    os.chdir(RAIZ)
+    sys.path.insert(0, RAIZ)
+    with silencio():
+        import app
+    return app
+
+
+def medir(funcion, repeticiones):
+    """(mejor tiempo en segundos, pico de memoria en MB) de llamar a `funcion`"""
+    tiempos = []
+    for _ in range(repeticiones):
+        with silencio():
+            inicio = time.perf_counter()
+            funcion()
+            tiempos.append(time.perf_counter() - inicio)
+
+    # El pico de memoria se mide aparte: tracemalloc hace más lenta la ejecución
+    tracemalloc.start()
+    try:
+        with silencio():
+            funcion()
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return min(tiempos), pico / 1024 / 1024
+
+
+def casos_encabezados(app, libros):
+    """Detección del tipo y plan de columnas de cada diseño, sin leer las filas completas"""
+    import openpyxl
+
+    casos = {}
+    for diseno, ruta in libros.items():
+        workbook = openpyxl.load_workbook(ruta, read_only=True)
+        filas = workbook.worksheets[0].iter_rows(values_only=True)
+        headers = list(next(filas))
+        muestra = [list(fila) for _, fila in zip(range(FILAS_MUESTRA), filas)]
+        workbook.close()
+
+        def resolver(headers=headers, muestra=muestra):
+            for _ in range(ITERACIONES_ENCABEZADOS):
+                tipo = app.detectar_tipo_evaluacion(headers)
+                plan = app.PlanColumnas(headers, tipo)
+                plan.clasificar_columnas_texto(muestra)
+
+        casos[f'encabezados/{diseno}'] = resolver
+    return casos
+
+
+def casos_lectura(app, libros, csvs):
+    """procesar_excel completo de cada diseño, como libro de Excel y como CSV"""
+    casos = {f'lectura/{diseno}': (lambda ruta=ruta: app.procesar_excel(ruta)) for diseno, ruta in libros.items()}
+    casos.update({f'lectura_csv/{diseno}': (lambda ruta=ruta: app.procesar_excel(ruta)) for diseno, ruta in csvs.items()})
+    return casos
+
+
+def casos_pdf(app, libros, cantidad, backends):
+    """Plantilla HTML y cada backend de PDF disponible, con `cantidad` evaluaciones de todos los diseños"""
+    with silencio():
+        por_diseno = [app.procesar_excel(ruta)[:cantidad] for ruta in libros.values()]
+    # Se alternan los diseños para que el lote tenga evaluaciones de todos los tipos
+    evaluaciones = [ev for grupo in zip(*por_diseno) for ev in grupo][:cantidad]
+
+    with app.app.app_context():
+        htmls = [app.generar_html_reporte(ev) for ev in evaluaciones]
+
+    def plantilla():
+        with app.app.app_context():
+            for ev in evaluaciones:
+                app.generar_html_reporte(ev)
+
+    casos = {'pdf/plantilla_html': plantilla}
+    for nombre in backends or list(app.BACKENDS_PDF):
+        generar, sondear = app.BACKENDS_PDF[nombre]
+        try:
+            with silencio():
+                sondear()
+        except Exception as e:
+            print(f'  (se omite pdf/{nombre}: {e})')
+            continue
+
+        def renderizar(generar=generar):
+            for html, ev in zip(htmls, evaluaciones):
+                generar(html, ev)
+
+        casos[f'pdf/{nombre}'] = renderizar
+    return casos
+
+
+def comparar(resultados, base, tolerancia):
+    """Imprime la tabla de resultados frente a la línea base y retorna los casos que empeoraron"""
+    casos_base = base['casos'] if base else {}
+    peores = []
+    print(f"\n{'caso':<32}{'segundos':>10}{'base':>10}{'cambio':>9}{'memoria MB':>12}{'base':>9}")
+    for caso, medida in resultados.items():
+        anterior = casos_base.get(caso)
+        linea = f"{caso:<32}{medida['segundos']:>10.4f}"
+        if anterior:
+            cambio = medida['segundos'] / anterior['segundos'] - 1 if anterior['segundos'] else 0.0
+            linea += f"{anterior['segundos']:>10.4f}{cambio:>+9.1%}"
+        else:
+            linea += f"{'-':>10}{'-':>9}"
+        linea += f"{medida['memoria_mb']:>12.2f}"
+        linea += f"{anterior['memoria_mb']:>9.2f}" if anterior else f"{'-':>9}"
+
+        if anterior and (medida['segundos'] > anterior['segundos'] * (1 + tolerancia)
+                         or medida['memoria_mb'] > anterior['memoria_mb'] * (1 + tolerancia) + 0.5):
+            linea += '  <- empeoró'
+            peores.append(caso)
+        print(linea)
+    return peores
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks de lectura y generación de PDFs')
+    parser.add_argument('--filas', type=int, default=500, help='filas de cada libro sintético')
+    parser.add_argument('--repeticiones', type=int, default=3, help='repeticiones por caso (se toma la mejor)')
+    parser.add_argument('--pdfs', type=int, default=10, help='evaluaciones por caso de PDF')
+    parser.add_argument('--backends', nargs='*', help='backends de PDF a medir (por defecto todos los disponibles)')
+    parser.add_argument('--solo', nargs='*', default=[], help='prefijos de los casos a ejecutar: encabezados, lectura, pdf')
+    parser.add_argument('--base', default=BASE_POR_DEFECTO, help='archivo de la línea base')
+    parser.add_argument('--guardar-base', action='store_true', help='guardar los resultados como nueva línea base')
+    parser.add_argument('--tolerancia', type=float, default=0.2, help='empeoramiento aceptado (0.2 = 20%%)')
+    parser.add_argument('--salida', help='guardar también los resultados en este archivo JSON')
+    args = parser.parse_args()
+
+    from libros import DISENOS, encabezados, generar_libro
+
+    with tempfile.TemporaryDirectory(prefix='bench_novaderma_') as directorio:
+        app = cargar_app(directorio)
+
+        print(f'Generando libros sintéticos de {args.filas} filas...')
+        libros = {}
+        csvs = {}
+        for diseno, (tipo, _, _) in DISENOS.items():
+            libros[diseno] = generar_libro(os.path.join(directorio, f'{diseno}.xlsx'), diseno, args.filas)
+            csvs[diseno] = generar_libro(os.path.join(directorio, f'{diseno}.csv'), diseno, args.filas)
+            with silencio():
+                detectado = app.detectar_tipo_evaluacion(encabezados(diseno))
+            if detectado != tipo:
+                print(f'  Advertencia: {diseno} se detecta como {detectado}, no como {tipo}')
+
+        casos = {}
+        casos.update(casos_encabezados(app, libros))
+        casos.update(casos_lectura(app, libros, csvs))
+        if not args.solo or any(prefijo.startswith('pdf') for prefijo in args.solo):
+            casos.update(casos_pdf(app, libros, args.pdfs, args.backends))
+        if args.solo:
+            casos = {caso: funcion for caso, funcion in casos.items() if caso.startswith(tuple(args.solo))}
+
+        resultados = {}
+        for caso, funcion in casos.items():
+            print(f'Midiendo {caso}...')
+            segundos, memoria = medir(funcion, args.repeticiones)
+            resultados[caso] = {'segundos': round(segundos, 6), 'memoria_mb': round(memoria, 3)}
+
+    informe = {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'filas': args.filas,
+        'pdfs': args.pdfs,
+        'repeticiones': args.repeticiones,
+        'casos': resultados,
+    }
+
+    base = None
+    if os.path.exists(args.base) and not args.guardar_base:
+        with open(args.base, encoding='utf-8') as archivo:
+            base = json.load(archivo)
+        if (base.get('filas'), base.get('pdfs')) != (args.filas, args.pdfs):
+            print(f"\nAdvertencia: la línea base se midió con {base.get('filas')} filas y {base.get('pdfs')} PDFs; "
+                  f"los tiempos no son comparables")
+
+    peores = comparar(resultados, base, args.tolerancia)
+
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as archivo:
+            json.dump(informe, archivo, indent=2, ensure_ascii=False)
+    if args.guardar_base:
+        os.makedirs(os.path.dirname(args.base), exist_ok=True)
+        with open(args.base, 'w', encoding='utf-8') as archivo:
+            json.dump(informe, archivo, indent=2, ensure_ascii=False)
+        print(f'\nLínea base guardada en {args.base}')
+    elif base is None:
+        print(f'\nNo hay línea base en {args.base}; use --guardar-base para crearla')
+
+    if peores:
+        print(f"\n{len(peores)} caso(s) empeoraron más de {args.tolerancia:.0%}: {', '.join(peores)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,176 @@
+"""
+Generador de libros de Excel sintéticos para los benchmarks.
+
+Cada diseño reproduce los encabezados de uno de los formularios de evaluación, con el
+número de columnas que usa detectar_tipo_evaluacion para distinguirlos (51, 53 y 56 o
+más, con y sin columnas de VENTAS/CUOTAS), y llena las filas con datos parecidos a los
+reales: calificaciones de 1 a 5 con algunas celdas vacías, fechas en varios formatos,
+comentarios de largo variable y algún promedio como porcentaje. Con un destino .csv se
+escribe el mismo contenido como CSV en UTF-8, como lo exporta el formulario de RR. HH.
+
+Uso:
+    python benchmarks/libros.py COMERCIAL 1000 comercial.xlsx
+    python benchmarks/libros.py COMERCIAL 1000 comercial.csv
+"""
+
+import argparse
+import csv
+import datetime
+import random
+
+import openpyxl
+
+COMUNES = [
+    'Marca temporal', 'Dirección de correo electrónico', 'NOMBRE DEL COLABORADOR', 'CARGO',
+    'ÁREA / PROCESO', 'JEFE INMEDIATO', 'FECHA DE EVALUACIÓN', 'PERÍODO EVALUADO',
+]
+
+PREGUNTAS_OPERATIVO = [
+    'Organiza las tareas a fin de cumplir con los tiempos establecidos',
+    'Cumple con los resultados esperados de su función',
+    'Demuestra capacidad para apoyar y generar aportes constructivos al área',
+    'Realiza las actividades encomendadas según las instrucciones dadas',
+    'Demuestra compromiso con el cumplimiento de los objetivos y metas',
+    'Actúa en pro de los intereses de la empresa y bienestar general',
+    'Propone alternativas para mejorar el trabajo, aportando ideas',
+    'RELACIONES INTERPERSONALES: Mantiene relaciones de cordialidad',
+    'TRABAJO EN EQUIPO: Apoya a los compañeros',
+    'ACTITUD DE SERVICIO: Se preocupa por satisfacer las necesidades del cliente',
+]
+
+PREGUNTAS_ADMINISTRATIVA = [
+    'Conoce y aplica los procedimientos del área',
+    *PREGUNTAS_OPERATIVO[1:4],
+    'Demuestra capacidad para analizar y solucionar los problemas que se presentan',
+    'Presenta informes, cartas, etc., de manera oportuna y adecuada',
+    'Aplica en su desempeño diario los conceptos vistos en capacitaciones y entrenamientos',
+    'Hace uso adecuado del equipo y demás elementos de trabajo',
+    'Entrega los informes o tareas encomendadas de manera clara',
+    *PREGUNTAS_OPERATIVO[4:],
+]
+
+PREGUNTAS_COMERCIAL = [
+    'ORGANIZA SU TRABAJO', 'CUMPLE CON LOS RESULTADOS', 'APLICA LO APRENDIDO EN CAPACITACION',
+    'USO DE RECURSOS', 'CUMPLIMIENTO DE VENTAS Y CUOTAS', 'ATENCION A CLIENTES Y MEDICOS',
+    'POLITICAS Y PROCEDIMIENTOS', 'POLITICA DE CALIDAD', 'PROPONE MEJORAS',
+    'RELACIONES INTERPERSONALES', 'TRABAJO EN EQUIPO', 'ACTITUD DE SERVICIO',
+]
+
+PREGUNTAS_DIRECTIVOS = [
+    'ORGANIZA SU AREA', 'CUMPLE RESULTADOS', 'APLICA CAPACITACION', 'USO DE RECURSOS', 'LIDERAZGO',
+    'GESTION EFICIENTE', 'EVALUACION DEL EQUIPO', 'POLITICAS', 'CALIDAD', 'MEJORAS',
+    'RELACIONES', 'COLABORACION', 'SERVICIO',
+]
+
+TEXTO = [
+    'COMENTARIOS DEL JEFE INMEDIATO (fortalezas y debilidades)', 'QUE APORTES HIZO USTED AL AREA',
+    'PLAN DE MEJORA PROPUESTO', 'PROMEDIO',
+]
+
+# Diseño -> (tipo que debe detectar app.detectar_tipo_evaluacion, preguntas, columnas totales)
+DISENOS = {
+    'OPERATIVO': ('OPERATIVO', PREGUNTAS_OPERATIVO, 51),
+    'ADMINISTRATIVA': ('ADMINISTRATIVA', PREGUNTAS_ADMINISTRATIVA, 53),
+    'COMERCIAL': ('COMERCIAL', PREGUNTAS_COMERCIAL, 56),
+    'DIRECTIVOS': ('DIRECTIVOS', PREGUNTAS_DIRECTIVOS, 56),
+    'DIRECTIVOS_AMPLIO': ('DIRECTIVOS', PREGUNTAS_DIRECTIVOS, 60),
+}
+
+NOMBRES = ['MARÍA', 'JOSÉ', 'ANA', 'LUIS', 'CARLOS', 'DIANA', 'JUAN', 'PAULA', 'ANDRÉS', 'LAURA', 'SERGIO', 'SOFÍA']
+APELLIDOS = ['GÓMEZ', 'PÉREZ', 'RODRÍGUEZ', 'MARTÍNEZ', 'LÓPEZ', 'MUÑOZ', 'CASTRO', 'ORTIZ', 'RAMÍREZ', 'NÚÑEZ']
+CARGOS = ['Auxiliar de producción', 'Analista', 'Visitador médico', 'Coordinador', 'Asistente administrativo', 'Jefe']
+AREAS = ['Producción', 'Calidad', 'Ventas', 'Logística', 'Gestión Humana', 'Contabilidad']
+JEFES = ['Ana Pérez', 'Luis Gómez', 'Carolina Díaz', 'Fernando Ruiz']
+PERIODOS = ['2024', 'ENERO - DICIEMBRE 2024', '2023-2024', 'Segundo semestre 2024', None]
+FRASES = [
+    'Cumple con sus funciones de manera responsable',
+    'Debe mejorar la puntualidad en la entrega de informes',
+    'Muestra buena disposición para el trabajo en equipo',
+    'Propone mejoras en el proceso',
+    'Requiere fortalecer el manejo de herramientas ofimáticas',
+    'Mantiene buena relación con clientes y compañeros',
+]
+
+
+def encabezados(diseno):
+    """Encabezados del diseño, completados con columnas de observaciones hasta su número de columnas"""
+    _, preguntas, total = DISENOS[diseno]
+    columnas = COMUNES + preguntas + TEXTO
+    extra = 0
+    while len(columnas) < total:
+        extra += 1
+        columnas.append(f'OBSERVACION ADICIONAL {extra}')
+    return columnas
+
+
+def _texto(rnd, minimo, maximo):
+    return '. '.join(rnd.choice(FRASES) for _ in range(rnd.randint(minimo, maximo)))
+
+
+def _fecha(rnd):
+    dia = datetime.datetime(2024, 1, 1) + datetime.timedelta(days=rnd.randrange(365))
+    formato = rnd.random()
+    if formato < 0.6:
+        return dia
+    if formato < 0.8:
+        return dia.strftime('%d/%m/%Y')
+    return dia.strftime('%Y-%m-%d')
+
+
+def _fila(rnd, numero, columnas, preguntas):
+    calificaciones = [rnd.choice((3, 4, 4, 5, 5)) if rnd.random() > 0.05 else None for _ in preguntas]
+    validas = [c for c in calificaciones if c]
+    promedio = round(sum(validas) / len(validas), 1) if validas else None
+    if promedio is not None and rnd.random() < 0.2:
+        promedio = round(promedio * 20)  # Algunos formularios guardan el promedio como porcentaje
+
+    valores = {
+        'Marca temporal': datetime.datetime(2024, 12, 1, 8, 0) + datetime.timedelta(minutes=numero),
+        'Dirección de correo electrónico': f'colaborador{numero}@novaderma.com',
+        'NOMBRE DEL COLABORADOR': f'{rnd.choice(NOMBRES)} {rnd.choice(APELLIDOS)} {rnd.choice(APELLIDOS)} {numero}',
+        'CARGO': rnd.choice(CARGOS),
+        'ÁREA / PROCESO': rnd.choice(AREAS),
+        'JEFE INMEDIATO': rnd.choice(JEFES),
+        'FECHA DE EVALUACIÓN': _fecha(rnd),
+        'PERÍODO EVALUADO': rnd.choice(PERIODOS),
+        TEXTO[0]: _texto(rnd, 1, 4),
+        TEXTO[1]: _texto(rnd, 0, 2) or None,
+        TEXTO[2]: _texto(rnd, 1, 2),
+        TEXTO[3]: promedio,
+    }
+    valores.update(zip(preguntas, calificaciones))
+    return [valores.get(columna, rnd.choice((None, None, 'Sin observaciones'))) for columna in columnas]
+
+
+def generar_libro(destino, diseno, filas, semilla=1):
+    """Escribe en `destino` un libro (o un CSV) con `filas` evaluaciones del diseño indicado y lo retorna"""
+    _, preguntas, _ = DISENOS[diseno]
+    columnas = encabezados(diseno)
+    rnd = random.Random(f'{diseno}-{semilla}')
+
+    if destino.lower().endswith('.csv'):
+        with open(destino, 'w', encoding='utf-8', newline='') as archivo:
+            escritor = csv.writer(archivo)
+            escritor.writerow(columnas)
+            for numero in range(filas):
+                escritor.writerow(['' if valor is None else valor for valor in _fila(rnd, numero, columnas, preguntas)])
+        return destino
+
+    workbook = openpyxl.Workbook(write_only=True)
+    hoja = workbook.create_sheet(diseno.title())
+    hoja.append(columnas)
+    for numero in range(filas):
+        hoja.append(_fila(rnd, numero, columnas, preguntas))
+    workbook.save(destino)
+    return destino
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Genera un libro de evaluaciones sintético')
+    parser.add_argument('diseno', choices=list(DISENOS))
+    parser.add_argument('filas', type=int)
+    parser.add_argument('destino')
+    parser.add_argument('--semilla', type=int, default=1)
+    args = parser.parse_args()
+    generar_libro(args.destino, args.diseno, args.filas, args.semilla)
+    print(f'{args.destino}: {args.filas} filas, {len(encabezados(args.diseno))} columnas ({args.diseno})')
@@ -0,0 +1,428 @@
+"""
+Reporte de evaluación con ReportLab, el backend de PDF que no depende de HTML.
+
+Se importa recién cuando se usa ReportLab (ver importar_renderizador en app.py), así un
+worker que genera con WeasyPrint, o que todavía no generó ningún PDF, no carga ReportLab.
+Lo que depende de la aplicación (la evaluación como dict, el logo y la caché de la
+plantilla por proceso) queda en app.py.
+"""
+
+import logging
+import threading
+from io import BytesIO
+
+from reportlab import rl_config
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, PageBreak, Image, Flowable
+from reportlab.lib import colors
+from reportlab.lib.units import inch
+from reportlab.lib.utils import ImageReader
+
+log = logging.getLogger('novaderma')
+
+# Streams binarios: ASCII85 agrega un 25% a cada imagen y contenido ya comprimido con Flate
+rl_config.useA85 = 0
+
+# Metadatos fijos del documento. Con invariant=1 ReportLab no escribe la fecha de creación
+# ni un identificador aleatorio: la misma evaluación produce siempre el mismo PDF
+METADATOS_PDF = {
+    'author': 'LABORATORIOS NOVADERMA S.A.',
+    'creator': 'Informes Novaderma',
+    'subject': 'Evaluación de desempeño y competencias del trabajador',
+}
+
+def crear_estilos_reportlab():
+    """Crea los estilos de párrafo de ReportLab que replican el CSS original"""
+    styles = getSampleStyleSheet()
+    
+    return {
+        # Estilo para el título principal
+        'main_title': ParagraphStyle(
+            'MainTitle',
+            parent=styles['Heading1'],
+            fontSize=16,
+            spaceAfter=6,
+            alignment=1,  # Centrado
+            fontName='Helvetica-Bold',
+            textColor=colors.black
+        ),
+        # Estilo para subtítulo
+        'subtitle': ParagraphStyle(
+            'Subtitle',
+            parent=styles['Normal'],
+            fontSize=11,
+            spaceAfter=12,
+            alignment=1,  # Centrado
+            fontName='Helvetica',
+            textColor=colors.black
+        ),
+        # Estilo para títulos de sección
+        'section_title': ParagraphStyle(
+            'SectionTitle',
+            parent=styles['Heading2'],
+            fontSize=12,
+            spaceAfter=6,
+            spaceBefore=12,
+            fontName='Helvetica-Bold',
+            textColor=colors.black,
+            borderWidth=1,
+            borderColor=colors.lightgrey,
+            borderPadding=3
+        ),
+        # Estilo para texto normal
+        'normal': ParagraphStyle(
+            'CustomNormal',
+            parent=styles['Normal'],
+            fontSize=11,
+            spaceAfter=3,
+            fontName='Helvetica',
+            textColor=colors.black
+        ),
+        # Estilo para labels en negrita
+        'label': ParagraphStyle(
+            'LabelStyle',
+            parent=styles['Normal'],
+            fontSize=11,
+            spaceAfter=3,
+            fontName='Helvetica-Bold',
+            textColor=colors.black
+        ),
+        # Bloque de códigos del formato (CODIGO / VERSION / VIGENCIA)
+        'code': ParagraphStyle('CodeStyle', parent=styles['Normal'], fontSize=10, alignment=2),
+        # Nombre de la empresa cuando no hay logo
+        'company': ParagraphStyle('CompanyName', parent=styles['Normal'], fontSize=20, fontName='Helvetica-Bold'),
+        # Nota al pie
+        'footer': ParagraphStyle(
+            'Footer',
+            parent=styles['Normal'],
+            fontSize=10,
+            textColor=colors.black,
+            borderWidth=1,
+            borderColor=colors.lightgrey,
+            borderPadding=5,
+            spaceBefore=10
+        )
+    }
+
+def sondear():
+    """Verifica que ReportLab pueda escribir un PDF"""
+    canvas.Canvas(BytesIO(), pagesize=A4).save()
+
+def documento_reportlab(destino, titulo='Evaluaciones de desempeño'):
+    """Plantilla de documento A4 con los márgenes del reporte y metadatos deterministas"""
+    return SimpleDocTemplate(destino, pagesize=A4, topMargin=0.5*inch, bottomMargin=0.5*inch, 
+                             leftMargin=0.5*inch, rightMargin=0.5*inch,
+                             invariant=1, title=titulo, **METADATOS_PDF)
+
+class ReferenciaPiezaFija(Flowable):
+    """Aparición de una PiezaFija en la historia de un documento"""
+
+    def __init__(self, pieza, como_form):
+        super().__init__()
+        self.pieza = pieza
+        self.como_form = como_form
+        self.hAlign = pieza.hAlign
+
+    def getSpaceBefore(self):
+        return self.pieza.espacio_antes
+
+    def getSpaceAfter(self):
+        return self.pieza.espacio_despues
+
+    def wrap(self, availWidth, availHeight):
+        self.width, self.height = self.pieza.medir(availWidth)
+        return self.width, self.height
+
+    def split(self, availWidth, availHeight):
+        return self.pieza.partir(availWidth, availHeight)
+
+    def draw(self):
+        self.pieza.dibujar(self.canv, self.como_form)
+
+class PiezaFija:
+    """Flowable que no cambia entre reportes: se construye y se mide una vez por proceso.
+    
+    En documentos donde aparece muchas veces (el PDF consolidado) se dibuja una sola vez
+    como form XObject y las apariciones siguientes solo lo referencian; en un PDF individual
+    se dibuja directamente, porque un form usado una vez solo agrega bytes.
+    """
+    
+    # Margen de la caja del form: los bordes de los párrafos (borderPadding) quedan fuera del flowable
+    MARGEN = 12
+    
+    def __init__(self, nombre, flowable, lock):
+        self.nombre = nombre
+        self.flowable = flowable
+        self.hAlign = getattr(flowable, 'hAlign', 'LEFT')
+        self.espacio_antes = flowable.getSpaceBefore()
+        self.espacio_despues = flowable.getSpaceAfter()
+        self._lock = lock
+        self._medida = None
+    
+    def medir(self, ancho_disponible):
+        """(ancho, alto) del flowable; solo se calcula de nuevo si cambia el ancho disponible"""
+        with self._lock:
+            if self._medida is None or self._medida[0] != ancho_disponible:
+                self._medida = (ancho_disponible, *self.flowable.wrap(ancho_disponible, 10 ** 6))
+            return self._medida[1:]
+    
+    def partir(self, ancho_disponible, alto_disponible):
+        """Partes del flowable cuando no cabe al final de una página (flowables nuevos, no fijos)"""
+        with self._lock:
+            partes = self.flowable.split(ancho_disponible, alto_disponible)
+            # split puede descartar la medida que guarda el flowable
+            self._medida = None
+            return partes
+    
+    def dibujar(self, canv, como_form=False):
+        with self._lock:
+            if not como_form:
+                self.flowable.drawOn(canv, 0, 0)
+                return
+            if not canv._doc.hasForm(self.nombre):
+                _, ancho, alto = self._medida
+                canv.beginForm(self.nombre, -self.MARGEN, -self.MARGEN, ancho + self.MARGEN, alto + self.MARGEN)
+                self.flowable.drawOn(canv, 0, 0)
+                canv.endForm()
+        canv.doForm(self.nombre)
+    
+    def referencia(self, como_form=False):
+        return ReferenciaPiezaFija(self, como_form)
+
+class PlantillaReportLab:
+    """Partes del reporte de ReportLab que no cambian entre evaluaciones, armadas una vez por proceso.
+    
+    El encabezado (logo y códigos del formato), los títulos, los títulos de sección y el pie
+    de página son PiezaFija: se construyen y se miden una sola vez, y cada documento los
+    dibuja una vez (en el PDF consolidado, el mismo encabezado sirve para todas las
+    evaluaciones). También se preparan las etiquetas de la tabla de calificaciones de cada
+    tipo de evaluación y los estilos de las tablas; por evaluación solo se arman sus datos.
+    """
+    
+    CODIGOS = "<b>CODIGO:</b> FT-RH-042<br/><b>VERSION:</b> 1<br/><b>VIGENCIA:</b> 2026/02/03"
+    EMPRESA = "LABORATORIOS NOVADERMA S.A."
+    PIE = """Este formato se utiliza como registro de evaluación de desempeño y competencias del trabajador, 
+    en coherencia con las políticas internas de LABORATORIOS NOVADERMA S.A. y con los lineamientos 
+    del Sistema de Gestión de la Calidad."""
+    SECCIONES = {
+        'identificacion': "1. Datos de identificación del colaborador",
+        'resumen': "2. Resumen del desempeño",
+        'desempeno': "3. Desempeño en el cargo (1 a 5)",
+        'aportes': "6. Aportes",
+        'plan': "7. Plan de mejora",
+    }
+    
+    # Etiquetas de la tabla de calificaciones: las dos primeras dependen del tipo de evaluación,
+    # luego vienen las específicas del tipo y al final las comunes
+    ETIQUETAS_ORGANIZACION = {
+        'COMERCIAL': "Planificación y organización del trabajo comercial:",
+        'DIRECTIVOS': "Organización y planificación estratégica:",
+        'ADMINISTRATIVA': "Organización de tareas administrativas:",
+    }
+    ETIQUETAS_RESULTADOS = {
+        'COMERCIAL': "Cumplimiento de objetivos comerciales y cuotas:",
+        'DIRECTIVOS': "Cumplimiento de resultados del área dirigida:",
+        'ADMINISTRATIVA': "Cumplimiento de tareas y procedimientos:",
+    }
+    ETIQUETAS_ESPECIFICAS = {
+        'COMERCIAL': (
+            ('ventas', "Cumplimiento de cuotas y panel médico:"),
+            ('clientes', "Atención y relación con clientes/médicos:"),
+        ),
+        'DIRECTIVOS': (
+            ('liderazgo', "Liderazgo y dirección de equipos:"),
+            ('gestion', "Gestión eficiente de recursos:"),
+            ('evaluacion_equipo', "Evaluación y análisis de resultados del equipo:"),
+        ),
+        'ADMINISTRATIVA': (
+            ('analisis', "Análisis y solución de problemas:"),
+            ('informes', "Entrega de informes y tareas:"),
+            ('planificacion', "Planificación y cumplimiento del plan de trabajo:"),
+        ),
+    }
+    ETIQUETAS_COMUNES = (
+        ('uso_equipos', 'Uso adecuado de equipos y recursos:'),
+        ('cumple_politicas', 'Cumple con políticas, procedimientos, normas y horarios:'),
+        ('conoce_calidad', 'Conoce y aplica la política de calidad:'),
+        ('propone_mejoras', 'Propone alternativas de mejora e ideas constructivas:'),
+        ('relaciones', 'Relaciones interpersonales y cordialidad:'),
+        ('trabajo_equipo', 'Trabajo en equipo y colaboración:'),
+        ('actitud_servicio', 'Actitud de servicio:'),
+    )
+    
+    def __init__(self, estilos, logo):
+        self.estilos = estilos
+        self.logo = logo
+        lock = threading.Lock()
+        piezas = {
+            'encabezado': self._encabezado(logo),
+            'titulo': Paragraph("RESULTADOS EVALUACIÓN DE DESEMPEÑO LABORAL", estilos['main_title']),
+            'subtitulo': Paragraph("Evaluación de desempeño y competencias del trabajador", estilos['subtitle']),
+            'pie': Paragraph(self.PIE, estilos['footer']),
+        }
+        for nombre, titulo in self.SECCIONES.items():
+            piezas[nombre] = Paragraph(titulo, estilos['section_title'])
+        self._piezas = {nombre: PiezaFija(f'Fijo{nombre.title()}', flowable, lock) for nombre, flowable in piezas.items()}
+        
+        self.etiquetas = {}
+        for tipo in ('OPERATIVO', 'ADMINISTRATIVA', 'COMERCIAL', 'DIRECTIVOS'):
+            self.etiquetas[tipo] = (
+                ('organizacion', self.ETIQUETAS_ORGANIZACION.get(tipo, "Organización del trabajo y cumplimiento de tiempos:")),
+                ('cumple_resultados', self.ETIQUETAS_RESULTADOS.get(tipo, "Cumple con los resultados esperados de su función:")),
+                ('aplica_capacitacion', "Aplica conceptos de capacitaciones y entrenamientos:"),
+                *self.ETIQUETAS_ESPECIFICAS.get(tipo, ()),
+                *self.ETIQUETAS_COMUNES,
+            )
+        
+        self.estilo_resumen = TableStyle([
+            ('FONTNAME', (0, 0), (-1, -1), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, -1), 11),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+            ('BACKGROUND', (0, 0), (-1, -1), colors.lightgrey),
+            ('GRID', (0, 0), (-1, -1), 1, colors.grey),
+            ('TOPPADDING', (0, 0), (-1, -1), 8),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
+        ])
+        self.estilo_calificaciones = TableStyle([
+            ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
+            ('FONTSIZE', (0, 0), (-1, -1), 10),
+            ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+            ('ALIGN', (1, 0), (1, -1), 'CENTER'),
+            ('LEFTPADDING', (0, 0), (-1, -1), 6),
+            ('RIGHTPADDING', (0, 0), (-1, -1), 6),
+            ('TOPPADDING', (0, 0), (-1, -1), 4),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), 4),
+            ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+            ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+        ])
+    
+    def _encabezado(self, logo):
+        """Tabla con el logo (PNG ya reducido, o el nombre de la empresa si no hay logo) y los códigos del formato"""
+        codigos = Paragraph(self.CODIGOS, self.estilos['code'])
+        if logo:
+            try:
+                # Logo con altura máxima de 45px (como en CSS)
+                logo_height = 45
+                ancho, alto = ImageReader(BytesIO(logo)).getSize()
+                logo_width = logo_height * (ancho / alto)
+                imagen = Image(BytesIO(logo), width=logo_width, height=logo_height, lazy=0, hAlign='LEFT')
+                
+                header_table = Table([[imagen, codigos]], colWidths=[2*inch, 2*inch])
+                header_table.setStyle(TableStyle([
+                    ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+                    ('ALIGN', (0, 0), (0, 0), 'LEFT'),   # Logo a la izquierda
+                    ('ALIGN', (1, 0), (1, 0), 'RIGHT'),  # Códigos a la derecha
+                    ('LEFTPADDING', (0, 0), (-1, -1), 0),
+                    ('RIGHTPADDING', (0, 0), (-1, -1), 0),
+                    ('TOPPADDING', (0, 0), (-1, -1), 0),
+                    ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+                ]))
+                return header_table
+            except Exception as e:
+                log.warning("Error cargando logo: %s", e)
+        
+        # Sin logo disponible
+        header_table = Table([[Paragraph(f"<b>{self.EMPRESA}</b>", self.estilos['company']), codigos]],
+                             colWidths=[4*inch, 2*inch])
+        header_table.setStyle(TableStyle([
+            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+            ('ALIGN', (0, 0), (0, 0), 'LEFT'),
+            ('ALIGN', (1, 0), (1, 0), 'RIGHT'),
+            ('LEFTPADDING', (0, 0), (-1, -1), 0),
+            ('RIGHTPADDING', (0, 0), (-1, -1), 0),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
+        ]))
+        return header_table
+    
+    def historia(self, evaluacion, como_form=False):
+        """Flowables del reporte de una evaluación (dict).
+        
+        `como_form` dibuja las partes fijas como form XObjects, para documentos con muchas evaluaciones.
+        """
+        def fija(nombre):
+            return self._piezas[nombre].referencia(como_form)
+        
+        normal_style = self.estilos['normal']
+        story = [fija('encabezado'), fija('titulo'), fija('subtitulo')]
+        
+        # === SECCIÓN 1: DATOS DE IDENTIFICACIÓN ===
+        story.append(fija('identificacion'))
+        datos_identificacion = [
+            ("Empresa:", self.EMPRESA),
+            ("Área / Proceso:", evaluacion.get('area', '').upper()),
+            ("Cargo:", evaluacion.get('cargo', '').upper()),
+            ("Nombre del colaborador:", evaluacion.get('nombre', '').upper()),
+            ("Jefe inmediato:", evaluacion.get('jefe', '').upper()),
+            ("Período evaluado:", evaluacion.get('periodo', '').upper()),
+            ("Fecha de evaluación:", evaluacion.get('fecha', '').upper()),
+        ]
+        for label, value in datos_identificacion:
+            story.append(Paragraph(f"<b>{label}</b> {value}", normal_style))
+        story.append(Spacer(1, 12))
+        
+        # === SECCIÓN 2: RESUMEN DEL DESEMPEÑO ===
+        story.append(fija('resumen'))
+        promedio = evaluacion.get('promedio', 0)
+        rendimiento = evaluacion.get('rendimiento', 'NO EVALUADO')
+        story.append(Table([[f"PROMEDIO: {promedio:.1f}", f"RENDIMIENTO: {rendimiento.upper()}"]],
+                           colWidths=[2.5*inch, 2.5*inch], style=self.estilo_resumen))
+        story.append(Spacer(1, 6))
+        comentario = evaluacion.get('comentario_jefe', 'Sin comentarios').upper()
+        story.append(Paragraph(f"<b>Comentario del jefe inmediato:</b><br/>{comentario}", normal_style))
+        story.append(Spacer(1, 12))
+        
+        # === SECCIÓN 3: DESEMPEÑO EN EL CARGO ===
+        story.append(fija('desempeno'))
+        calificaciones = evaluacion.get('calificaciones', {})
+        etiquetas = self.etiquetas.get(evaluacion.get('tipo_evaluacion', 'OPERATIVO'), self.etiquetas['OPERATIVO'])
+        cal_data = [[label, f"{calificaciones[key]} / 5"] for key, label in etiquetas if calificaciones.get(key, 0) > 0]
+        if cal_data:
+            story.append(Table(cal_data, colWidths=[4.5*inch, 1*inch], style=self.estilo_calificaciones))
+        story.append(Spacer(1, 12))
+        
+        # === SECCIÓN 6: APORTES ===
+        story.append(fija('aportes'))
+        story.append(Paragraph(evaluacion.get('aportes', 'Sin aportes registrados').upper(), normal_style))
+        story.append(Spacer(1, 12))
+        
+        # === SECCIÓN 7: PLAN DE MEJORA ===
+        story.append(fija('plan'))
+        plan_mejora = evaluacion.get('plan_mejora', 'Sin plan de mejora registrado').upper()
+        story.append(Paragraph(f"<b>Acción de mejora:</b><br/>{plan_mejora}", normal_style))
+        
+        # === FOOTER ===
+        story.append(Spacer(1, 20))
+        story.append(fija('pie'))
+        return story
+
+class HistoriaPerezosa(list):
+    """Historia de ReportLab que se rellena desde un generador a medida que se consume.
+    
+    doc.build() va sacando flowables del inicio de la lista; mantener solo unos pocos
+    por delante evita tener en memoria los flowables de todas las evaluaciones a la vez.
+    """
+    
+    def __init__(self, bloques, minimo=50):
+        super().__init__()
+        self.bloques = iter(bloques)
+        self.minimo = minimo
+    
+    def _rellenar(self):
+        while self.bloques is not None and list.__len__(self) < self.minimo:
+            bloque = next(self.bloques, None)
+            if bloque is None:
+                self.bloques = None
+            else:
+                self.extend(bloque)
+    
+    def __len__(self):
+        self._rellenar()
+        return list.__len__(self)
+    
+    def __getitem__(self, indice):
+        self._rellenar()
+        return list.__getitem__(self, indice)